@@ -1,66 +1,325 @@
 #app.py
-from flask import Flask, request, render_template, redirect, url_for, send_from_directory, jsonify
+from flask import Flask, request, render_template, redirect, url_for, send_from_directory, jsonify, Response, stream_with_context
 import os
-import shutil
-from main import extract_question_text, process_student_pdf  # Make sure main is correctly imported
+import json
+import time
+import uuid
+import threading
+import csv
+import io
+from dotenv import load_dotenv
 
-UPLOAD_FOLDER = "uploads"
-QUESTION_FOLDER = os.path.join(UPLOAD_FOLDER, "question_data")
-STUDENT_FOLDER = os.path.join(UPLOAD_FOLDER, "students_data")
-OUTPUT_FOLDER = "outputs"
+load_dotenv()  # Before any module reads its settings from the environment
+
+from main import extract_question_text, process_student_pdfs, OUTPUT_FOLDER  # Make sure main is correctly imported
+from utils.jobs import JobStore, JobRunner, QUEUED, FINISHED_STATES
+from utils.cache import get_cache, file_sha256
+from utils.llm_client import get_llm_client
+from utils.metrics import registry, span
+from utils.sessions import SessionStore, SessionError
+from utils.uploads import UploadBatches, UploadError
+from utils.question_index import get_question_index, normalize_question_number
+from utils.answer_store import answer_store_for
+from utils.latex_generator import convert_question_to_latex
+from utils.scheduler import AdmissionError, admit, flow_weight, llm_backlog_seconds, scheduling_context, BULK, INTERACTIVE
+from utils.concurrency import stage_stats
+from utils.storage import StorageSweeper, over_quota, directory_size, session_quota_bytes
+
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "storage")  # Shared by every worker and host serving the app
+SESSION_COOKIE = "exam_session"
 
-os.makedirs(QUESTION_FOLDER, exist_ok=True)
-os.makedirs(STUDENT_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 os.makedirs("tmp", exist_ok=True)  # Ensure the tmp directory used by ocr_openai.py exists
 
 app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
-question_text = None  # OCRed question paper text
+SSE_POLL_INTERVAL = 0.5  # Seconds between job event polls while streaming /jobs/<id>/events
+# Seconds a browser may reuse a served PDF before revalidating it (PDF_MAX_AGE env); revalidation is a
+# conditional request answered with 304 Not Modified while the file is unchanged
+DEFAULT_PDF_MAX_AGE = 300
+
+# Per-exam question text, uploads and outputs; sessions with unfinished jobs are never expired
+session_store = SessionStore(STORAGE_ROOT, busy_sessions=lambda: job_store.active_session_ids())
+_batch_stores = {}  # session ID -> UploadBatches, so partial-upload hashes survive between chunk requests
+_batch_stores_guard = threading.Lock()
+_question_locks = {}  # question paper path -> lock, so per-file jobs of one batch OCR it only once
+_question_locks_guard = threading.Lock()
+
+
+def _upload_batches(session_id):
+    with _batch_stores_guard:
+        if session_id not in _batch_stores:
+            _batch_stores[session_id] = UploadBatches(session_store.students_dir(session_id))
+        return _batch_stores[session_id]
+
+
+def _requested_session_id():
+    # URL (/sessions/<id>/...) first, then the X-Session-ID header, ?session_id=, a form field and the cookie
+    session_id = (request.view_args or {}).get("session_id") or request.headers.get("X-Session-ID") \
+        or request.args.get("session_id")
+    if not session_id and request.mimetype in ("multipart/form-data", "application/x-www-form-urlencoded"):
+        session_id = request.form.get("session_id")
+    return session_id or request.cookies.get(SESSION_COOKIE)
+
+
+def _current_session(create=False):
+    """
+    The exam session this request belongs to. With create=True a missing or expired session
+    is replaced by a new one (the browser flow); otherwise a SessionError is raised.
+    """
+    session_id = _requested_session_id()
+    if session_id and session_store.exists(session_id):
+        return session_store.get(session_id)
+    if not create:
+        if session_id:
+            raise SessionError("Unknown session.")
+        raise SessionError("No exam session; create one with POST /sessions.", status=400)
+    return session_store.create()
+
+
+def _with_session_cookie(response, session):
+    if request.cookies.get(SESSION_COOKIE) != session["session_id"]:
+        response.set_cookie(SESSION_COOKIE, session["session_id"], max_age=session_store.ttl, samesite="Lax")
+    return response
+
+
+def _check_storage_quota(session_id):
+    # Refuses new uploads once a session's uploads and outputs exceed SESSION_MAX_BYTES (see utils/storage.py)
+    exceeded = over_quota(session_store.session_dir(session_id))
+    if exceeded:
+        size, limit = exceeded
+        raise UploadError(f"Session storage quota exceeded ({size / 1024 ** 2:.0f} MB of {limit / 1024 ** 2:.0f} MB). "
+                          "Remove old uploads or start a new session.", status=413)
+
+
+def _send_output(directory, filename, **kwargs):
+    # Conditional responses (ETag/Last-Modified, 304) and byte ranges (206), so the PDF viewer in the
+    # preview iframe fetches only the pages it shows and reloads nothing that has not changed
+    response = send_from_directory(directory, filename, conditional=True,
+                                   max_age=int(os.getenv("PDF_MAX_AGE", DEFAULT_PDF_MAX_AGE)), **kwargs)
+    response.cache_control.public = False
+    response.cache_control.private = True  # Session files must never be kept by shared proxies
+    return response
+
+
+def _output_dirs():
+    # Every folder the storage sweeper compacts: each session's outputs and the shared CLI outputs folder
+    return [session_store.outputs_dir(session_id) for session_id in session_store.session_ids()] + [OUTPUT_FOLDER]
+
+
+def _job_lane(student_count):
+    # ?priority=interactive|bulk wins; otherwise a single script (or only a question paper) is a preview,
+    # and work of unknown size (student_count None) is bulk
+    requested = request.args.get("priority") or request.form.get("priority")
+    if requested in (INTERACTIVE, BULK):
+        return requested
+    return INTERACTIVE if student_count is not None and student_count <= 1 else BULK
+
+
+def _session_weight(session):
+    return flow_weight(session.get("name"), session["session_id"])
+
+
+def _job_schedule(job):
+    # JobRunner dispatch order: one flow per exam session, weighted by SCHEDULER_WEIGHTS (see utils/scheduler.py)
+    payload = job["payload"]
+    session_id = payload.get("session_id")
+    session = session_store.get(session_id) if session_id and session_store.exists(session_id) else {"session_id": session_id}
+    return session_id, _session_weight(session), payload.get("lane", BULK)
+
+
+def _admit(student_count, lane):
+    # Refuses bulk work with a 429 once the scripts already queued would outlast ADMISSION_MAX_WAIT
+    admit(job_store.pending_scripts(BULK), student_count, lane)
+
+
+def _save_question_paper(session_id, q_file):
+    # Every question paper upload gets its own folder; earlier papers are never overwritten
+    q_path = os.path.join(session_store.question_dir(session_id), uuid.uuid4().hex, os.path.basename(q_file.filename))
+    os.makedirs(os.path.dirname(q_path), exist_ok=True)
+    with span("upload_save") as save_span:
+        q_file.save(q_path)
+        save_span.set(bytes=os.path.getsize(q_path))
+    return q_path
+
+
+def _session_question_text(session_id, question_pdf):
+    """OCRs a session's question paper once and stores the text on the session for every worker to reuse."""
+    with _question_locks_guard:
+        question_lock = _question_locks.setdefault(question_pdf, threading.Lock())
+    with question_lock:  # Later jobs of the same batch wait here, then reuse the stored text
+        session = session_store.get(session_id)
+        if session["question_pdf"] == question_pdf and session["question_text"]:
+            return session["question_text"]
+        text = extract_question_text(question_pdf)
+        if text:
+            session_store.update(session_id, question_pdf=question_pdf, question_sha256=file_sha256(question_pdf),
+                                 question_text=text)
+        return text
+
+
+def _build_batch_response(relative_paths, batch_results):
+    """
+    Turns process_student_pdfs results into the JSON body the frontend expects.
+    Returns (body, ok) where ok is False if no script produced any output.
+    """
+    results = []
+    for relative_path, batch_result in zip(relative_paths, batch_results):
+        if not batch_result["pdf_filename"]:
+            print(f"Warning: PDF compilation failed for {relative_path}. Extracted text still available.")
+        results.append({
+            "pdf_filename": batch_result["pdf_filename"],
+            "extracted_text": batch_result["extracted_text"],
+            "original_student_pdf": relative_path,  # Send the relative path
+            "error": batch_result["error"],
+        })
+
+    if not any(r["pdf_filename"] or r["extracted_text"] for r in results):
+        return {"error": "No valid output generated. Please check files and try again.", "results": results}, False
+
+    # The frontend previews a single script, so the first successful result is also
+    # returned at the top level; the full list is available under "results".
+    first = next((r for r in results if r["pdf_filename"]), results[0])
+    return {
+        "pdf_filename": first["pdf_filename"],
+        "extracted_text": first["extracted_text"],
+        "original_student_pdf": first["original_student_pdf"],
+        "results": results
+    }, True
+
+
+def _run_grading_job(job, report):
+    # Background handler for uploads: question paper OCR (if uploaded) followed by the student batch
+    payload = job["payload"]
+    session_id = payload["session_id"]
+
+    job_question_text = payload.get("question_text")
+    if payload.get("question_pdf") and not payload.get("recompile_only"):
+        report("question", "started")
+        job_question_text = _session_question_text(session_id, payload["question_pdf"])
+        if not job_question_text:
+            report("question", "failed")
+            raise RuntimeError("Failed to extract text from question paper.")
+        report("question", "finished")
+    job_question_text = job_question_text or session_store.get(session_id)["question_text"]
+
+    if not payload["student_pdfs"]:
+        return {"message": "Question paper processed.", "results": []}
+
+    students_dir = session_store.students_dir(session_id)
+
+    def progress(student_pdf, stage, status, message=None):
+        report(stage, status, student=os.path.relpath(student_pdf, students_dir), message=message)
+
+    batch_results = process_student_pdfs(
+        payload["student_pdfs"],
+        question_text=job_question_text,
+        output_dir=session_store.outputs_dir(session_id),
+        progress=progress,
+        recompile_only=payload.get("recompile_only", False)
+    )
+    body, ok = _build_batch_response(payload["relative_paths"], batch_results)
+    if not ok:
+        raise RuntimeError(body["error"])
+    return body
+
+
+job_store = JobStore()
+job_runner = None  # Created per process by start_worker
+storage_sweeper = None
+_worker_lock = threading.Lock()
+
+
+def start_worker(warm_up=False):
+    """
+    Per-process start-up: creates this process's job runner and picks up jobs interrupted by a
+    restart (or a dead worker). With warm_up, the shared LLM client and artifact cache are also
+    created now instead of on the first request. Runs at import, or from gunicorn's post_fork
+    hook when the app is preloaded into the master (see gunicorn.conf.py), since threads,
+    sockets and the runner's owner ID must not be shared across a fork. The storage sweeper
+    (retention of tmp/ and compaction of finished scripts) is started here too.
+    """
+    global job_runner, storage_sweeper
+    with _worker_lock:
+        if job_runner is None:
+            if warm_up:
+                get_llm_client()
+                get_cache()
+            job_runner = JobRunner(job_store, _run_grading_job, schedule=_job_schedule)
+            job_runner.resume_unfinished()
+            storage_sweeper = StorageSweeper(_output_dirs).start()
+    return job_runner
+
+
+if os.getenv("DEFER_WORKER_START", "0") != "1":
+    start_worker()
+
+
+@app.errorhandler(SessionError)
+def session_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+@app.errorhandler(AdmissionError)
+def admission_error(e):
+    return jsonify({"error": str(e), "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    body = {"error": str(e)}
+    if e.received is not None:
+        body["received"] = e.received
+    return jsonify(body), e.status
+
+
+@app.route("/sessions", methods=["POST"])
+def create_session():
+    # Starts a new exam session; the browser keeps using it through the session cookie
+    name = (request.get_json(silent=True) or {}).get("name") or request.form.get("name")
+    session = session_store.create(name=name)
+    return _with_session_cookie(jsonify(session), session), 201
+
+
+@app.route("/sessions/<session_id>")
+def session_info(session_id):
+    session = _current_session()
+    return jsonify(session)
 
 
 @app.route("/download/<filename>")
-def download(filename):
-    # This route serves files for download (generated PDFs from OUTPUT_FOLDER)
-    return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
+@app.route("/sessions/<session_id>/download/<filename>")
+def download(filename, session_id=None):
+    # This route serves files for download (generated PDFs from the session's outputs folder)
+    session = _current_session()
+    return _send_output(session_store.outputs_dir(session["session_id"]), filename, as_attachment=True)
 
 
 @app.route('/preview/<path:filename>')  # Use <path:filename> to handle subdirectories
-def preview_pdf(filename):
+@app.route('/sessions/<session_id>/preview/<path:filename>')
+def preview_pdf(filename, session_id=None):
     # This route serves files for iframe preview
+    session = _current_session()
     # Check if the filename belongs to a generated PDF (ends with _answers.pdf)
     if filename.endswith("_answers.pdf"):
-        return send_from_directory(OUTPUT_FOLDER, filename)
+        return _send_output(session_store.outputs_dir(session["session_id"]), filename)
     else:
         # Otherwise, assume it's an original student PDF.
-        # The filename here should be the path relative to STUDENT_FOLDER
-        return send_from_directory(STUDENT_FOLDER, filename)
+        # The filename here should be the path relative to the session's students folder
+        return _send_output(session_store.students_dir(session["session_id"]), filename)
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    global question_text
+    session = _current_session(create=True)
+    session_id = session["session_id"]
 
     if request.method == "POST":
-        last_processed_pdf_filename = None  # Filename of the generated PDF (e.g., 'G24AI1006_Abhinav Kumar Ranjan_Social Network Analysis (Code CSL 7390)_Major Exam April 2025_answers.pdf')
-        last_processed_extracted_text = None
-        original_student_relative_path_for_preview = None  # Store path relative to STUDENT_FOLDER for preview (e.g., 'MyFolder/student.pdf')
-
+        _check_storage_quota(session_id)
+        question_text = session["question_text"]
         # Handle question paper upload
         if "question_paper" in request.files:
-            q_file = request.files["question_paper"]
-            # Clear old question papers
-            for f in os.listdir(QUESTION_FOLDER):
-                file_path = os.path.join(QUESTION_FOLDER, f)
-                if os.path.isfile(file_path) and file_path.lower().endswith('.pdf'):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        print(f"Error removing old question file {file_path}: {e}")
-            q_path = os.path.join(QUESTION_FOLDER, q_file.filename)
-            q_file.save(q_path)
-            question_text = extract_question_text(q_path)
+            q_path = _save_question_paper(session_id, request.files["question_paper"])
+            question_text = _session_question_text(session_id, q_path)
             if not question_text:
                 return jsonify({"error": "Failed to extract text from question paper."}), 500
 
@@ -70,75 +329,382 @@ def index():
             if not student_files:
                 return jsonify({"error": "No student PDFs provided."}), 400
 
-            # Clear *only PDF files* from the student data folder (and their subdirectories)
-            for root, dirs, files in os.walk(STUDENT_FOLDER, topdown=False):
-                for name in files:
-                    file_path = os.path.join(root, name)
-                    if file_path.lower().endswith('.pdf'):
-                        try:
-                            os.remove(file_path)
-                        except Exception as e:
-                            print(f"Error removing old student file {file_path}: {e}")
-                for name in dirs:
-                    dir_path = os.path.join(root, name)
-                    if not os.listdir(dir_path):  # Only remove empty directories
-                        try:
-                            os.rmdir(dir_path)
-                        except Exception as e:
-                            print(f"Error removing empty directory {dir_path}: {e}")
-
+            # Each upload goes to its own batch folder; old batches expire instead of being wiped here
+            upload_batches = _upload_batches(session_id)
+            batch_id = upload_batches.create_batch({"question_text": question_text})
+            saved_pdf_paths = []
+            relative_paths = []
             for s_file in student_files:
                 # s_file.filename will contain the relative path from the folder chosen by webkitdirectory
                 # e.g., 'MyAnswers/student1.pdf' or just 'student2.pdf' if files were selected directly
+                with span("upload_save") as save_span:
+                    full_save_path, _ = upload_batches.save_file(batch_id, s_file.filename, s_file)
+                    save_span.set(bytes=os.path.getsize(full_save_path))
+                saved_pdf_paths.append(full_save_path)
+                # Store the path relative to the session's students folder for the frontend preview
+                relative_paths.append(os.path.relpath(full_save_path, upload_batches.root))
+
+            # Process every uploaded script concurrently; one result entry per student
+            with scheduling_context(session_id, _session_weight(session), _job_lane(len(saved_pdf_paths))):
+                batch_results = process_student_pdfs(saved_pdf_paths, question_text=question_text,
+                                                     output_dir=session_store.outputs_dir(session_id))
 
-                # Construct the full path where the file will be saved
-                full_save_path = os.path.join(STUDENT_FOLDER, s_file.filename)
-
-                # Ensure the directory structure exists before saving
-                os.makedirs(os.path.dirname(full_save_path), exist_ok=True)
-
-                s_file.save(full_save_path)
-
-                # Store the path relative to STUDENT_FOLDER for the frontend preview
-                original_student_relative_path_for_preview = s_file.filename
-
-                pdf_filename, extracted_latex = process_student_pdf(
-                    # **** THIS IS THE LINE TO CHANGE ****
-                    full_save_path,  # Pass the relative path as the first positional argument
-                    question_text=question_text,
-                    output_dir=OUTPUT_FOLDER
-                )
-
-                if pdf_filename:
-                    last_processed_pdf_filename = pdf_filename
-                    last_processed_extracted_text = extracted_latex
-                else:
-                    print(f"Warning: PDF compilation failed for {s_file.filename}. Extracted text still available.")
-                    last_processed_extracted_text = extracted_latex  # Keep the extracted text even if PDF fails
-
-                # IMPORTANT: We are processing one PDF at a time in the loop.
-                # The frontend's current design assumes one result per POST.
-                # If you upload multiple student PDFs, only the LAST one processed
-                # will have its data sent back. You might need to change the frontend
-                # to handle multiple results if that's the desired behavior.
-                break  # <-- Keeping this `break` as per your existing code structure
-                # This means only the first student PDF in the list will be processed fully.
-                # Remove this 'break' if you intend to process all and return a list of results.
-
-            if last_processed_pdf_filename or last_processed_extracted_text:
-                return jsonify({
-                    "pdf_filename": last_processed_pdf_filename,
-                    "extracted_text": last_processed_extracted_text,
-                    "original_student_pdf": original_student_relative_path_for_preview  # Send the relative path
-                })
-            else:
-                return jsonify({"error": "No valid output generated. Please check files and try again."}), 500
+            body, ok = _build_batch_response(relative_paths, batch_results)
+            return _with_session_cookie(jsonify(body), session), (200 if ok else 500)
         elif not question_text:
             return jsonify({"error": "Please upload the question paper first."}), 400
 
         return jsonify({"message": "No files processed or no output generated."}), 200
 
-    return render_template("index.html")
+    return _with_session_cookie(app.make_response(render_template("index.html")), session)
+
+
+@app.route("/jobs", methods=["POST"])
+@app.route("/sessions/<session_id>/jobs", methods=["POST"])
+def create_job(session_id=None):
+    """
+    Non-blocking upload: saves the question paper and/or student PDFs into the session's storage,
+    queues the work on the background runner and returns the job ID straight away.
+    """
+    session = _current_session()
+    session_id = session["session_id"]
+    job_id = uuid.uuid4().hex
+    _check_storage_quota(session_id)
+    student_files = [s_file for s_file in request.files.getlist("student_pdfs") if s_file.filename]
+    lane = _job_lane(len(student_files))
+    _admit(len(student_files), lane)
+    payload = {"session_id": session_id, "question_pdf": None, "question_text": session["question_text"],
+               "student_pdfs": [], "relative_paths": [], "lane": lane}
+
+    q_file = request.files.get("question_paper")
+    if q_file and q_file.filename:
+        payload["question_pdf"] = _save_question_paper(session_id, q_file)
+    elif not session["question_text"]:
+        return jsonify({"error": "Please upload the question paper first."}), 400
+
+    upload_batches = _upload_batches(session_id)
+    if student_files:
+        # Each job gets its own batch folder, so concurrent uploads never overwrite each other
+        upload_batches.create_batch({"question_text": session["question_text"]}, batch_id=job_id)
+    for s_file in student_files:
+        with span("upload_save") as save_span:
+            full_save_path, _ = upload_batches.save_file(job_id, s_file.filename, s_file)
+            save_span.set(bytes=os.path.getsize(full_save_path))
+        payload["student_pdfs"].append(full_save_path)
+        payload["relative_paths"].append(os.path.relpath(full_save_path, upload_batches.root))
+
+    if not payload["question_pdf"] and not payload["student_pdfs"]:
+        return jsonify({"error": "No files provided."}), 400
+
+    return jsonify(_submit_job(payload, job_id=job_id)), 202
+
+
+def _submit_job(payload, job_id=None):
+    job_id = job_store.create_job("grading", payload, job_id=job_id)
+    job_runner.submit(job_id)
+    return {
+        "job_id": job_id,
+        "status": QUEUED,
+        "status_url": url_for("job_status", job_id=job_id),
+        "events_url": url_for("job_events", job_id=job_id)
+    }
+
+
+def _parse_content_range(header, content_length):
+    """
+    Parses "bytes <start>-<end>/<total>" into (offset, total). Without the header the body
+    is taken to be the whole file.
+    """
+    if not header:
+        return 0, content_length or 0
+    try:
+        unit, _, spec = header.partition(" ")
+        byte_range, _, total = spec.partition("/")
+        start = byte_range.split("-")[0]
+        if unit != "bytes" or not start or not total or total == "*":
+            raise ValueError
+        return int(start), int(total)
+    except ValueError:
+        raise UploadError("Invalid Content-Range header.")
+
+
+@app.route("/batches", methods=["POST"])
+@app.route("/sessions/<session_id>/batches", methods=["POST"])
+def create_batch(session_id=None):
+    """
+    Starts a chunked upload batch. The question paper (optional once the session has one) and the
+    number of scripts to follow (file_count, which picks the scheduling lane) come with this request;
+    student scripts are then streamed with PUT /batches/<id>/files/<path>.
+    """
+    session = _current_session()
+    session_id = session["session_id"]
+    _check_storage_quota(session_id)
+    # The client announces how many scripts it will stream (file_count); a one-script batch is a preview.
+    # Without a count the batch is bulk work unless ?priority=interactive asks otherwise.
+    try:
+        file_count = int(request.form.get("file_count") or request.args.get("file_count") or 0)
+    except ValueError:
+        return jsonify({"error": "file_count must be a number."}), 400
+    lane = _job_lane(file_count or None)
+    _admit(max(file_count, 1), lane)  # Refuses bulk work once the queue is already full
+    batch_id = uuid.uuid4().hex
+    metadata = {"question_pdf": None, "question_text": session["question_text"], "lane": lane,
+                "file_count": file_count or None}
+    q_file = request.files.get("question_paper")
+    if q_file and q_file.filename:
+        metadata["question_pdf"] = _save_question_paper(session_id, q_file)
+    elif not session["question_text"]:
+        return jsonify({"error": "Please upload the question paper first."}), 400
+
+    _upload_batches(session_id).create_batch(metadata, batch_id=batch_id)
+    return jsonify({"batch_id": batch_id, "session_id": session_id,
+                    "batch_url": url_for("batch_status", batch_id=batch_id)}), 201
+
+
+@app.route("/batches/<batch_id>")
+@app.route("/sessions/<session_id>/batches/<batch_id>")
+def batch_status(batch_id, session_id=None):
+    # Every file received so far with its SHA-256 and the status of the job processing it
+    session = _current_session()
+    manifest = _upload_batches(session["session_id"]).manifest(batch_id)
+    for entry in manifest["files"].values():
+        job = job_store.get_job(entry["job_id"]) if entry.get("job_id") else None
+        if job is not None:
+            entry["status"] = job["status"]
+            entry["result"] = job["result"]
+            entry["error"] = job["error"]
+    return jsonify({"batch_id": batch_id, "files": manifest["files"]})
+
+
+@app.route("/batches/<batch_id>/files/<path:relative_path>", methods=["GET"])
+@app.route("/sessions/<session_id>/batches/<batch_id>/files/<path:relative_path>", methods=["GET"])
+def upload_offset(batch_id, relative_path, session_id=None):
+    # Lets a client resume an interrupted upload from the number of bytes already on disk
+    upload_batches = _upload_batches(_current_session()["session_id"])
+    if not upload_batches.exists(batch_id):
+        return jsonify({"error": "Unknown batch."}), 404
+    return jsonify({"received": upload_batches.received_bytes(batch_id, relative_path)})
+
+
+@app.route("/batches/<batch_id>/files/<path:relative_path>", methods=["PUT"])
+@app.route("/sessions/<session_id>/batches/<batch_id>/files/<path:relative_path>", methods=["PUT"])
+def upload_chunk(batch_id, relative_path, session_id=None):
+    """
+    Streams one chunk of a student script to disk (raw request body, "Content-Range: bytes
+    start-end/total"). When the last chunk lands the file is queued for processing straight away.
+    """
+    session = _current_session()
+    upload_batches = _upload_batches(session["session_id"])
+    offset, total = _parse_content_range(request.headers.get("Content-Range"), request.content_length)
+    if offset == 0:
+        _check_storage_quota(session["session_id"])  # Once per file, not on every chunk
+    with span("upload_save", bytes=request.content_length or 0):
+        received, sha256 = upload_batches.write_chunk(batch_id, relative_path, request.stream, offset, total)
+    if sha256 is None:
+        return jsonify({"received": received, "complete": False})
+
+    manifest = upload_batches.manifest(batch_id)
+    metadata = manifest["metadata"]
+    lane = metadata.get("lane", BULK)
+    if metadata.get("file_count") and len(manifest["files"]) > metadata["file_count"]:
+        lane = BULK  # More scripts than announced: no longer a preview
+    full_save_path = upload_batches.file_path(batch_id, relative_path)
+    job = _submit_job({
+        "session_id": session["session_id"],
+        "question_pdf": metadata.get("question_pdf"),
+        "question_text": metadata.get("question_text"),
+        "student_pdfs": [full_save_path],
+        "relative_paths": [os.path.relpath(full_save_path, upload_batches.root)],
+        # One job per file, so the lane is the batch's (chosen from its file count), not this job's single script
+        "lane": lane
+    })
+    upload_batches.update_file(batch_id, os.path.relpath(full_save_path, upload_batches.batch_dir(batch_id)),
+                               job_id=job["job_id"])
+    return jsonify({"received": received, "complete": True, "sha256": sha256, **job})
+
+
+def _session_job(job_id):
+    # A job is only visible to the session that owns it; to any other session it is an unknown job
+    session = _current_session()
+    job = job_store.get_job(job_id)
+    if job is None or job["payload"].get("session_id") != session["session_id"]:
+        return None
+    return job
+
+
+@app.route("/jobs/<job_id>")
+@app.route("/sessions/<session_id>/jobs/<job_id>")
+def job_status(job_id, session_id=None):
+    job = _session_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job."}), 404
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job_store.stage_progress(job_id),
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    })
+
+
+@app.route("/jobs/<job_id>/resume", methods=["POST"])
+@app.route("/jobs/<job_id>/recompile", methods=["POST"])
+@app.route("/sessions/<session_id>/jobs/<job_id>/resume", methods=["POST"])
+@app.route("/sessions/<session_id>/jobs/<job_id>/recompile", methods=["POST"])
+def rerun_job(job_id, session_id=None):
+    """
+    Runs a finished job's scripts again as a new job. /resume continues every script from its
+    first incomplete checkpointed stage (finished stages are not redone); /recompile only
+    re-runs the compile step from the .tex files, e.g. after they were fixed by hand.
+    """
+    job = _session_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job."}), 404
+    if job["status"] not in FINISHED_STATES:
+        return jsonify({"error": "Job is still running."}), 409
+    payload = dict(job["payload"], recompile_only=request.path.endswith("/recompile"))
+    _admit(len(payload["student_pdfs"]), payload.get("lane", BULK))  # Reruns go through admission like uploads
+    return jsonify({"resumed_from": job_id, **_submit_job(payload)}), 202
+
+
+@app.route("/jobs/<job_id>/events")
+@app.route("/sessions/<session_id>/jobs/<job_id>/events")
+def job_events(job_id, session_id=None):
+    # Server-Sent Events stream of per-stage progress; resumes from Last-Event-ID on reconnect
+    if _session_job(job_id) is None:
+        return jsonify({"error": "Unknown job."}), 404
+    try:
+        last_event_id = int(request.headers.get("Last-Event-ID", 0))
+    except ValueError:
+        last_event_id = 0
+
+    def stream():
+        nonlocal last_event_id
+        while True:
+            for event in job_store.events_since(job_id, last_event_id):
+                last_event_id = event["id"]
+                yield f"id: {event['id']}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            job = job_store.get_job(job_id)
+            if job["status"] in FINISHED_STATES and not job_store.events_since(job_id, last_event_id):
+                yield f"event: done\ndata: {json.dumps({'status': job['status'], 'error': job['error']})}\n\n"
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/questions")
+@app.route("/sessions/<session_id>/questions")
+def questions(session_id=None):
+    # The session's question paper index (numbers, subparts, marks) with how many scripts answer each part
+    session = _current_session()
+    index = get_question_index(session["question_text"] or "")
+    answered = answer_store_for(session_store.outputs_dir(session["session_id"])).questions()
+    listed = []
+    for question in index["questions"]:
+        listed.append(dict(question, answered=answered.get((question["number"], ""), 0),
+                           subparts=[dict(s, answered=answered.get((question["number"], s["label"]), 0))
+                                     for s in question["subparts"]]))
+    known = {(q["number"], "") for q in index["questions"]} | \
+            {(q["number"], s["label"]) for q in index["questions"] for s in q["subparts"]}
+    # Answers recorded under numbers the paper's index does not list (e.g. an unparsed paper)
+    unindexed = [{"number": number, "subpart": subpart, "answered": count}
+                 for (number, subpart), count in sorted(answered.items()) if (number, subpart) not in known]
+    return jsonify({"questions": listed, "total_marks": index["total_marks"], "unindexed": unindexed})
+
+
+@app.route("/questions/<question_number>/answers")
+@app.route("/sessions/<session_id>/questions/<question_number>/answers")
+def question_answers(question_number, session_id=None):
+    """
+    Every student's answer to one question, from the per-question records (no extraction is re-run).
+    ?subpart= narrows to one subpart, ?q= keeps answers containing the text, ?format= is json (default),
+    tex (one LaTeX document for the question) or csv.
+    """
+    session = _current_session()
+    number = normalize_question_number(question_number)
+    subpart = request.args.get("subpart")
+    store = answer_store_for(session_store.outputs_dir(session["session_id"]))
+    records = store.question_answers(number, subpart=subpart.lower() if subpart else None, search=request.args.get("q"))
+    output_format = request.args.get("format", "json").lower()
+    if output_format == "tex":
+        question = next((q for q in get_question_index(session["question_text"] or "")["questions"]
+                         if q["number"] == number), None)
+        latex = convert_question_to_latex(number, records, question["text"] if question else None)
+        return Response(latex, mimetype="application/x-tex",
+                        headers={"Content-Disposition": f'attachment; filename="question_{number}_answers.tex"'})
+    if output_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["student", "question_number", "subpart", "latex"])
+        for record in records:
+            writer.writerow([record["student"], record["question_number"], record["subpart"], record["latex"]])
+        return Response(buffer.getvalue(), mimetype="text/csv",
+                        headers={"Content-Disposition": f'attachment; filename="question_{number}_answers.csv"'})
+    return jsonify({"question_number": number, "answers": records})
+
+
+@app.route("/answers/search")
+@app.route("/sessions/<session_id>/answers/search")
+def search_answers(session_id=None):
+    # Answers containing ?q= across every question and student of the session
+    session = _current_session()
+    text = request.args.get("q", "").strip()
+    if not text:
+        return jsonify({"error": "Missing ?q= search text."}), 400
+    store = answer_store_for(session_store.outputs_dir(session["session_id"]))
+    return jsonify({"q": text, "answers": store.search(text)})
+
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus scrape endpoint: per-stage duration histograms, bytes/pages/token/retry counters and cache usage
+    cache = get_cache().stats()
+    lines = [registry.render().rstrip("\n"),
+             "# TYPE cache_size_bytes gauge", f"cache_size_bytes {cache['size_bytes']}",
+             "# TYPE cache_requests_total counter"]
+    for namespace, counters in sorted(cache["namespaces"].items()):
+        for outcome, value in sorted(counters.items()):
+            lines.append(f'cache_requests_total{{namespace="{namespace}",outcome="{outcome}"}} {value}')
+    queues = dict(stage_stats(), jobs=job_runner.queue_stats() if job_runner else {"queued": {}})
+    lines.append("# TYPE scheduler_queue_depth gauge")
+    for queue, stats in sorted(queues.items()):
+        for lane, depth in sorted(stats["queued"].items()):
+            lines.append(f'scheduler_queue_depth{{queue="{queue}",lane="{lane}"}} {depth}')
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/storage/stats")
+def storage_stats():
+    # Disk used by the current session against its quota, and the result of this worker's last storage sweep
+    session = _current_session()
+    return jsonify({
+        "session_bytes": directory_size(session_store.session_dir(session["session_id"])),
+        "session_max_bytes": session_quota_bytes(),
+        "last_sweep": storage_sweeper.last_sweep if storage_sweeper else None,
+    })
+
+
+@app.route("/scheduler/stats")
+def scheduler_stats():
+    # Queue depth and wait times of the job queue and every pipeline stage in this worker, plus the shared backlog
+    pending = job_store.pending_scripts()
+    bulk_pending = job_store.pending_scripts(BULK)
+    return jsonify({
+        "jobs": job_runner.queue_stats() if job_runner else None,
+        "stages": stage_stats(),
+        "pending_scripts": {INTERACTIVE: pending - bulk_pending, BULK: bulk_pending},
+        "llm_backlog_seconds": round(llm_backlog_seconds(bulk_pending), 1),
+    })
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    # Hit/miss counters per namespace ("pages", "llm", "pdf") and current cache size
+    return jsonify(get_cache().stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+#batch_marker.py
+"""
+Headless batch marker: runs the pipeline over a directory tree of student scripts without the web UI.
+
+The question paper is OCRed once, every PDF under the scripts directory is processed with
+process_student_pdf on a worker pool, and a manifest with the status and per-stage timings of
+each script is written (and updated as scripts finish) next to the outputs. Scripts whose
+outputs are already up to date are skipped and the rest resume from their first incomplete
+checkpointed stage, so an interrupted overnight run can simply be started again.
+
+Examples:
+    python batch_marker.py question_paper.pdf scripts/ --output-dir marked/ --workers 8
+    python batch_marker.py question_paper.pdf scripts/ --output-dir marked/ --recompile
+    python batch_marker.py question_paper.pdf scripts/ --output-dir marked/ --from-stage raw
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+load_dotenv()  # Before any module reads its settings from the environment
+
+from main import extract_question_text, process_student_pdf, recompile_student_pdf
+from utils.cache import cache_key, file_sha256
+from utils.checkpoints import ScriptCheckpoint, STAGES
+from utils.concurrency import batch_concurrency
+from utils.ocr_openai import page_encoding_params, extraction_params, extraction_mode
+
+MANIFEST_NAME = "manifest.json"
+DONE_STATUSES = ("completed", "skipped")
+
+
+def find_scripts(scripts_dir, pattern=".pdf"):
+    """All PDFs under scripts_dir, as sorted paths relative to it."""
+    scripts = []
+    for root, _, files in os.walk(scripts_dir):
+        for name in files:
+            if name.lower().endswith(pattern):
+                scripts.append(os.path.relpath(os.path.join(root, name), scripts_dir))
+    return sorted(scripts)
+
+
+def script_fingerprint(script_path, question_sha256, question_text):
+    # Changes whenever the script, the question paper or any setting that affects the output changes
+    return cache_key(file_sha256(script_path), question_sha256, page_encoding_params(),
+                     extraction_params(question_text, extraction_mode()))
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+
+class Manifest:
+    """The run manifest, rewritten atomically every time a script finishes."""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    def set_script(self, relative_path, entry):
+        with self._lock:
+            self.data["scripts"][relative_path] = entry
+            self._write()
+
+    def finish(self, **fields):
+        with self._lock:
+            self.data.update(fields)
+            statuses = [entry["status"] for entry in self.data["scripts"].values()]
+            self.data["summary"] = {status: statuses.count(status) for status in ("completed", "failed", "skipped")}
+            self._write()
+
+    def _write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def is_up_to_date(entry, fingerprint, output_dir):
+    """A script is skipped if the last run completed it with the same inputs and its PDF is still there."""
+    if not entry or entry.get("status") not in DONE_STATUSES or entry.get("fingerprint") != fingerprint:
+        return False
+    return bool(entry.get("pdf")) and os.path.exists(os.path.join(output_dir, entry["pdf"]))
+
+
+def mark_script(script_path, relative_path, question_text, output_dir, fingerprint, recompile=False):
+    """Runs one script through process_student_pdf (or only recompiles it) and returns its manifest entry."""
+    script_output_dir = os.path.join(output_dir, os.path.dirname(relative_path))
+    stage_starts, timings = {}, {}
+
+    def progress(stage, status, message=None):
+        now = time.perf_counter()
+        if status == "started":
+            stage_starts[stage] = now
+        elif stage in stage_starts:
+            timings[stage] = round(now - stage_starts.pop(stage), 3)
+
+    start = time.perf_counter()
+    entry = {"fingerprint": fingerprint, "pdf": None, "tex": None, "error": None}
+    try:
+        if recompile:
+            pdf_filename, _ = recompile_student_pdf(script_path, script_output_dir, progress=progress)
+        else:
+            pdf_filename, _ = process_student_pdf(script_path, question_text, script_output_dir, progress=progress)
+        tex_filename = f"{os.path.splitext(os.path.basename(script_path))[0]}_answers.tex"
+        if os.path.exists(os.path.join(script_output_dir, tex_filename)):
+            entry["tex"] = os.path.relpath(os.path.join(script_output_dir, tex_filename), output_dir)
+        if pdf_filename:
+            entry["pdf"] = os.path.relpath(os.path.join(script_output_dir, pdf_filename), output_dir)
+            entry["status"] = "completed"
+        else:
+            entry["status"] = "failed"
+            entry["error"] = "PDF compilation failed."
+    except Exception as e:
+        print(f"❌ Error processing {relative_path}: {e}")
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+    timings["total"] = round(time.perf_counter() - start, 3)
+    entry["timings"] = timings
+    entry["finished_at"] = time.time()
+    return entry
+
+
+def run(question_paper, scripts_dir, output_dir, workers=None, manifest_path=None, force=False,
+        recompile=False, from_stage=None):
+    """
+    Marks every script under scripts_dir. Returns the manifest dict.
+
+    Args:
+        question_paper (str): Path to the question paper PDF.
+        scripts_dir (str): Directory searched recursively for student PDFs.
+        output_dir (str): Where the .tex/.pdf outputs go, mirroring the scripts' sub-folders.
+        workers (int, optional): Scripts processed in parallel. Defaults to BATCH_CONCURRENCY.
+        manifest_path (str, optional): Defaults to <output_dir>/manifest.json.
+        force (bool): Re-mark scripts even if their outputs are up to date.
+        recompile (bool): Only re-run the compile step from each script's existing .tex; the question
+                          paper is not OCRed and no model is called.
+        from_stage (str, optional): Discard checkpoints from this stage ("pages", "raw", "latex", "pdf")
+                                    onward, so it and every later stage run again for every script.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    previous = load_manifest(manifest_path).get("scripts", {})
+    workers = workers or batch_concurrency()
+    started_at = time.time()
+
+    question_text = None
+    if not recompile:
+        print(f"📝 Extracting question paper {question_paper}")
+        question_text = extract_question_text(question_paper)
+        if not question_text:
+            raise RuntimeError("Failed to extract text from question paper.")
+    question_sha256 = file_sha256(question_paper)
+
+    manifest = Manifest(manifest_path, {
+        "question_paper": os.path.abspath(question_paper),
+        "question_sha256": question_sha256,
+        "scripts_dir": os.path.abspath(scripts_dir),
+        "workers": workers,
+        "started_at": started_at,
+        "scripts": {},
+    })
+
+    pending = []
+    for relative_path in find_scripts(scripts_dir):
+        script_path = os.path.join(scripts_dir, relative_path)
+        entry = previous.get(relative_path)
+        if recompile:
+            # The LaTeX (and so the fingerprint of what produced it) is unchanged; only the PDF is rebuilt
+            pending.append((script_path, relative_path, (entry or {}).get("fingerprint")))
+            continue
+        fingerprint = script_fingerprint(script_path, question_sha256, question_text)
+        if from_stage:
+            student_name = os.path.splitext(os.path.basename(relative_path))[0]
+            ScriptCheckpoint(os.path.join(output_dir, os.path.dirname(relative_path)), student_name).invalidate(from_stage)
+        elif not force and is_up_to_date(entry, fingerprint, output_dir):
+            manifest.set_script(relative_path, {**entry, "status": "skipped"})
+            continue
+        pending.append((script_path, relative_path, fingerprint))
+
+    skipped = len(manifest.data["scripts"])
+    print(f"🗂️ {len(pending)} script(s) to mark, {skipped} up to date, {workers} worker(s)")
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending)), thread_name_prefix="marker") as executor:
+            futures = {
+                executor.submit(mark_script, script_path, relative_path, question_text, output_dir, fingerprint,
+                                recompile):
+                    relative_path
+                for script_path, relative_path, fingerprint in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                relative_path = futures[future]
+                entry = future.result()
+                manifest.set_script(relative_path, entry)
+                icon = "✅" if entry["status"] == "completed" else "❌"
+                print(f"{icon} [{done}/{len(pending)}] {relative_path} ({entry['timings']['total']}s)")
+
+    finished_at = time.time()
+    manifest.finish(finished_at=finished_at, wall_seconds=round(finished_at - started_at, 3))
+    return manifest.data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mark a directory of student scripts without the web UI.")
+    parser.add_argument("question_paper", help="Question paper PDF")
+    parser.add_argument("scripts_dir", help="Directory of student answer PDFs (searched recursively)")
+    parser.add_argument("--output-dir", default="outputs", help="Where generated .tex/.pdf files are written")
+    parser.add_argument("--workers", type=int, help="Scripts processed in parallel (default: BATCH_CONCURRENCY)")
+    parser.add_argument("--manifest", help="Manifest path (default: <output-dir>/manifest.json)")
+    parser.add_argument("--force", action="store_true", help="Re-mark scripts whose outputs are up to date")
+    parser.add_argument("--recompile", action="store_true",
+                        help="Only recompile the existing .tex files (e.g. after fixing them by hand)")
+    parser.add_argument("--from-stage", choices=STAGES,
+                        help="Redo this checkpointed stage and every later one for every script "
+                             "(set CACHE_ENABLED=0 as well to bypass the shared cache)")
+    args = parser.parse_args(argv)
+    if args.recompile and args.from_stage:
+        parser.error("--recompile and --from-stage cannot be combined")
+
+    if not os.path.isfile(args.question_paper):
+        parser.error(f"question paper not found: {args.question_paper}")
+    if not os.path.isdir(args.scripts_dir):
+        parser.error(f"scripts directory not found: {args.scripts_dir}")
+
+    manifest = run(args.question_paper, args.scripts_dir, args.output_dir, workers=args.workers,
+                   manifest_path=args.manifest, force=args.force, recompile=args.recompile,
+                   from_stage=args.from_stage)
+    summary = manifest["summary"]
+    print(f"🏁 Done in {manifest['wall_seconds']}s: {summary['completed']} completed, "
+          f"{summary['skipped']} skipped, {summary['failed']} failed")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#fake_llm_server
+"""
+Local stand-in for the OpenAI chat-completions endpoint, used by the benchmarks.
+
+Responses are either synthetic (a small LaTeX document, or JSON answers when the request
+asks for JSON) or replayed round-robin from recorded outputs (.tex / .json files).
+Latency is configurable, and the server counts requests, images and bytes received.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SYNTHETIC_LATEX = r"""\documentclass[12pt]{article}
+\usepackage[utf8]{inputenc}
+\usepackage{amsmath, amsfonts, amssymb}
+\usepackage{geometry}
+\geometry{margin=1in}
+\title{Answer Sheet}
+\date{}
+\begin{document}
+\maketitle
+\section*{Question 1}
+Synthetic answer text for benchmarking.
+\end{document}
+"""
+
+SYNTHETIC_ANSWERS = {
+    "answers": [
+        {"question_number": "1", "answer": "Synthetic answer text for benchmarking."},
+        {"question_number": "2", "subparts": {"a": {"answer": "Part a."}, "b": {"answer": "Part b."}}},
+    ]
+}
+
+
+class FakeLLMServer:
+    """
+    Threaded HTTP server answering POST /v1/chat/completions.
+
+    Each request sleeps latency + per_image_latency * images (+ uniform jitter) before replying.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=1.0, per_image_latency=0.0, jitter=0.0,
+                 replay_dir=None, completion_tokens=500):
+        self.latency = latency
+        self.per_image_latency = per_image_latency
+        self.jitter = jitter
+        self.completion_tokens = completion_tokens
+        self.stats = {"requests": 0, "images": 0, "bytes_received": 0}
+        self._stats_lock = threading.Lock()
+        self._replay = None
+        if replay_dir:
+            recorded = []
+            for name in sorted(os.listdir(replay_dir)):
+                if name.endswith((".tex", ".json")):
+                    with open(os.path.join(replay_dir, name), "r", encoding="utf-8") as f:
+                        recorded.append(f.read())
+            if not recorded:
+                raise ValueError(f"No .tex or .json recordings found in {replay_dir}")
+            self._replay = itertools.cycle(recorded)
+            self._replay_lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                request = json.loads(body or b"{}")
+                payload = json.dumps(server._respond(request, len(body))).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _respond(self, request, body_size):
+        images = 0
+        prompt_chars = 0
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                prompt_chars += len(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "image_url":
+                    images += 1
+                else:
+                    prompt_chars += len(part.get("text", ""))
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["images"] += images
+            self.stats["bytes_received"] += body_size
+
+        time.sleep(self.latency + self.per_image_latency * images + random.uniform(0, self.jitter))
+
+        if self._replay is not None:
+            with self._replay_lock:
+                content = next(self._replay)
+        elif (request.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps(SYNTHETIC_ANSWERS)
+        else:
+            content = SYNTHETIC_LATEX
+
+        prompt_tokens = prompt_chars // 4 + images * 1105
+        return {
+            "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens,
+                      "total_tokens": prompt_tokens + self.completion_tokens},
+        }
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {"requests": 0, "images": 0, "bytes_received": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible chat-completions server.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="Base seconds per request")
+    parser.add_argument("--per-image-latency", type=float, default=0.0, help="Extra seconds per image")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform random extra seconds")
+    parser.add_argument("--replay-dir", help="Replay recorded .tex/.json outputs from this folder")
+    args = parser.parse_args()
+
+    fake = FakeLLMServer(port=args.port, latency=args.latency, per_image_latency=args.per_image_latency,
+                         jitter=args.jitter, replay_dir=args.replay_dir)
+    print(f"Fake LLM server listening on {fake.base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        fake._httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
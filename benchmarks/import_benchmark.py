@@ -0,0 +1,97 @@
+#import_benchmark
+"""
+Cold import time of the web app and pipeline entry points.
+
+Each module is imported in a fresh interpreter (so nothing is cached in sys.modules) from an
+empty working directory, and the median and worst import times are reported together with the
+heavy dependencies that were loaded eagerly and the slowest modules from python -X importtime.
+Exits with status 1 if a median exceeds --budget, so it can guard worker start-up time in CI.
+
+Example:
+    python benchmarks/import_benchmark.py --runs 5 --budget 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Should only be imported on first use (or by gunicorn.conf.py before forking)
+HEAVY_MODULES = ("openai", "httpx", "numpy", "PIL", "pdf2image", "langchain", "langchain_core", "langchain_openai")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def import_once(module, work_dir, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", PROBE.format(module=module, heavy=HEAVY_MODULES)]
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.getenv("PYTHONPATH", ""),
+               DEFER_WORKER_START="1", METRICS_LOG="0", JOBS_DB=os.path.join(work_dir, "jobs.db"))
+    result = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_modules(importtime_output, module, top):
+    """(cumulative microseconds, name) of the slowest imports made directly by `module`, from -X importtime output."""
+    entries = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # importtime indents nested imports by two spaces
+        entries.append((depth, int(cumulative_us), name.strip()))
+    # A module is listed after everything it imported, so its direct imports are the depth-1 entries just before it
+    end = max((i for i, (depth, _, name) in enumerate(entries) if depth == 0 and name == module), default=None)
+    if end is None:
+        return []
+    rows = []
+    for depth, cumulative_us, name in reversed(entries[:end]):
+        if depth == 0:
+            break
+        if depth == 1:
+            rows.append((cumulative_us, name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the app and pipeline modules.")
+    parser.add_argument("--modules", default="app,main,batch_marker", help="Comma-separated modules to import")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list per module")
+    parser.add_argument("--budget", type=float, help="Fail if a module's median import time exceeds this (seconds)")
+    args = parser.parse_args()
+
+    over_budget = False
+    with tempfile.TemporaryDirectory(prefix="import-bench-") as work_dir:
+        for module in (m.strip() for m in args.modules.split(",") if m.strip()):
+            runs = [import_once(module, work_dir)[0] for _ in range(args.runs)]
+            timings = [run["seconds"] for run in runs]
+            median = statistics.median(timings)
+            heavy = runs[-1]["heavy"]
+            print(f"{module:<14} median={median * 1000:7.1f} ms  max={max(timings) * 1000:7.1f} ms  "
+                  f"eager heavy imports: {', '.join(heavy) or 'none'}")
+            _, importtime_output = import_once(module, work_dir, importtime=True)
+            for cumulative_us, name in slowest_modules(importtime_output, module, args.top):
+                print(f"    {cumulative_us / 1000:7.1f} ms  {name}")
+            if args.budget is not None and median > args.budget:
+                print(f"❌ {module} imports in {median:.2f}s, over the {args.budget:.2f}s budget")
+                over_budget = True
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+#latex_benchmark
+"""
+Micro-benchmark and round-trip check of the LaTeX answer-sheet generator.
+
+Checks escape_latex on randomly generated Unicode text first (every special character escaped,
+control characters dropped, everything else reproduced exactly), then times escape_latex and
+convert_to_latex on a synthetic batch of structured answers against the previous
+regex-based implementation kept below for comparison.
+
+Example:
+    python benchmarks/latex_benchmark.py --scripts 2000 --questions 12 --samples 20000
+"""
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from utils.latex_generator import (STANDARD_PREAMBLE_LINES, escape_latex, convert_to_latex,
+                                   write_latex_document)
+
+SPECIAL_CHARACTERS = "_&%$#{}~^\\"
+# Inverse of escape_latex, longest sequences first
+UNESCAPES = [(r"\textbackslash{}", "\\"), (r"\textasciitilde{}", "~"), (r"\^{}", "^")] + \
+            [("\\" + char, char) for char in "_&%$#{}"]
+# Sampled alphabet: LaTeX specials, ASCII, control characters, accents, maths symbols, CJK and emoji
+ALPHABET = (SPECIAL_CHARACTERS + "abcXYZ019 .,;:'\"!?()[]<>+-=*/|@`\n\t\r\x00\x07\x1b\x7f"
+            + "éüñçßøåÆ≤≥≠±×÷∞√∑∫αβγπΩ“”‘’–—…•°²½" + "中文答案日本語한국어" + "😀🧮✅")
+# Answer text for the timings: mostly prose, with some maths, specials and non-ASCII
+ANSWER_WORDS = ("the force on the block is F = ma so a = 2.5 m/s since friction is negligible and "
+                "50% of x_1 y^2 $v = u + at$ {net} \\Delta \u2264 \u00e9nergie #3 & ~").split(" ")
+
+
+def legacy_escape_latex(text):
+    # The previous implementation: a replacement dict built and a regex substitution run per call
+    replacements = {
+        "_": r"\_",
+        "&": r"\&",
+        "%": r"\%",
+        "$": r"\$",
+        "#": r"\#",
+        "{": r"\{",
+        "}": r"\}",
+        "~": r"\textasciitilde{}",
+        "^": r"\^{}",
+        "\\": r"\textbackslash{}",
+    }
+    return re.sub(r'([_&%$#{}\\~^])', lambda m: replacements[m.group()], text)
+
+
+def legacy_convert_to_latex(structured_list, student_name="Student"):
+    latex_lines = STANDARD_PREAMBLE_LINES + [
+        rf"\title{{Answer Sheet - {legacy_escape_latex(student_name)}}}",
+        r"\date{}",
+        r"\begin{document}",
+        r"\maketitle",
+        ""
+    ]
+    for item in structured_list:
+        latex_lines.append(r"\section*{Question " + legacy_escape_latex(str(item.get("question_number", "Unknown"))) + "}")
+        if "subparts" in item:
+            for sub_label, sub_content in item["subparts"].items():
+                latex_lines.append(r"\subsection*{(" + legacy_escape_latex(str(sub_label)) + ")}")
+                latex_lines.append(r"\textbf{Answer:}")
+                latex_lines.append(legacy_escape_latex(sub_content.get("answer", "Not answered")))
+        else:
+            latex_lines.append(r"\textbf{Answer:}")
+            latex_lines.append(legacy_escape_latex(item.get("answer", "Not answered")))
+        latex_lines.append("")
+    latex_lines.append(r"\end{document}")
+    return "\n".join(latex_lines)
+
+
+def random_text(rng, max_length):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def printable(text):
+    """`text` without the control characters escape_latex drops."""
+    return "".join(char for char in text if char in "\t\n\r" or not (ord(char) < 0x20 or ord(char) == 0x7f))
+
+
+def unescape_latex(escaped):
+    out, i = [], 0
+    while i < len(escaped):
+        for sequence, char in UNESCAPES:
+            if escaped.startswith(sequence, i):
+                out.append(char)
+                i += len(sequence)
+                break
+        else:
+            if escaped[i] in SPECIAL_CHARACTERS:
+                raise AssertionError(f"unescaped {escaped[i]!r} at {i} in {escaped!r}")
+            out.append(escaped[i])
+            i += 1
+    return "".join(out)
+
+
+def check_round_trip(samples, seed):
+    """escape_latex on random text: no bare special characters, and unescaping gives back the printable text."""
+    rng = random.Random(seed)
+    for _ in range(samples):
+        text = random_text(rng, 80)
+        expected = printable(text)
+        escaped = escape_latex(text)
+        assert unescape_latex(escaped) == expected, f"round trip failed for {text!r}"
+        if expected == text:
+            assert escaped == legacy_escape_latex(text), f"differs from the previous escaper for {text!r}"
+
+
+def answer_text(rng, words):
+    lines = [" ".join(rng.choice(ANSWER_WORDS) for _ in range(12)) for _ in range(max(1, words // 12))]
+    return "\n".join(lines)
+
+
+def make_answers(rng, scripts, questions):
+    batch = []
+    for _ in range(scripts):
+        answers = []
+        for q in range(1, questions + 1):
+            if rng.random() < 0.3:
+                answers.append({"question_number": str(q), "subparts": {
+                    label: {"answer": answer_text(rng, 60)} for label in "abc"
+                }})
+            else:
+                answers.append({"question_number": str(q), "answer": answer_text(rng, 180)})
+        batch.append(answers)
+    return batch
+
+
+def best_of(repeats, fn):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and round-trip check the LaTeX generator.")
+    parser.add_argument("--scripts", type=int, default=500, help="Synthetic answer sheets to render")
+    parser.add_argument("--questions", type=int, default=10, help="Questions per answer sheet")
+    parser.add_argument("--samples", type=int, default=5000, help="Random texts for the round-trip check")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats (the best is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_round_trip(args.samples, args.seed)
+    print(f"✅ Round trip held for {args.samples} random texts")
+
+    rng = random.Random(args.seed)
+    batch = make_answers(rng, args.scripts, args.questions)
+    texts = [answer.get("answer", "") for answers in batch for answer in answers]
+    for answers in batch[:20]:
+        assert convert_to_latex(answers) == legacy_convert_to_latex(answers), "documents differ from the previous generator"
+
+    escape_new = best_of(args.repeats, lambda: [escape_latex(t) for t in texts])
+    escape_old = best_of(args.repeats, lambda: [legacy_escape_latex(t) for t in texts])
+    convert_new = best_of(args.repeats, lambda: [convert_to_latex(a, "Student") for a in batch])
+    convert_old = best_of(args.repeats, lambda: [legacy_convert_to_latex(a, "Student") for a in batch])
+    stream_new = best_of(args.repeats, lambda: [write_latex_document(a, io.StringIO(), "Student") for a in batch])
+    megabytes = sum(len(t) for t in texts) / 1e6
+
+    print(f"escape_latex      {escape_new * 1000:8.1f} ms  (previous {escape_old * 1000:8.1f} ms, "
+          f"{escape_old / escape_new:.1f}x)  {megabytes / escape_new:.0f} MB/s")
+    print(f"convert_to_latex  {convert_new * 1000:8.1f} ms  (previous {convert_old * 1000:8.1f} ms, "
+          f"{convert_old / convert_new:.1f}x)  {args.scripts / convert_new:.0f} sheets/s")
+    print(f"write_latex_document {stream_new * 1000:5.1f} ms  (streamed into a file object)")
+
+
+if __name__ == "__main__":
+    main()
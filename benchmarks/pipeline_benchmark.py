@@ -0,0 +1,202 @@
+#pipeline_benchmark
+"""
+End-to-end benchmark of process_student_pdfs against a fake LLM server.
+
+Generates a corpus of synthetic multi-page scripts, runs the full pipeline
+(rasterize -> encode -> LLM -> compile) at each concurrency level and reports per-stage
+p50/p95 timings, peak RSS, bytes sent per page and scripts/minute. No API money is spent.
+
+Example:
+    python benchmarks/pipeline_benchmark.py --scripts 20 --pages 12 --concurrency 1,4,8 --latency 2
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from PIL import Image, ImageDraw
+
+from benchmarks.fake_llm_server import FakeLLMServer
+
+STAGES = ("rasterize", "ocr", "compile")
+
+
+def make_synthetic_script(path, pages, seed, size=(1240, 1754)):
+    """Writes a PDF of `pages` A4 pages (150 dpi) covered in random pen strokes."""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(pages):
+        img = Image.new("L", size, 255)
+        draw = ImageDraw.Draw(img)
+        y = 120
+        while y < size[1] - 120:
+            x = 100
+            while x < size[0] - 100:
+                width = rng.randint(20, 90)
+                points = [(x + i * width / 6, y + rng.randint(-12, 12)) for i in range(7)]
+                draw.line(points, fill=rng.randint(0, 60), width=3)
+                x += width + rng.randint(15, 40)
+            y += rng.randint(55, 80)
+        images.append(img)
+    images[0].save(path, "PDF", resolution=150, save_all=True, append_images=images[1:])
+    for img in images:
+        img.close()
+
+
+class RSSSampler:
+    """Samples the resident set size of this process to find the peak during a run."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    @staticmethod
+    def current_rss():
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        # Not Linux: fall back to the lifetime peak (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_rss())
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_level(process_student_pdfs, pdf_paths, output_dir, concurrency, server):
+    started = {}
+    durations = {stage: [] for stage in STAGES}
+    lock = threading.Lock()
+
+    def progress(student_pdf, stage, status, message=None):
+        now = time.perf_counter()
+        with lock:
+            if status == "started":
+                started[(student_pdf, stage)] = now
+            elif status == "finished" and (student_pdf, stage) in started:
+                durations[stage].append(now - started.pop((student_pdf, stage)))
+
+    server.reset_stats()
+    with RSSSampler() as rss:
+        t0 = time.perf_counter()
+        results = process_student_pdfs(pdf_paths, question_text="Q1. Benchmark question.",
+                                       output_dir=output_dir, max_workers=concurrency, progress=progress)
+        wall = time.perf_counter() - t0
+
+    pages_sent = server.stats["images"]
+    return {
+        "concurrency": concurrency,
+        "scripts": len(pdf_paths),
+        "failed": sum(1 for r in results if r["error"]),
+        "wall_seconds": round(wall, 3),
+        "scripts_per_minute": round(len(pdf_paths) / wall * 60, 2) if wall else None,
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+        "llm_requests": server.stats["requests"],
+        "bytes_sent_per_page": round(server.stats["bytes_received"] / pages_sent) if pages_sent else None,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 3) if values else None,
+                "p95": round(percentile(values, 95), 3) if values else None,
+            }
+            for stage, values in durations.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the marking pipeline against a fake LLM backend.")
+    parser.add_argument("--scripts", type=int, default=8, help="Number of synthetic scripts")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per script")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated batch concurrency levels")
+    parser.add_argument("--latency", type=float, default=2.0, help="Fake LLM base latency (seconds)")
+    parser.add_argument("--per-image-latency", type=float, default=0.1, help="Fake LLM latency per page image")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Fake LLM latency jitter (seconds)")
+    parser.add_argument("--replay-dir", help="Replay recorded .tex/.json outputs instead of synthetic ones")
+    parser.add_argument("--mode", help="EXTRACTION_MODE to benchmark (latex, structured, windowed, auto)")
+    parser.add_argument("--corpus-dir", help="Use (or create) the synthetic corpus in this folder")
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    os.environ["CACHE_ENABLED"] = "0"  # Every run must do the real work
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    if args.mode:
+        os.environ["EXTRACTION_MODE"] = args.mode
+
+    server = FakeLLMServer(latency=args.latency, per_image_latency=args.per_image_latency,
+                           jitter=args.jitter, replay_dir=args.replay_dir).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+
+    from main import process_student_pdfs
+    from utils.llm_client import LLMClient, set_llm_client
+    set_llm_client(LLMClient(base_url=server.base_url, api_key="benchmark",
+                             requests_per_minute=0, tokens_per_minute=0))
+
+    corpus_dir = args.corpus_dir or os.path.join(work_dir, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    pdf_paths = []
+    for i in range(args.scripts):
+        path = os.path.join(corpus_dir, f"script_{i:03d}_{args.pages}p.pdf")
+        if not os.path.exists(path):
+            make_synthetic_script(path, args.pages, seed=i)
+        pdf_paths.append(path)
+
+    report = {"scripts": args.scripts, "pages_per_script": args.pages, "latency": args.latency, "levels": []}
+    try:
+        for level in (int(c) for c in args.concurrency.split(",") if c.strip()):
+            output_dir = os.path.join(work_dir, f"outputs_c{level}")
+            result = run_level(process_student_pdfs, pdf_paths, output_dir, level, server)
+            report["levels"].append(result)
+            stages = "  ".join(
+                f"{stage} p50={s['p50']}s p95={s['p95']}s" if s["count"] else f"{stage} n/a"
+                for stage, s in result["stages"].items()
+            )
+            print(f"concurrency={level:<3} {result['scripts_per_minute']} scripts/min  "
+                  f"wall={result['wall_seconds']}s  peak_rss={result['peak_rss_mb']}MB  "
+                  f"bytes/page={result['bytes_sent_per_page']}  failed={result['failed']}\n    {stages}")
+    finally:
+        server.stop()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Saved benchmark report to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,13 @@
 #answer_structuring_chain
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableMap
-import os
+from utils.llm_client import get_chat_model
 
 def get_answer_structuring_chain(model_name="gpt-4o"):
-    llm = ChatOpenAI(
-        model=model_name,
-        temperature=0.1,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
+    # langchain is heavy and only this chain needs it, so it is imported when the chain is built
+    from langchain.prompts import ChatPromptTemplate
+
+    # Requests go through the shared LLM client (same concurrency, rate and token limits and retries as
+    # the vision extraction path)
+    llm = get_chat_model(model_name, temperature=0.1)
 
     prompt = ChatPromptTemplate.from_template(r"""
     You are a helpful assistant. A professor uploaded a question paper and a student's answer sheet.
@@ -0,0 +1,43 @@
+#gunicorn.conf.py
+"""
+Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+The app is preloaded into the master and the heavy dependencies (openai, httpx, PIL,
+pdf2image, numpy) are imported there once before forking, so workers start warm and share
+those pages copy-on-write. Anything holding threads or sockets (the job runner, the pooled
+LLM client, the artifact cache) is created in each worker by post_fork instead.
+Override the defaults with the GUNICORN_* / WEB_CONCURRENCY / PORT env variables.
+"""
+import importlib
+import os
+import time
+
+# Set before the app is preloaded: the master must not start a job runner of its own
+os.environ["DEFER_WORKER_START"] = "1"
+
+PRELOAD_MODULES = ("openai", "httpx", "numpy", "PIL.Image", "pdf2image", "utils.page_filter")
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))  # Job event streams each hold a thread
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))  # Large upload chunks on slow links
+preload_app = True
+
+
+def on_starting(server):
+    start = time.perf_counter()
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    from PIL import Image
+
+    Image.init()  # Register every image plugin now rather than on each worker's first save
+    server.log.info(f"Preloaded {', '.join(PRELOAD_MODULES)} in {time.perf_counter() - start:.2f}s")
+
+
+def post_fork(server, worker):
+    import app
+
+    start = time.perf_counter()
+    app.start_worker(warm_up=True)
+    server.log.info(f"Worker {worker.pid} ready in {time.perf_counter() - start:.2f}s")
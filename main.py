@@ -1,8 +1,20 @@
 #main.py
 import os
-import subprocess
-from dotenv import load_dotenv
-from utils.ocr_openai import pdf_to_images, gpt4o_extract_answer_latex
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from utils.ocr_openai import (iter_encoded_pages, gpt4o_extract_answer_latex, page_encoding_params, extraction_params,
+                              extraction_mode, window_params, extract_answers_windowed, gpt4o_extract_answers_json)
+from utils.latex_generator import convert_to_latex
+from utils.formatter import merge_structured_answers
+from utils.latex_compiler import compile_latex
+from utils.latex_repair import repair_latex
+from utils.concurrency import stage_slot, batch_concurrency
+from utils.cache import get_cache, cache_key, file_sha256
+from utils.metrics import span, record_span, job_context
+from utils.checkpoints import ScriptCheckpoint, text_sha256
+from utils.question_index import segment_answers, QUESTION_INDEX_VERSION
+from utils.answer_store import answer_store_for
 import re # <--- NEW: Import regex for cleaning
 
 # These global paths should match the ones in app.py
@@ -11,9 +23,6 @@ OUTPUT_FOLDER = "outputs"
 
 os.makedirs(OUTPUT_FOLDER, exist_ok=True) # Ensure outputs directory exists
 
-load_dotenv()
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-
 
 def extract_question_text(pdf_path: str):
     """
@@ -23,12 +32,38 @@ def extract_question_text(pdf_path: str):
     Returns:
         str: Extracted text from the question paper.
     """
-    image_paths = pdf_to_images(pdf_path)
+    # Re-uploading the same question paper is served from the cache instead of another vision call.
+    # The paper is always read with the LaTeX prompt, so its key ignores EXTRACTION_MODE (which only
+    # changes how answer sheets are extracted).
+    cache = get_cache()
+    llm_key = cache_key(file_sha256(pdf_path), page_encoding_params(), extraction_params("", mode="latex"))
+    cached_text = cache.get_text("llm", llm_key)
+    if cached_text is not None:
+        print(f"♻️ Question paper text served from cache for {os.path.basename(pdf_path)}")
+        return cached_text
+
+    filter_stats = {}
+    image_pages = list(iter_encoded_pages(pdf_path, stats=filter_stats))
+    for page_number, reason in filter_stats.get("dropped_pages", []):
+        print(f"🧹 Question paper page {page_number} was not sent ({reason})")
     # For question paper, we don't have existing question text to provide
-    return gpt4o_extract_answer_latex(image_paths, question_text="")
+    extracted_text = gpt4o_extract_answer_latex(image_pages, question_text="")
+    if extracted_text:
+        cache.put_text("llm", llm_key, extracted_text)
+    return extracted_text
+
+
+def _report(progress, stage: str, status: str, message: str = None):
+    # Progress callbacks are best-effort: a broken listener must never fail the script
+    if progress is None:
+        return
+    try:
+        progress(stage, status, message)
+    except Exception as e:
+        print(f"Warning: progress callback failed for stage {stage}: {e}")
 
 
-def process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir: str):
+def process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir: str, progress=None):
     """
     Processes a single student answer sheet PDF, extracts answers, and generates a LaTeX file and PDF.
 
@@ -38,6 +73,8 @@ def process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir
         question_text (str): The extracted text from the question paper.
         output_dir (str): The directory where the generated .tex and .pdf files will be saved.
                           (This should be the global 'outputs' folder).
+        progress (callable, optional): Called as progress(stage, status, message) when a stage
+                                       ("rasterize", "ocr", "compile") is "started", "finished" or "failed".
 
     Returns:
         tuple[str | None, str]: A tuple containing:
@@ -45,7 +82,20 @@ def process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir
               or None if PDF compilation failed.
             - The raw LaTeX string extracted (after cleaning, for display/debugging).
     """
+    student_name = os.path.splitext(os.path.basename(full_input_pdf_path))[0]
+    # Every span recorded while processing this script (including LLM requests) is tagged with the student
+    with job_context(student_name):
+        result = _process_student_pdf(full_input_pdf_path, question_text, output_dir, progress)
+    if result[0]:
+        # A finished script only keeps compressed intermediates (CHECKPOINT_INTERMEDIATES, see utils/checkpoints.py)
+        try:
+            ScriptCheckpoint(output_dir, student_name).compact()
+        except OSError as e:
+            print(f"Warning: could not compact the checkpoint of {student_name}: {e}")
+    return result
 
+
+def _process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir: str, progress=None):
     # Extract just the base filename (e.g., "G24AI1126-G23AI1028PreetamSocialNAn.pdf")
     base_filename_only = os.path.basename(full_input_pdf_path)
 
@@ -54,26 +104,116 @@ def process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir
 
     print(f"\n🧑‍🎓 Processing: {student_name}")
 
-    # 2. Convert PDF to images
-    try:
-        image_pages = pdf_to_images(full_input_pdf_path)
-    except Exception as e:
-        print(f"Error converting PDF to images for {full_input_pdf_path}: {e}")
-        return None, f"Error converting PDF to images: {e}"
+    # 1. Look up earlier work: first this script's own checkpoints (durable, see utils/checkpoints.py),
+    #    then the shared cache. Keys are content hashes of the PDF plus every parameter that
+    #    affects a stage's output, so a hit skips that stage (and the ones before it).
+    cache = get_cache()
+    checkpoint = ScriptCheckpoint(output_dir, student_name)
+    pages_key = cache_key(file_sha256(full_input_pdf_path), page_encoding_params())
+    mode = extraction_mode()
+    llm_key = cache_key(pages_key, extraction_params(question_text, mode))
 
+    # The .tex from an earlier run (including any hand edits) goes straight to the compile step
+    final_latex_to_write = checkpoint.load_latex(llm_key)
+    if final_latex_to_write is not None:
+        print(f"⏩ Resuming {student_name} from its LaTeX checkpoint")
+        _report(progress, "rasterize", "finished", "checkpoint")
+        _report(progress, "ocr", "finished", "checkpoint")
+        return _compile_student_latex(checkpoint, final_latex_to_write, progress)
+
+    raw_latex_output = checkpoint.load_raw(llm_key)
+    raw_source = "checkpoint"
+    if raw_latex_output is None:
+        raw_latex_output = cache.get_text("llm", llm_key)
+        raw_source = "cached"
+
+    if raw_latex_output is not None:
+        print(f"♻️ Using {raw_source} extraction for {student_name}")
+        _report(progress, "rasterize", "finished", raw_source)
+        _report(progress, "ocr", "finished", raw_source)
+    else:
+        # 2. Convert PDF to images (encoded in memory, ready for the request payload)
+        image_pages = checkpoint.load_pages(pages_key)
+        pages_source = "checkpoint"
+        if image_pages is None:
+            image_pages = cache.get_json("pages", pages_key)
+            pages_source = "cached"
+        if image_pages is not None:
+            _report(progress, "rasterize", "finished", pages_source)
+        else:
+            encode_stats = {}
+            rasterize_start = time.perf_counter()  # Set before the try, so a failure anywhere in it is timed
+            try:
+                with stage_slot("rasterize"):
+                    _report(progress, "rasterize", "started")
+                    rasterize_start = time.perf_counter()  # The span excludes the wait for a slot
+                    image_pages = list(iter_encoded_pages(full_input_pdf_path, stats=encode_stats))
+                    rasterize_seconds = time.perf_counter() - rasterize_start
+            except Exception as e:
+                print(f"Error converting PDF to images for {full_input_pdf_path}: {e}")
+                _report(progress, "rasterize", "failed", str(e))
+                record_span("rasterize", time.perf_counter() - rasterize_start, status="error")
+                return None, f"Error converting PDF to images: {e}"
+            # Rendering, filtering and encoding are interleaved page by page, so they are timed separately
+            # and reported as three spans; the page_filter span counts the pages and bytes dropped
+            encode_seconds = encode_stats.get("encode_seconds", 0.0)
+            filter_seconds = encode_stats.get("filter_seconds", 0.0)
+            pages_dropped = encode_stats.get("pages_dropped", 0)
+            record_span("rasterize", max(0.0, rasterize_seconds - encode_seconds - filter_seconds), pages=len(image_pages))
+            record_span("page_filter", filter_seconds, pages=pages_dropped, bytes=encode_stats.get("dropped_bytes", 0),
+                        blank=encode_stats.get("pages_blank", 0), duplicate=encode_stats.get("pages_duplicate", 0),
+                        deskewed=encode_stats.get("pages_deskewed", 0))
+            record_span("encode", encode_seconds, pages=len(image_pages), bytes=encode_stats.get("encoded_bytes", 0))
+            if pages_dropped:
+                print(f"🧹 Dropped {pages_dropped} page(s) for {student_name} "
+                      f"({encode_stats.get('pages_blank', 0)} blank, {encode_stats.get('pages_duplicate', 0)} duplicate, "
+                      f"{encode_stats.get('dropped_bytes', 0) / 1024:.0f} KB)")
+            # Every page withheld from the model is listed in the job events, so graders can check it
+            for page_number, reason in encode_stats.get("dropped_pages", []):
+                _report(progress, "page_filter", "dropped", f"page {page_number} ({reason})")
+            _report(progress, "rasterize", "finished", f"{len(image_pages)} pages, {pages_dropped} dropped")
+            cache.put_json("pages", pages_key, image_pages)
+        if pages_source != "checkpoint":
+            checkpoint.save_pages(pages_key, image_pages)
 
-    # 3. Extract LaTeX from images using GPT-4o
-    raw_latex_output = gpt4o_extract_answer_latex(image_pages, question_text)
+        # 3. Extract LaTeX from images using GPT-4o
+        if mode == "auto":
+            mode = "windowed" if len(image_pages) > window_params()[0] else "structured"
+        try:
+            _report(progress, "ocr", "started")
+            if mode == "windowed":
+                # Windows are sent concurrently, each holding its own "llm" slot
+                answers = extract_answers_windowed(image_pages, question_text)
+                raw_latex_output = convert_to_latex(answers, student_name=student_name)
+            elif mode == "structured":
+                # Compact JSON answers; the LaTeX (with the fixed, precompiled preamble) is generated locally
+                with stage_slot("llm"):
+                    answers = gpt4o_extract_answers_json(image_pages, question_text)
+                # Same normalisation as the windowed path: subparts of any shape become {"answer": ...}
+                answers = merge_structured_answers([answers])
+                raw_latex_output = convert_to_latex(answers, student_name=student_name)
+            else:
+                with stage_slot("llm"):
+                    raw_latex_output = gpt4o_extract_answer_latex(image_pages, question_text)
+        except Exception as e:
+            _report(progress, "ocr", "failed", str(e))
+            raise
+        _report(progress, "ocr", "finished")
+        if raw_latex_output:
+            cache.put_text("llm", llm_key, raw_latex_output)
+    if raw_latex_output and raw_source != "checkpoint":
+        checkpoint.save_raw(llm_key, raw_latex_output)
 
     # --- START OF NEW/MODIFIED CODE FOR CLEANING LATEX OUTPUT ---
     # Remove markdown code fences from the GPT-4o output
-    cleaned_latex_output = raw_latex_output.strip()
-    if cleaned_latex_output.startswith("```latex"):
-        cleaned_latex_output = cleaned_latex_output[len("```latex"):].strip()
-    if cleaned_latex_output.endswith("```"):
-        cleaned_latex_output = cleaned_latex_output[:-len("```")].strip()
-    # Ensure no extra newlines or spaces at the very beginning/end after stripping fences
-    cleaned_latex_output = cleaned_latex_output.strip()
+    with span("cleanup", bytes=len(raw_latex_output)):
+        cleaned_latex_output = raw_latex_output.strip()
+        if cleaned_latex_output.startswith("```latex"):
+            cleaned_latex_output = cleaned_latex_output[len("```latex"):].strip()
+        if cleaned_latex_output.endswith("```"):
+            cleaned_latex_output = cleaned_latex_output[:-len("```")].strip()
+        # Ensure no extra newlines or spaces at the very beginning/end after stripping fences
+        cleaned_latex_output = cleaned_latex_output.strip()
 
     # Optional: Further cleaning for common LaTeX display issues if needed
     # For example, if GPT-4o outputs \begin{document} etc. within the main content,
@@ -105,38 +245,175 @@ def process_student_pdf(full_input_pdf_path: str, question_text: str, output_dir
 
     with open(tex_path, "w", encoding="utf-8") as f:
         f.write(final_latex_to_write) # <--- Use the cleaned/final LaTeX here
+    checkpoint.mark("latex", llm_key, sha256=text_sha256(final_latex_to_write))
 
     # 5. Compile LaTeX to PDF
-    pdf_filename = f"{student_name}_answers.pdf"
-    compile_command = [
-        "pdflatex",
-        "-interaction=nonstopmode",
-        "-output-directory", output_dir,
-        tex_path
-    ]
+    return _compile_student_latex(checkpoint, final_latex_to_write, progress)
+
 
+def _record_answers(checkpoint, latex: str):
+    # Per-question records of the answer sheet, for per-question views and exports across students.
+    # Taken from the LaTeX being compiled, so hand edits are picked up by recompiles; never fails the script.
     try:
-        result = subprocess.run(compile_command, cwd=output_dir, capture_output=True, text=True, check=False)
-        if result.returncode != 0:
-            print(f"❌ LaTeX compile error for {student_name}:")
-            print(result.stderr) # Print the actual LaTeX errors from pdflatex
-            print(f"Warning: PDF compilation failed for {base_filename_only}. Extracted text still available.")
-            return None, final_latex_to_write # Return None for pdf_filename on failure
-        else:
-            print(f"📄 PDF generated for {student_name}")
+        with span("segment_answers") as segment_span:
+            store = answer_store_for(checkpoint.output_dir)
+            # Keyed on the parser version too, so sheets split by an older parser are split again
+            latex_sha256 = cache_key(text_sha256(latex), QUESTION_INDEX_VERSION)
+            if store.is_current(checkpoint.student_name, latex_sha256):
+                return
+            records = segment_answers(latex)
+            store.replace_student(checkpoint.student_name, records, latex_sha256)
+            segment_span.set(answers=len(records))
+    except Exception as e:
+        print(f"Warning: could not record per-question answers for {checkpoint.student_name}: {e}")
 
-    except FileNotFoundError:
-        print("❌ Error: pdflatex command not found. Please ensure LaTeX is installed and in your PATH.")
-        return None, final_latex_to_write
+
+def _compile_student_latex(checkpoint, final_latex_to_write: str, progress=None):
+    # Compile step shared by full runs, resumed runs and recompile_student_pdf.
+    # A PDF already compiled from this exact LaTeX is kept; identical LaTeX reuses the cached PDF.
+    student_name = checkpoint.student_name
+    output_dir = checkpoint.output_dir
+    cache = get_cache()
+    pdf_filename = f"{student_name}_answers.pdf"
+    latex_sha256 = text_sha256(final_latex_to_write)
+    _record_answers(checkpoint, final_latex_to_write)
+    if checkpoint.pdf_up_to_date(final_latex_to_write):
+        print(f"⏩ PDF for {student_name} is already up to date")
+        _report(progress, "compile", "finished", "checkpoint")
+        return pdf_filename, final_latex_to_write
+
+    pdf_key = cache_key(latex_sha256)
+    if cache.get_file("pdf", pdf_key, os.path.join(output_dir, pdf_filename)):
+        print(f"♻️ Using cached PDF for {student_name}")
+        _report(progress, "compile", "finished", "cached")
+        checkpoint.mark("pdf", latex_sha256)
+        return pdf_filename, final_latex_to_write
+
+    _report(progress, "compile", "started")
+    try:
+        # Isolated working directory, precompiled preamble and a timeout (see utils/latex_compiler.py)
+        with span("compile", bytes=len(final_latex_to_write)) as compile_span:
+            compiled_pdf_path, compile_log = compile_latex(final_latex_to_write, f"{student_name}_answers", output_dir)
+            if compiled_pdf_path is None:
+                compile_span.status = "error"
+        if compiled_pdf_path is None:
+            # Local fixes from the log first, then a text-only fix request (see utils/latex_repair.py)
+            with span("latex_repair") as repair_span:
+                compiled_pdf_path, compile_log, repaired_latex, fixes = repair_latex(
+                    final_latex_to_write, compile_log, f"{student_name}_answers", output_dir)
+                repair_span.set(fixes=len(fixes))
+                if compiled_pdf_path is None:
+                    repair_span.status = "error"
+            if compiled_pdf_path is not None:
+                # Keep the .tex in step with the PDF, so the checkpoint sees it as up to date
+                with open(checkpoint.tex_path, "w", encoding="utf-8") as f:
+                    f.write(repaired_latex)
+                print(f"🔧 Repaired LaTeX for {student_name} ({len(fixes)} fix(es))")
+                final_latex_to_write = repaired_latex
+                latex_sha256 = text_sha256(repaired_latex)
+                _record_answers(checkpoint, repaired_latex)
     except Exception as e:
         print(f"❌ An unexpected error occurred during LaTeX compilation for {student_name}: {e}")
+        _report(progress, "compile", "failed", str(e))
         return None, final_latex_to_write
 
-    # 6. Clean up auxiliary files (keeping .tex for debugging)
-    #for ext in [".aux", ".log"]: # Removed .tex from this list to keep it
-        #try:
-            #os.remove(os.path.join(output_dir, f"{student_name}_answers{ext}"))
-        #except FileNotFoundError:
-            #pass
+    if compiled_pdf_path is None:
+        print(f"❌ LaTeX compile error for {student_name}:")
+        print(compile_log[-3000:])  # Tail of the pdflatex log, where the errors are
+        print(f"Warning: PDF compilation failed for {student_name}. Extracted text still available.")
+        first_error = next((line for line in compile_log.splitlines() if line.startswith("!")), None)
+        _report(progress, "compile", "failed", first_error or compile_log.splitlines()[0] if compile_log else None)
+        return None, final_latex_to_write  # Return None for pdf_filename on failure
+
+    print(f"📄 PDF generated for {student_name}")
+    _report(progress, "compile", "finished")
+    checkpoint.mark("pdf", latex_sha256)
+    cache.put_file("pdf", pdf_key, compiled_pdf_path)
+
+    return pdf_filename, final_latex_to_write # Return the cleaned LaTeX for display/debugging
+
+
+def recompile_student_pdf(full_input_pdf_path: str, output_dir: str, progress=None):
+    """
+    Re-runs only the compile step for a script, from the .tex already in output_dir
+    (e.g. after fixing the LaTeX by hand). No pages are rendered and no model is called.
+
+    Args:
+        full_input_pdf_path (str): The student PDF (only its name is used).
+        output_dir (str): The directory holding the script's generated .tex file.
+        progress (callable, optional): As for process_student_pdf.
+
+    Returns:
+        tuple[str | None, str]: The generated PDF filename (None on failure) and the LaTeX compiled.
+    """
+    student_name = os.path.splitext(os.path.basename(full_input_pdf_path))[0]
+    checkpoint = ScriptCheckpoint(output_dir, student_name)
+    if not os.path.exists(checkpoint.tex_path):
+        raise FileNotFoundError(f"No LaTeX to recompile for {student_name}: {checkpoint.tex_path} is missing.")
+    with open(checkpoint.tex_path, "r", encoding="utf-8") as f:
+        final_latex_to_write = f.read()
+    with job_context(student_name):
+        return _compile_student_latex(checkpoint, final_latex_to_write, progress)
+
+
+def process_student_pdfs(full_input_pdf_paths, question_text: str, output_dir: str, max_workers: int = None,
+                         progress=None, recompile_only: bool = False):
+    """
+    Processes a batch of student answer sheet PDFs concurrently.
+
+    Every script goes through process_student_pdf on a bounded worker pool. The rasterize,
+    LLM and compile stages are additionally limited by their own stage limits
+    (see utils/concurrency.py), so the batch takes about as long as its slowest stage
+    rather than the sum of all scripts. Stage slots are shared fairly with other batches
+    running at the same time, by the caller's scheduling context (see utils/scheduler.py).
+
+    Args:
+        full_input_pdf_paths (list[str]): FULL paths to the student PDFs.
+        question_text (str): The extracted text from the question paper.
+        output_dir (str): The directory where the generated .tex and .pdf files will be saved.
+        max_workers (int, optional): Number of scripts in flight. Defaults to BATCH_CONCURRENCY.
+        progress (callable, optional): Called as progress(student_pdf, stage, status, message)
+                                       for every stage transition of every script.
+        recompile_only (bool): Only re-run the compile step from each script's existing .tex
+                               (see recompile_student_pdf). Otherwise every script resumes from
+                               its first incomplete stage.
+
+    Returns:
+        list[dict]: One entry per input PDF, in input order, with keys
+            "student_pdf", "pdf_filename", "extracted_text" and "error" (None on success).
+    """
+
+    def _run_one(pdf_path):
+        script_progress = None
+        if progress is not None:
+            script_progress = lambda stage, status, message=None: progress(pdf_path, stage, status, message)
+        try:
+            if recompile_only:
+                pdf_filename, extracted_text = recompile_student_pdf(pdf_path, output_dir, progress=script_progress)
+            else:
+                pdf_filename, extracted_text = process_student_pdf(
+                    pdf_path,
+                    question_text=question_text,
+                    output_dir=output_dir,
+                    progress=script_progress
+                )
+            error = None if pdf_filename else "PDF compilation failed."
+        except Exception as e:
+            print(f"❌ Error processing {pdf_path}: {e}")
+            pdf_filename, extracted_text, error = None, None, str(e)
+        return {
+            "student_pdf": pdf_path,
+            "pdf_filename": pdf_filename,
+            "extracted_text": extracted_text,
+            "error": error,
+        }
+
+    if not full_input_pdf_paths:
+        return []
 
-    return pdf_filename, final_latex_to_write # Return the cleaned LaTeX for display/debugging
\ No newline at end of file
+    workers = min(max_workers or batch_concurrency(), len(full_input_pdf_paths))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="student-pdf") as executor:
+        # Each script runs in a copy of the caller's context, so it keeps the job's scheduling flow and lane
+        futures = [executor.submit(contextvars.copy_context().run, _run_one, pdf_path)
+                   for pdf_path in full_input_pdf_paths]
+        return [future.result() for future in futures]
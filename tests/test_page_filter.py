@@ -0,0 +1,44 @@
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.page_filter import iter_filtered_pages, page_filter_params
+
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+
+
+def template_page(answer=None):
+    """A page of a templated answer book (header box and ruled lines), with an optional short answer."""
+    img = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((100, 80, 1140, 220), outline="black", width=4)
+    draw.text((130, 120), "ANSWER BOOK  Roll No: ________", fill="black", font=ImageFont.load_default(size=40))
+    for y in range(300, 1650, 60):
+        draw.line((100, y, 1140, y), fill="black", width=2)
+    if answer:
+        draw.text((140, 310), answer, fill="black", font=ImageFont.load_default(size=36))
+    return img
+
+
+def run_filter(images):
+    params = dict(page_filter_params(), enabled=True, max_skew=0.0)
+    stats = {}
+    results = [(number, reason) for number, img, reason in
+               iter_filtered_pages(enumerate(images, start=1), params, stats)]
+    return results, stats
+
+
+def test_template_pages_with_different_answers_are_kept():
+    results, stats = run_filter([template_page(answer) for answer in ("Q1: 42", "Q2: x", "Q3: 17", "Q4: a=3")])
+    assert results == [(1, None), (2, None), (3, None), (4, None)]
+    assert "dropped_pages" not in stats
+
+
+def test_page_scanned_twice_in_a_row_is_dropped():
+    results, stats = run_filter([template_page("Q1: 42"), template_page("Q1: 42"), template_page("Q2: x")])
+    assert results == [(1, None), (2, "duplicate"), (3, None)]
+    assert stats["dropped_pages"] == [(2, "duplicate")]
+
+
+def test_repeat_of_an_earlier_page_is_kept():
+    # Only the page kept just before is compared: a later page that repeats an earlier one is kept
+    results, _ = run_filter([template_page("Q1: 42"), template_page("Q2: x"), template_page("Q1: 42")])
+    assert [reason for _, reason in results] == [None, None, None]
@@ -0,0 +1,136 @@
+#answer_store
+import os
+import sqlite3
+import threading
+import time
+
+# Per-question answer records of every script in an output folder, kept next to the outputs
+ANSWERS_DB_NAME = "answers.db"
+
+_stores = {}  # db path -> AnswerStore
+_stores_lock = threading.Lock()
+
+
+class AnswerStore:
+    """
+    Per-question answer records (one row per student, question and subpart) backed by SQLite,
+    so a single question can be listed, searched or exported across all students without
+    re-reading every answer sheet.
+
+    Every call opens its own connection, as in JobStore, so the store can be shared between
+    request threads and batch workers.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            # answers.db sits next to the outputs, possibly on NFS/EFS where WAL's shared-memory index
+            # is unsafe: keep the default rollback journal (and switch back stores created in WAL mode)
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    student TEXT NOT NULL,
+                    question_number TEXT NOT NULL,
+                    subpart TEXT NOT NULL DEFAULT '',
+                    position INTEGER NOT NULL,
+                    latex TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (student, question_number, subpart)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answer_sheets (
+                    student TEXT PRIMARY KEY,
+                    latex_sha256 TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_question ON answers (question_number, subpart)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def is_current(self, student: str, latex_sha256: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT latex_sha256 FROM answer_sheets WHERE student = ?", (student,)).fetchone()
+        return row is not None and row["latex_sha256"] == latex_sha256
+
+    def replace_student(self, student: str, records, latex_sha256: str) -> bool:
+        """
+        Replaces all records of `student` with `records` ([{"question_number", "subpart", "latex"}]).
+        Returns False (and writes nothing) if they were already recorded from the same LaTeX.
+        """
+        if self.is_current(student, latex_sha256):
+            return False
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers WHERE student = ?", (student,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO answers (student, question_number, subpart, position, latex, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(student, r["question_number"], r.get("subpart") or "", position, r["latex"], now)
+                 for position, r in enumerate(records)]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO answer_sheets (student, latex_sha256, updated_at) VALUES (?, ?, ?)",
+                (student, latex_sha256, now)
+            )
+        return True
+
+    def question_answers(self, question_number: str, subpart: str = None, search: str = None):
+        """Every student's answer to a question (all its subparts unless `subpart` is given), by student."""
+        query = "SELECT student, question_number, subpart, latex, updated_at FROM answers WHERE question_number = ?"
+        params = [question_number]
+        if subpart is not None:
+            query += " AND subpart = ?"
+            params.append(subpart)
+        if search:
+            query += " AND instr(lower(latex), lower(?)) > 0"
+            params.append(search)
+        query += " ORDER BY student, position"
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def student_answers(self, student: str):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT student, question_number, subpart, latex, updated_at FROM answers "
+                "WHERE student = ? ORDER BY position", (student,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, text: str, limit: int = 200):
+        """Answers containing `text` (case-insensitive), across all questions and students."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT student, question_number, subpart, latex, updated_at FROM answers "
+                "WHERE instr(lower(latex), lower(?)) > 0 ORDER BY question_number, subpart, student LIMIT ?",
+                (text, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def questions(self):
+        """{(question_number, subpart): number of students with an answer recorded}."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT question_number, subpart, COUNT(*) AS students FROM answers GROUP BY question_number, subpart"
+            ).fetchall()
+        return {(row["question_number"], row["subpart"]): row["students"] for row in rows}
+
+
+def answer_store_for(output_dir: str) -> AnswerStore:
+    """The answer store of an output folder (<output_dir>/answers.db), created once per process."""
+    db_path = os.path.abspath(os.path.join(output_dir, ANSWERS_DB_NAME))
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = AnswerStore(db_path)
+        return _stores[db_path]
@@ -0,0 +1,220 @@
+#cache
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+DEFAULT_CACHE_DIR = "cache"
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+# Once past max_bytes, eviction frees space down to this fraction of it (CACHE_LOW_WATER env), so the
+# directory walk it takes happens once per batch of puts rather than on every put
+DEFAULT_CACHE_LOW_WATER = 0.9
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_atomic(src_path: str, dest_path: str):
+    """
+    Copies src_path to dest_path through a temporary file next to it, so dest_path is replaced
+    (a new inode) rather than rewritten: readers of the old file never see a partial or mixed copy.
+    """
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def cache_key(*parts) -> str:
+    """Stable key for any JSON-serialisable parts (content hashes, prompt/model/parameter dicts)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """
+    On-disk, content-addressed cache for pipeline artifacts.
+
+    Entries live at <root>/<namespace>/<key[:2]>/<key> ("pages", "llm", "pdf", ...).
+    Reads refresh an entry's mtime, and once the cache grows past max_bytes the least
+    recently used entries are evicted down to the low-water mark. Hit/miss counters are kept
+    per namespace.
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = root or os.getenv("CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes or int(os.getenv("CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+        low_water = float(os.getenv("CACHE_LOW_WATER", DEFAULT_CACHE_LOW_WATER))
+        self.low_water_bytes = int(self.max_bytes * min(max(low_water, 0.0), 1.0))
+        self.enabled = os.getenv("CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+        self._lock = threading.Lock()
+        self._evicting = False
+        self._counters = {}
+        os.makedirs(self.root, exist_ok=True)
+        self._size_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.root, namespace, key[:2], key)
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _added(self, path: str, previous_size: int):
+        # Accounts for an entry just written to `path`; an overwritten entry only adds the difference
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size_bytes += size - previous_size
+        self._evict_if_needed()
+
+    def _existing_size(self, path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _count(self, namespace: str, outcome: str):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0})
+            counters[outcome] += 1
+
+    def get_path(self, namespace: str, key: str):
+        """Path of a cached entry (and marks it as recently used), or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path(namespace, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._count(namespace, "misses")
+            return None
+        self._count(namespace, "hits")
+        return path
+
+    def get_bytes(self, namespace: str, key: str):
+        path = self.get_path(namespace, key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:  # Evicted between the lookup and the read
+            return None
+
+    def put_bytes(self, namespace: str, key: str, data: bytes):
+        if not self.enabled:
+            return
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        previous_size = self._existing_size(path)
+        os.replace(tmp_path, path)
+        self._added(path, previous_size)
+
+    def get_text(self, namespace: str, key: str):
+        data = self.get_bytes(namespace, key)
+        return data.decode("utf-8") if data is not None else None
+
+    def put_text(self, namespace: str, key: str, text: str):
+        self.put_bytes(namespace, key, text.encode("utf-8"))
+
+    def get_json(self, namespace: str, key: str):
+        data = self.get_bytes(namespace, key)
+        return json.loads(data) if data is not None else None
+
+    def put_json(self, namespace: str, key: str, value):
+        self.put_bytes(namespace, key, json.dumps(value).encode("utf-8"))
+
+    def get_file(self, namespace: str, key: str, dest_path: str) -> bool:
+        """Copies a cached entry to dest_path. Returns False on a miss."""
+        path = self.get_path(namespace, key)
+        if path is None:
+            return False
+        try:
+            copy_atomic(path, dest_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_file(self, namespace: str, key: str, src_path: str):
+        # Always a copy, never a hard link: get_path refreshes an entry's mtime on every hit, and a
+        # served output sharing the inode would change its Last-Modified/ETag (or its bytes) with it
+        if not self.enabled:
+            return
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        previous_size = self._existing_size(path)
+        copy_atomic(src_path, path)
+        self._added(path, previous_size)
+
+    def _evict_if_needed(self):
+        # One eviction at a time, walking the cache outside the lock so hits and puts are not held up
+        with self._lock:
+            if self._size_bytes <= self.max_bytes or self._evicting:
+                return
+            self._evicting = True
+        total = None
+        try:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])  # Oldest use first
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.low_water_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        finally:
+            with self._lock:
+                if total is not None:
+                    self._size_bytes = total  # Re-measured from disk
+                self._evicting = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size_bytes": self._size_bytes,
+                "max_bytes": self.max_bytes,
+                "namespaces": {namespace: dict(counters) for namespace, counters in self._counters.items()},
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ArtifactCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+        return _cache
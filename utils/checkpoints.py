@@ -0,0 +1,172 @@
+#checkpoints
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Per-script pipeline stages, in order. "pages" and "raw" are stored in the checkpoint folder;
+# "latex" and "pdf" are the <student>_answers.tex/.pdf files in the output folder itself, so a
+# hand-edited .tex is what gets recompiled.
+STAGES = ("pages", "raw", "latex", "pdf")
+CHECKPOINT_DIR = ".checkpoints"
+STATE_FILE = "state.json"
+STAGE_FILES = {"pages": "pages.json", "raw": "raw_output.txt"}
+# What compact() does with a finished script's intermediates (CHECKPOINT_INTERMEDIATES env):
+# "compress" gzips them, "drop" also deletes the page images, "keep" leaves them as they are
+DEFAULT_CHECKPOINT_INTERMEDIATES = "compress"
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ScriptCheckpoint:
+    """
+    Durable record of the stages a script has completed, kept in
+    <output_dir>/.checkpoints/<student_name>/.
+
+    Each stage is saved with the key of the inputs it was computed from (the same content
+    keys the artifact cache uses); a stage only counts as done while its key still matches,
+    so a new question paper or different settings redo the affected stages automatically.
+    Unlike the artifact cache, checkpoints are never evicted and ignore CACHE_ENABLED.
+    """
+
+    def __init__(self, output_dir: str, student_name: str):
+        self.dir = os.path.join(output_dir, CHECKPOINT_DIR, student_name)
+        self.output_dir = output_dir
+        self.student_name = student_name
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+
+    @property
+    def tex_path(self):
+        return os.path.join(self.output_dir, f"{self.student_name}_answers.tex")
+
+    @property
+    def pdf_path(self):
+        return os.path.join(self.output_dir, f"{self.student_name}_answers.pdf")
+
+    def _state_path(self):
+        return os.path.join(self.dir, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"stages": {}}
+
+    def _write_atomic(self, path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def mark(self, stage: str, key: str = None, **info):
+        """Records `stage` as done for `key`; the artifact must already be on disk."""
+        with self._lock:
+            self.state["stages"][stage] = {"key": key, "finished_at": time.time(), **info}
+            self._write_atomic(self._state_path(), json.dumps(self.state, indent=2).encode("utf-8"))
+
+    def info(self, stage: str, key: str = None):
+        """The stage record if it is done for `key` (any key when None), else None."""
+        entry = self.state["stages"].get(stage)
+        if entry is None or (key is not None and entry.get("key") != key):
+            return None
+        return entry
+
+    def invalidate(self, from_stage: str):
+        """Forgets `from_stage` and every later stage, so they run again on the next pass."""
+        with self._lock:
+            for stage in STAGES[STAGES.index(from_stage):]:
+                self.state["stages"].pop(stage, None)
+            self._write_atomic(self._state_path(), json.dumps(self.state, indent=2).encode("utf-8"))
+
+    def _save_stage_file(self, stage: str, data: bytes):
+        path = os.path.join(self.dir, STAGE_FILES[stage])
+        self._write_atomic(path, data)
+        try:
+            os.remove(path + ".gz")  # A compacted copy from an earlier run is stale now
+        except FileNotFoundError:
+            pass
+
+    def _load_stage_file(self, stage: str):
+        # Plain file, or its gzipped copy once compact() has run
+        path = os.path.join(self.dir, STAGE_FILES[stage])
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with gzip.open(path + ".gz", "rb") as f:
+                return f.read()
+
+    def save_pages(self, key: str, pages):
+        self._save_stage_file("pages", json.dumps(pages).encode("utf-8"))
+        self.mark("pages", key, count=len(pages))
+
+    def load_pages(self, key: str):
+        if self.info("pages", key) is None:
+            return None
+        try:
+            return json.loads(self._load_stage_file("pages"))
+        except (OSError, ValueError):
+            return None
+
+    def save_raw(self, key: str, raw_output: str):
+        self._save_stage_file("raw", raw_output.encode("utf-8"))
+        self.mark("raw", key)
+
+    def load_raw(self, key: str):
+        if self.info("raw", key) is None:
+            return None
+        try:
+            return self._load_stage_file("raw").decode("utf-8")
+        except (OSError, ValueError):
+            return None
+
+    def compact(self, mode: str = None) -> int:
+        """
+        Shrinks the intermediates of a finished script and returns the bytes freed. "compress"
+        gzips them in place (they still load as before); "drop" deletes the page images, which
+        are only needed to redo the extraction and are re-rendered (or taken from the artifact
+        cache) if that ever happens. The raw model output is always kept, so the LaTeX can be
+        rebuilt without another model call.
+        """
+        mode = (mode or os.getenv("CHECKPOINT_INTERMEDIATES", DEFAULT_CHECKPOINT_INTERMEDIATES)).strip().lower()
+        freed = 0
+        for stage, file_name in STAGE_FILES.items():
+            path = os.path.join(self.dir, file_name)
+            if mode == "drop" and stage == "pages":
+                for stale in (path, path + ".gz"):
+                    try:
+                        freed += os.path.getsize(stale)
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+                with self._lock:
+                    self.state["stages"].pop("pages", None)
+                    self._write_atomic(self._state_path(), json.dumps(self.state, indent=2).encode("utf-8"))
+            elif mode in ("compress", "drop") and os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                compressed = gzip.compress(data, compresslevel=6)
+                if len(compressed) >= len(data):
+                    continue  # Tiny or already-compressed content stays as it is
+                self._write_atomic(path + ".gz", compressed)
+                os.remove(path)
+                freed += len(data) - len(compressed)
+        return freed
+
+    def load_latex(self, key: str = None):
+        """The .tex in the output folder (including any hand edits) if the latex stage is done for `key`."""
+        if self.info("latex", key) is None or not os.path.exists(self.tex_path):
+            return None
+        with open(self.tex_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def pdf_up_to_date(self, latex: str) -> bool:
+        """True if the PDF on disk was compiled from exactly this LaTeX."""
+        return self.info("pdf", text_sha256(latex)) is not None and os.path.exists(self.pdf_path)
@@ -0,0 +1,61 @@
+#concurrency
+import os
+import threading
+from contextlib import contextmanager
+
+from utils.scheduler import FairSlots
+
+# Default number of scripts allowed in each pipeline stage at the same time.
+# Override per stage with RASTERIZE_CONCURRENCY, LLM_CONCURRENCY and COMPILE_CONCURRENCY.
+DEFAULT_STAGE_LIMITS = {
+    "rasterize": 2,
+    "llm": 4,
+    "compile": 2,
+}
+
+# Number of scripts in flight for a batch (each one moves through the stages above)
+DEFAULT_BATCH_CONCURRENCY = 8
+
+_stage_slots = {}
+_slots_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def stage_limit(stage: str) -> int:
+    return _env_int(f"{stage.upper()}_CONCURRENCY", DEFAULT_STAGE_LIMITS[stage])
+
+
+def batch_concurrency() -> int:
+    return _env_int("BATCH_CONCURRENCY", DEFAULT_BATCH_CONCURRENCY)
+
+
+def _get_slots(stage: str) -> FairSlots:
+    with _slots_lock:
+        if stage not in _stage_slots:
+            _stage_slots[stage] = FairSlots(stage, stage_limit(stage))
+        return _stage_slots[stage]
+
+
+@contextmanager
+def stage_slot(stage: str):
+    """
+    Holds one slot of the given pipeline stage ("rasterize", "llm" or "compile") for the
+    duration of the block, so a batch never runs more of that stage at once than its limit.
+    When the stage is full, slots go to waiting scripts in weighted fair order of their exam
+    sessions, previews first (see utils/scheduler.py), not to whichever thread asked first.
+    """
+    with _get_slots(stage).slot():
+        yield
+
+
+def stage_stats():
+    """Limit, slots in use, queue depth and wait times of every stage used so far."""
+    with _slots_lock:
+        slots = dict(_stage_slots)
+    return {stage: stage_slots.snapshot() for stage, stage_slots in slots.items()}
@@ -25,6 +25,10 @@ def _normalize_to_list(parsed_obj) -> List[Dict]:
     if isinstance(parsed_obj, list):
         return parsed_obj
 
+    if isinstance(parsed_obj, dict) and isinstance(parsed_obj.get("answers"), list):
+        # JSON-mode responses wrap the list: {"answers": [...]}
+        return parsed_obj["answers"]
+
     if isinstance(parsed_obj, dict):
         result = []
         for qno, val in parsed_obj.items():
@@ -79,3 +83,95 @@ def save_to_json_file(data: List[Dict], filename: str = "structured_answers.json
     with open(filename, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
     print(f"✅ Saved structured answers to {filename}")
+
+
+def _question_sort_key(question_number) -> tuple:
+    # Natural order: "2" < "10", "Q3" < "Q3b"
+    parts = re.split(r"(\d+)", str(question_number))
+    return tuple((0, int(p)) if p.isdigit() else (1, p.lower()) for p in parts if p)
+
+
+def _answer_text(value) -> str:
+    if isinstance(value, dict):
+        return str(value.get("answer", "")).strip()
+    return str(value or "").strip()
+
+
+def _subpart_items(subparts):
+    """
+    (label, content) pairs of a "subparts" value in any shape the model returns: a {label: content}
+    dict, a list of {"label"/"subpart", "answer"} dicts or bare strings (labelled a, b, c, ...),
+    A string (the whole answer, see merge_structured_answers), None or an empty value yields nothing.
+    """
+    if isinstance(subparts, dict):
+        return [(str(label), content) for label, content in subparts.items()]
+    if isinstance(subparts, list):
+        items = []
+        for index, content in enumerate(subparts):
+            label = chr(ord("a") + index) if index < 26 else str(index + 1)
+            if isinstance(content, dict):
+                label = str(content.get("label") or content.get("subpart") or label)
+            items.append((label, content))
+        return items
+    return []
+
+
+def _join_answer_text(first: str, second: str, min_overlap: int = 20) -> str:
+    """
+    Joins two fragments of the same answer. Overlapping pages are not transcribed twice (see
+    extract_answers_windowed); this only drops text a window repeated verbatim anyway.
+    """
+    if not first:
+        return second
+    if not second or second in first:
+        return first
+    if first in second:
+        return second
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+def merge_structured_answers(answer_lists: List[List[Dict]]) -> List[Dict]:
+    """
+    Merges answers extracted from several page windows of one script into a single list
+    (a single-window or structured-mode extraction is passed as a one-element list).
+
+    Items are matched by question_number (and subpart label). An answer that spans windows is
+    joined in window order; a fragment repeated verbatim across windows is only kept once.
+    The result is sorted by question number and every subpart, whatever its shape (see
+    _subpart_items), is normalised to {"answer": ...}, as convert_to_latex expects.
+    """
+    merged = {}
+    for answers in answer_lists:
+        for item in answers:
+            if not isinstance(item, dict):
+                continue
+            q_no = str(item.get("question_number", "Unknown")).strip()
+            entry = merged.setdefault(q_no, {"question_number": q_no})
+            if item.get("question") and not entry.get("question"):
+                entry["question"] = item["question"]
+
+            subpart_items = _subpart_items(item.get("subparts"))
+            if subpart_items:
+                subparts = entry.setdefault("subparts", {})
+                for label, content in subpart_items:
+                    previous = subparts.get(label, {}).get("answer", "")
+                    subparts[label] = {"answer": _join_answer_text(previous, _answer_text(content))}
+            elif "answer" in item:
+                entry["answer"] = _join_answer_text(entry.get("answer", ""), _answer_text(item["answer"]))
+            elif isinstance(item.get("subparts"), str):
+                # A question without parts sometimes comes back with its answer as "subparts"
+                entry["answer"] = _join_answer_text(entry.get("answer", ""), item["subparts"].strip())
+
+    result = []
+    for q_no in sorted(merged, key=_question_sort_key):
+        entry = merged[q_no]
+        if "subparts" in entry and entry.get("answer"):
+            # A question answered both as a whole and in parts keeps the whole answer as a subpart
+            entry["subparts"] = {"main": {"answer": entry.pop("answer")}, **entry["subparts"]}
+        elif "subparts" not in entry and not entry.get("answer"):
+            entry["answer"] = "Not answered"
+        result.append(entry)
+    return result
@@ -0,0 +1,305 @@
+#jobs
+import json
+import os
+import sqlite3
+import socket
+import threading
+import time
+import uuid
+
+from utils.scheduler import FairQueue, QueueStats, scheduling_context, DEFAULT_FLOW, BULK, INTERACTIVE, LANES
+
+# Job states. "queued" and "running" jobs are picked up again after a restart.
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED_STATES = (COMPLETED, FAILED)
+
+DEFAULT_JOBS_DB = "jobs.db"
+DEFAULT_JOB_WORKERS = 2
+# Extra workers that only run interactive jobs (single-script previews), so a preview never waits
+# for a bulk job to finish (INTERACTIVE_JOB_WORKERS env)
+DEFAULT_INTERACTIVE_JOB_WORKERS = 1
+# A running job whose progress has not moved for this long is assumed to belong to a dead worker
+DEFAULT_JOB_STALE_SECONDS = 900
+
+
+class JobStore:
+    """
+    Persistent job table backed by SQLite.
+
+    Every call opens its own connection, so the store can be shared freely between
+    request threads, background workers and separate worker processes.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.getenv("JOBS_DB", DEFAULT_JOBS_DB)
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    student TEXT,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    message TEXT,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id)")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_job(self, kind: str, payload: dict, job_id: str = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def update_job(self, job_id: str, status: str = None, result=None, error: str = None):
+        fields, values = ["updated_at = ?"], [time.time()]
+        if status is not None:
+            fields.append("status = ?")
+            values.append(status)
+        if result is not None:
+            fields.append("result = ?")
+            values.append(json.dumps(result))
+        if error is not None:
+            fields.append("error = ?")
+            values.append(error)
+        values.append(job_id)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(fields)} WHERE id = ?", values)
+
+    def get_job(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim_job(self, job_id: str, owner: str) -> bool:
+        """
+        Atomically moves a queued job to running for `owner`. Only one caller can win, so
+        several worker processes (or hosts) can share the same job table.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, owner, time.time(), job_id, QUEUED)
+            )
+        return cursor.rowcount == 1
+
+    def requeue_stale_jobs(self, stale_seconds: float):
+        """Puts running jobs without progress for `stale_seconds` (their worker died) back in the queue."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL WHERE status = ? AND updated_at < ?",
+                (QUEUED, RUNNING, time.time() - stale_seconds)
+            )
+        return cursor.rowcount
+
+    def pending_scripts(self, lane: str = None) -> int:
+        """Student scripts in queued or running jobs (of `lane` only, if given), across every worker process."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT payload FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        total = 0
+        for row in rows:
+            payload = json.loads(row["payload"])
+            if lane is None or payload.get("lane", BULK) == lane:
+                total += len(payload.get("student_pdfs") or [])
+        return total
+
+    def active_session_ids(self):
+        """IDs of the sessions that own a queued or running job, across every worker process."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT payload FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        return {json.loads(row["payload"]).get("session_id") for row in rows} - {None}
+
+    def unfinished_job_ids(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def add_event(self, job_id: str, stage: str, status: str, student: str = None, message: str = None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, student, stage, status, message, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, student, stage, status, message, now)
+            )
+            # Progress doubles as the heartbeat that keeps a running job from looking stale
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def events_since(self, job_id: str, last_event_id: int = 0):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM job_events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, last_event_id)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stage_progress(self, job_id: str):
+        """
+        Latest status of every stage for every student of a job, e.g.
+        {"student.pdf": {"rasterize": "finished", "ocr": "started"}}; job-level stages are under "_job".
+        """
+        progress = {}
+        for event in self.events_since(job_id):
+            progress.setdefault(event["student"] or "_job", {})[event["stage"]] = event["status"]
+        return progress
+
+
+class JobRunner:
+    """
+    Runs jobs from a JobStore on background worker threads.
+
+    handler(job, report) does the actual work and returns the JSON-serialisable job result;
+    report(stage, status, student=None, message=None) records a progress event.
+
+    Queued jobs are dispatched in weighted fair order of their flows rather than first come,
+    first served: schedule(job) returns (flow, weight, lane), e.g. the exam session, its weight
+    and "interactive" for a single-script preview. Interactive jobs go ahead of bulk ones and
+    also have workers of their own. The flow is kept for the job's run, so its pipeline stage
+    slots are shared fairly too (see utils/scheduler.py).
+    """
+
+    def __init__(self, store: JobStore, handler, max_workers: int = None, stale_seconds: float = None,
+                 schedule=None, interactive_workers: int = None):
+        self.store = store
+        self.handler = handler
+        self.schedule = schedule
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stale_seconds = stale_seconds or float(os.getenv("JOB_STALE_SECONDS", DEFAULT_JOB_STALE_SECONDS))
+        self.workers = max_workers or int(os.getenv("JOB_WORKERS", DEFAULT_JOB_WORKERS))
+        self.interactive_workers = interactive_workers if interactive_workers is not None else \
+            int(os.getenv("INTERACTIVE_JOB_WORKERS", DEFAULT_INTERACTIVE_JOB_WORKERS))
+        self.stats = QueueStats("jobs")
+        self._queue = FairQueue()
+        self._ready = threading.Condition()
+        self._running = {lane: 0 for lane in LANES}
+        self._submitted = set()
+        self._lock = threading.Lock()
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, args=(LANES,), name=f"job-{i}", daemon=True).start()
+        for i in range(self.interactive_workers):
+            threading.Thread(target=self._worker, args=((INTERACTIVE,),), name=f"job-interactive-{i}",
+                             daemon=True).start()
+
+    def _schedule(self, job_id: str):
+        job = self.store.get_job(job_id) if self.schedule else None
+        if job is None:
+            return DEFAULT_FLOW, 1.0, BULK
+        try:
+            return self.schedule(job)
+        except Exception as e:  # A bad schedule must never lose the job
+            print(f"Warning: could not schedule job {job_id}, running it as bulk: {e}")
+            return DEFAULT_FLOW, 1.0, BULK
+
+    def submit(self, job_id: str):
+        with self._lock:
+            if job_id in self._submitted:
+                return
+            self._submitted.add(job_id)
+        flow, weight, lane = self._schedule(job_id)
+        with self._ready:
+            self._queue.push((job_id, weight), flow, weight, lane)
+            self._ready.notify_all()
+
+    def _worker(self, lanes):
+        while True:
+            with self._ready:
+                while not self._queue.has(lanes):
+                    self._ready.wait()
+                (job_id, weight), flow, lane, waited = self._queue.pop(lanes)
+                self._running[lane] += 1
+            self.stats.record(lane, waited)
+            try:
+                with scheduling_context(flow, weight, lane):
+                    self._run(job_id)
+            except Exception as e:
+                print(f"❌ Job worker error on {job_id}: {e}")
+            finally:
+                with self._ready:
+                    self._running[lane] -= 1
+
+    def queue_stats(self):
+        """Jobs waiting (per lane and flow) and running in this process, and their wait times so far."""
+        with self._ready:
+            depths = self._queue.depths()
+            running = dict(self._running)
+        return {"workers": self.workers, "interactive_workers": self.interactive_workers,
+                "queued": depths["lanes"], "queued_by_flow": depths["flows"], "running": running,
+                "served": self.stats.snapshot()}
+
+    def resume_unfinished(self):
+        """
+        Picks up queued jobs and re-queues running ones whose worker stopped reporting progress.
+        Jobs still running in another live worker are left alone; claim_job keeps each job to one runner.
+        """
+        self.store.requeue_stale_jobs(self.stale_seconds)
+        job_ids = [job_id for job_id in self.store.unfinished_job_ids()
+                   if self.store.get_job(job_id)["status"] == QUEUED]
+        for job_id in job_ids:
+            self.submit(job_id)
+        return job_ids
+
+    def _run(self, job_id: str):
+        try:
+            if self.store.claim_job(job_id, self.owner):  # False if another worker already took it
+                self._execute(job_id)
+        finally:
+            with self._lock:
+                self._submitted.discard(job_id)
+
+    def _execute(self, job_id: str):
+        job = self.store.get_job(job_id)
+
+        def report(stage, status, student=None, message=None):
+            self.store.add_event(job_id, stage, status, student=student, message=message)
+
+        report("job", RUNNING)
+        try:
+            result = self.handler(job, report)
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            self.store.update_job(job_id, status=FAILED, error=str(e))
+            report("job", FAILED, message=str(e))
+        else:
+            self.store.update_job(job_id, status=COMPLETED, result=result)
+            report("job", COMPLETED)
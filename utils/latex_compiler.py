@@ -0,0 +1,156 @@
+#latex_compiler
+import hashlib
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+
+from utils.cache import copy_atomic
+from utils.concurrency import stage_slot
+from utils.latex_generator import STANDARD_PREAMBLE
+
+# Seconds before a runaway pdflatex run is killed (LATEX_TIMEOUT env)
+DEFAULT_COMPILE_TIMEOUT = 120
+# Where precompiled preamble formats are kept (LATEX_FORMAT_DIR env)
+DEFAULT_FORMAT_DIR = os.path.join("tmp", "latex_formats")
+
+_format_lock = threading.Lock()
+_format_names = {}  # preamble hash -> format name, or None if building it failed
+
+
+def _run(command, cwd, timeout, env=None):
+    """
+    Runs a TeX command in its own process group and kills the whole group on timeout.
+    Returns (returncode, output); returncode is None if the run timed out.
+    """
+    process = subprocess.Popen(
+        command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL, text=True, errors="replace", start_new_session=True
+    )
+    try:
+        output, _ = process.communicate(timeout=timeout)
+        return process.returncode, output
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        output, _ = process.communicate()
+        return None, output
+
+
+def _format_dir():
+    return os.path.abspath(os.getenv("LATEX_FORMAT_DIR", DEFAULT_FORMAT_DIR))
+
+
+def _preamble_hash(preamble: str) -> str:
+    return hashlib.sha256(preamble.encode("utf-8")).hexdigest()[:16]
+
+
+def source_line_offset(tex_source: str) -> int:
+    """
+    Number of source lines not seen by pdflatex because they were compiled into the preamble
+    format; add it to a log's "l.<n>" line numbers to find the line in `tex_source`.
+    """
+    if not tex_source.startswith(STANDARD_PREAMBLE):
+        return 0
+    with _format_lock:
+        format_name = _format_names.get(_preamble_hash(STANDARD_PREAMBLE))
+    return STANDARD_PREAMBLE.count("\n") if format_name else 0
+
+
+def _ensure_format(preamble: str, timeout: float):
+    """
+    Dumps `preamble` into a pdflatex format file once per process (and reuses one already on disk),
+    so documents starting with it skip loading the class and packages on every compile.
+    Returns the format name, or None if the format could not be built.
+    """
+    preamble_hash = _preamble_hash(preamble)
+    with _format_lock:
+        if preamble_hash in _format_names:
+            return _format_names[preamble_hash]
+
+        format_name = f"preamble_{preamble_hash}"
+        format_dir = _format_dir()
+        if not os.path.exists(os.path.join(format_dir, f"{format_name}.fmt")):
+            os.makedirs(format_dir, exist_ok=True)
+            build_dir = tempfile.mkdtemp(prefix="latex-format-")
+            try:
+                with open(os.path.join(build_dir, "preamble.tex"), "w", encoding="utf-8") as f:
+                    f.write(preamble + "\\dump\n")
+                returncode, output = _run(
+                    ["pdflatex", "-ini", "-interaction=nonstopmode", f"-jobname={format_name}",
+                     "&pdflatex", "preamble.tex"],
+                    cwd=build_dir, timeout=timeout
+                )
+                built_format = os.path.join(build_dir, f"{format_name}.fmt")
+                if returncode != 0 or not os.path.exists(built_format):
+                    print(f"⚠️ Could not precompile the LaTeX preamble, falling back to full compiles:\n{output[-2000:]}")
+                    format_name = None
+                else:
+                    shutil.move(built_format, os.path.join(format_dir, f"{format_name}.fmt"))
+            except OSError as e:
+                print(f"⚠️ Could not precompile the LaTeX preamble: {e}")
+                format_name = None
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+
+        _format_names[preamble_hash] = format_name
+        return format_name
+
+
+def compile_latex(tex_source: str, job_name: str, output_dir: str, timeout: float = None):
+    """
+    Compiles a LaTeX document into output_dir/<job_name>.pdf.
+
+    Each run works in its own temporary directory, so concurrent jobs never share
+    .aux/.log files, and holds a "compile" stage slot (COMPILE_CONCURRENCY bounds the
+    number of pdflatex workers). Documents that start with the standard preamble are
+    compiled against a precompiled format. Runs longer than LATEX_TIMEOUT are killed.
+
+    Returns:
+        tuple[str | None, str]: The path of the generated PDF (None on failure) and the
+        pdflatex log (or an error message).
+    """
+    timeout = timeout or float(os.getenv("LATEX_TIMEOUT", DEFAULT_COMPILE_TIMEOUT))
+    work_dir = tempfile.mkdtemp(prefix="latex-")
+    try:
+        with stage_slot("compile"):
+            command = ["pdflatex", "-interaction=nonstopmode", "-jobname=document"]
+            env = None
+            source = tex_source
+            if tex_source.startswith(STANDARD_PREAMBLE):
+                format_name = _ensure_format(STANDARD_PREAMBLE, timeout)
+                if format_name:
+                    # The preamble is already in the format; only the rest of the document is read
+                    source = tex_source[len(STANDARD_PREAMBLE):]
+                    command.append(f"-fmt={format_name}")
+                    env = dict(os.environ, TEXFORMATS=_format_dir() + os.pathsep)
+
+            with open(os.path.join(work_dir, "document.tex"), "w", encoding="utf-8") as f:
+                f.write(source)
+            try:
+                returncode, output = _run(command + ["document.tex"], cwd=work_dir, timeout=timeout, env=env)
+            except FileNotFoundError:
+                return None, "pdflatex command not found. Please ensure LaTeX is installed and in your PATH."
+
+        log_path = os.path.join(work_dir, "document.log")
+        if os.path.exists(log_path):
+            with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+                log = f.read()
+        else:
+            log = output
+
+        if returncode is None:
+            return None, f"pdflatex timed out after {timeout:.0f}s\n{log}"
+        pdf_path = os.path.join(work_dir, "document.pdf")
+        if returncode != 0 or not os.path.exists(pdf_path):
+            return None, log
+
+        os.makedirs(output_dir, exist_ok=True)
+        final_pdf_path = os.path.join(output_dir, f"{job_name}.pdf")
+        # The work dir is usually on another filesystem, where shutil.move would rewrite the existing
+        # PDF in place; copying next to it and renaming always swaps in a new file instead
+        copy_atomic(pdf_path, final_pdf_path)
+        return final_pdf_path, log
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,63 +1,106 @@
 #latex_generator.py
 import re
+
+# Fixed package set shared by every generated document. The compiler precompiles it into a
+# format file (see utils/latex_compiler.py), so keep per-document lines such as \title out of it.
+STANDARD_PREAMBLE_LINES = [
+    r"\documentclass[12pt]{article}",
+    r"\usepackage[utf8]{inputenc}",
+    r"\usepackage{amsmath, amsfonts, amssymb}",
+    r"\usepackage{geometry}",
+    r"\geometry{margin=1in}",
+]
+STANDARD_PREAMBLE = "\n".join(STANDARD_PREAMBLE_LINES) + "\n"
+
+
+# LaTeX special characters, replaced in this order with str.replace (one C-level pass per character
+# present, which beats a per-match regex callback on answer text). Backslashes are parked on a
+# placeholder first, so the braces of \textbackslash{} are not escaped again; the placeholder is a
+# control character, and those are removed (pdflatex rejects them) before any replacement.
+LATEX_ESCAPES = (
+    ("\\", "\x00"),
+    ("{", r"\{"),
+    ("}", r"\}"),
+    ("\x00", r"\textbackslash{}"),
+    ("_", r"\_"),
+    ("&", r"\&"),
+    ("%", r"\%"),
+    ("$", r"\$"),
+    ("#", r"\#"),
+    ("~", r"\textasciitilde{}"),
+    ("^", r"\^{}"),
+)
+_CONTROL_CHARACTERS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+
 def escape_latex(text):
-    replacements = {
-        "_": r"\_",
-        "&": r"\&",
-        "%": r"\%",
-        "$": r"\$",
-        "#": r"\#",
-        "{": r"\{",
-        "对了": r"\}",  # Corrected for proper LaTeX escape for '}'
-        "~": r"\textasciitilde{}",
-        "^": r"\^{}",
-        "\\": r"\textbackslash{}",
-    }
-    return re.sub(r'([_&%$#{}\\~^])', lambda m: replacements[m.group()], text)
-
-
-def convert_to_latex(structured_list, student_name="Student"):  # Removed output_tex_path
-    latex_lines = [
-        r"\documentclass[12pt]{article}",
-        r"\usepackage[utf8]{inputenc}",
-        r"\usepackage{amsmath, amsfonts, amssymb}",
-        r"\usepackage{geometry}",
-        r"\geometry{margin=1in}",
-        rf"\title{{Answer Sheet - {escape_latex(student_name)}}}",
-        r"\date{}",
-        r"\begin{document}",
-        r"\maketitle",
-        ""
-    ]
+    """Escapes `text` (converted with str() if needed) for use as ordinary LaTeX text."""
+    text = _CONTROL_CHARACTERS.sub("", str(text))
+    for char, replacement in LATEX_ESCAPES:
+        if char in text:
+            text = text.replace(char, replacement)
+    return text
+
+
+def _answer_value(content):
+    # A subpart is normally {"answer": ...}, but a bare string or None must not break rendering
+    if isinstance(content, dict):
+        return content.get("answer", "Not answered")
+    return content if content not in (None, "") else "Not answered"
+
 
+def _render_answer(item):
+    # One question as a single string: section heading, then each (sub)answer, then a blank line
+    parts = [r"\section*{Question ", escape_latex(item.get("question_number", "Unknown")), "}\n"]
+    if "subparts" in item:
+        for sub_label, sub_content in item["subparts"].items():
+            parts += [r"\subsection*{(", escape_latex(sub_label), ")}\n\\textbf{Answer:}\n",
+                      escape_latex(_answer_value(sub_content)), "\n"]
+    else:
+        parts += ["\\textbf{Answer:}\n", escape_latex(item.get("answer", "Not answered")), "\n"]
+    parts.append("\n")
+    return "".join(parts)
+
+
+def iter_latex_document(structured_list, student_name="Student"):
+    """
+    Yields the LaTeX answer sheet for structured answers chunk by chunk (the preamble and title,
+    then one chunk per question), in a single pass over the answers.
+    """
+    yield (f"{STANDARD_PREAMBLE}\\title{{Answer Sheet - {escape_latex(student_name)}}}\n"
+           "\\date{}\n\\begin{document}\n\\maketitle\n\n")
     for item in structured_list:
-        q_no = item.get("question_number", "Unknown")
-        # Ensure 'Question ' is always present before escaping
-        latex_lines.append(r"\section*{Question " + escape_latex(str(q_no)) + "}")  # Ensure q_no is string
-
-        if "subparts" in item:
-            for sub_label, sub_content in item["subparts"].items():
-                ans = sub_content.get("answer", "Not answered")
-                latex_lines.append(
-                    r"\subsection*{(" + escape_latex(str(sub_label)) + ")}")  # Ensure sub_label is string
-                latex_lines.append(r"\textbf{Answer:}")
-                latex_lines.append(escape_latex(ans))
-        else:
-            ans = item.get("answer", "Not answered")
-            latex_lines.append(r"\textbf{Answer:}")
-            latex_lines.append(escape_latex(ans))
-
-        latex_lines.append("")
-
-    latex_lines.append(r"\end{document}")
-
-    latex_content = "\n".join(latex_lines)
-
-    # You can still write to a file *here* for debugging/inspection if needed
-    # but the primary purpose of this function becomes returning the string.
-    # if output_tex_path:
-    #     with open(output_tex_path, "w", encoding="utf-8") as f:
-    #         f.write(latex_content)
-    #     print(f"📄 LaTeX file saved as: {output_tex_path}")
-
-    return latex_content  # Return the generated LaTeX string
\ No newline at end of file
+        yield _render_answer(item)
+    yield r"\end{document}"
+
+
+def write_latex_document(structured_list, f, student_name="Student"):
+    """Streams the answer sheet into the text file object `f` without building it in memory."""
+    for chunk in iter_latex_document(structured_list, student_name):
+        f.write(chunk)
+
+
+def convert_to_latex(structured_list, student_name="Student"):
+    """The answer sheet for structured answers as one LaTeX string."""
+    return "".join(iter_latex_document(structured_list, student_name))
+
+
+def convert_question_to_latex(question_number, records, question_text=None):
+    """
+    One question across all students as a LaTeX document: a section per student holding their
+    recorded answer fragments ([{"student", "subpart", "latex"}], already LaTeX) in order.
+    """
+    parts = [f"{STANDARD_PREAMBLE}\\title{{Question {escape_latex(question_number)} - All Answers}}\n"
+             "\\date{}\n\\begin{document}\n\\maketitle\n\n"]
+    if question_text:
+        parts.append(f"\\noindent\\textbf{{Question:}} {escape_latex(question_text)}\n\n")
+    student = None
+    for record in records:
+        if record["student"] != student:
+            student = record["student"]
+            parts.append(f"\\section*{{{escape_latex(student)}}}\n")
+        if record.get("subpart"):
+            parts.append(f"\\subsection*{{({escape_latex(record['subpart'])})}}\n")
+        parts.append(record["latex"] + "\n\n")
+    parts.append(r"\end{document}")
+    return "".join(parts)
@@ -0,0 +1,405 @@
+#latex_repair
+import json
+import os
+import re
+
+from utils.concurrency import stage_slot
+from utils.latex_compiler import compile_latex, source_line_offset
+from utils.llm_client import get_llm_client
+
+# Repair of documents that fail to compile (override with the LATEX_REPAIR_* env variables).
+# Errors are parsed from the pdflatex log and fixed locally first; only if that fails is a small
+# text-only request sent to the model, holding the errors and the offending lines (never the pages).
+DEFAULT_REPAIR_ROUNDS = 3  # Local fix + recompile rounds; 0 disables repair
+DEFAULT_REPAIR_MODEL = "gpt-4o-mini"
+REPAIR_CONTEXT_LINES = 3  # Lines sent either side of each offending line
+REPAIR_MAX_LINES = 60
+REPAIR_MAX_ERRORS = 5
+TEX_LOG_WIDTH = 79
+
+# Packages that define environments and commands the model commonly uses without loading them
+ENVIRONMENT_PACKAGES = {
+    "align": "amsmath", "align*": "amsmath", "gather": "amsmath", "gather*": "amsmath",
+    "multline": "amsmath", "multline*": "amsmath", "cases": "amsmath", "pmatrix": "amsmath",
+    "bmatrix": "amsmath", "vmatrix": "amsmath", "equation*": "amsmath", "tikzpicture": "tikz",
+    "lstlisting": "listings", "algorithmic": "algpseudocode", "tabularx": "tabularx",
+}
+COMMAND_PACKAGES = {
+    r"\mathbb": "amssymb", r"\checkmark": "amssymb", r"\text": "amsmath", r"\boxed": "amsmath",
+    r"\includegraphics": "graphicx", r"\textcolor": "xcolor", r"\url": "url", r"\cancel": "cancel",
+    r"\SI": "siunitx", r"\si": "siunitx", r"\ce": "mhchem",
+}
+# Undefined shorthands with a standard meaning
+COMMAND_REPLACEMENTS = {
+    r"\R": r"\mathbb{R}", r"\N": r"\mathbb{N}", r"\Z": r"\mathbb{Z}", r"\Q": r"\mathbb{Q}",
+    r"\C": r"\mathbb{C}", r"\degree": r"^\circ", r"\tick": r"\checkmark",
+}
+# Characters pdflatex's utf8 input encoding has no definition for
+UNICODE_REPLACEMENTS = {
+    "\u00a0": "~", "\u200b": "", "\ufeff": "", "\u2018": "`", "\u2019": "'", "\u201c": "``", "\u201d": "''",
+    "\u2013": "--", "\u2014": "---", "\u2026": r"\ldots{}", "\u2022": r"\textbullet{}", "\u2212": "-",
+    "\u00b0": r"\ensuremath{^\circ}", "\u00b2": r"\ensuremath{^{2}}", "\u00b3": r"\ensuremath{^{3}}",
+    "\u00bd": r"\ensuremath{\frac{1}{2}}", "\u00d7": r"\ensuremath{\times}", "\u00f7": r"\ensuremath{\div}",
+    "\u00b1": r"\ensuremath{\pm}", "\u2264": r"\ensuremath{\leq}", "\u2265": r"\ensuremath{\geq}",
+    "\u2260": r"\ensuremath{\neq}", "\u2248": r"\ensuremath{\approx}", "\u221e": r"\ensuremath{\infty}",
+    "\u2192": r"\ensuremath{\rightarrow}", "\u2190": r"\ensuremath{\leftarrow}",
+    "\u21d2": r"\ensuremath{\Rightarrow}", "\u21d4": r"\ensuremath{\Leftrightarrow}",
+    "\u221a": r"\ensuremath{\surd}", "\u2211": r"\ensuremath{\sum}", "\u222b": r"\ensuremath{\int}",
+    "\u2208": r"\ensuremath{\in}", "\u2209": r"\ensuremath{\notin}", "\u2282": r"\ensuremath{\subset}",
+    "\u222a": r"\ensuremath{\cup}", "\u2229": r"\ensuremath{\cap}", "\u2200": r"\ensuremath{\forall}",
+    "\u2203": r"\ensuremath{\exists}", "\u2202": r"\ensuremath{\partial}", "\u2206": r"\ensuremath{\Delta}",
+    "\u0394": r"\ensuremath{\Delta}", "\u03b1": r"\ensuremath{\alpha}", "\u03b2": r"\ensuremath{\beta}",
+    "\u03b3": r"\ensuremath{\gamma}", "\u03b4": r"\ensuremath{\delta}", "\u03b5": r"\ensuremath{\epsilon}",
+    "\u03b8": r"\ensuremath{\theta}", "\u03bb": r"\ensuremath{\lambda}", "\u03bc": r"\ensuremath{\mu}",
+    "\u03c0": r"\ensuremath{\pi}", "\u03c3": r"\ensuremath{\sigma}", "\u03a3": r"\ensuremath{\Sigma}",
+    "\u03c6": r"\ensuremath{\phi}", "\u03c9": r"\ensuremath{\omega}", "\u03a9": r"\ensuremath{\Omega}",
+}
+
+REPAIR_SYSTEM_PROMPT = (
+    "You fix LaTeX compile errors. You are given pdflatex error messages and numbered lines of the "
+    "document around each error. Change as little as possible and never alter the content of the answers. "
+    'Reply with JSON only: {"lines": [{"line": <number>, "text": "<corrected line>"}]}, listing just the '
+    "lines you changed (use an empty text to delete a line)."
+)
+
+_ERROR_LINE = re.compile(r"^l\.(\d+) ?(.*)$")
+_MATH_SEGMENT = re.compile(r"(\$\$.*?\$\$|(?<!\\)\$.*?(?<!\\)\$|\\\(.*?\\\)|\\\[.*?\\\])")
+_ENVIRONMENT = re.compile(r"\\(begin|end)\{([^}]+)\}")
+_TRAILING_COMMAND = re.compile(r"(\\[A-Za-z@]+)\*?\s*$")
+
+
+def repair_rounds():
+    return int(os.getenv("LATEX_REPAIR_ROUNDS", DEFAULT_REPAIR_ROUNDS))
+
+
+def llm_repair_enabled():
+    return os.getenv("LATEX_REPAIR_LLM", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _classify(message):
+    if "not found" in message and ".sty" in message:
+        return "missing_package"
+    if "Unicode character" in message or "Invalid UTF-8" in message:
+        return "unicode"
+    if "Misplaced alignment tab character" in message:
+        return "unescaped_ampersand"
+    if "Missing $ inserted" in message:
+        return "math_outside_math"
+    if "Undefined control sequence" in message:
+        return "undefined_command"
+    if re.search(r"Environment \S+ undefined", message):
+        return "undefined_environment"
+    if "ended by \\end" in message or "\\begin{document} ended" in message or "Extra \\end" in message:
+        return "unbalanced_environment"
+    if any(text in message for text in ("Extra }", "Missing } inserted", "Runaway argument",
+                                        "File ended while scanning", "Paragraph ended before")):
+        return "unbalanced_braces"
+    if "Emergency stop" in message or "no legal \\end found" in message:
+        return "missing_end"
+    return "other"
+
+
+def parse_latex_errors(log: str):
+    """
+    The errors in a pdflatex log, in order, as dicts with "kind", "message", "line" (the 1-based
+    line number pdflatex reported, or None) and "context" (the source text up to the error).
+    """
+    lines = log.splitlines()
+    errors = []
+    for index, line in enumerate(lines):
+        if line.startswith("*** (job aborted, no legal \\end found)"):
+            errors.append({"kind": "missing_end", "message": line, "line": None, "context": ""})
+        if not line.startswith("! "):
+            continue
+        message = line[2:].strip()
+        # TeX wraps log lines at 79 characters, so long messages (e.g. missing files) continue on the next line
+        if len(line) >= TEX_LOG_WIDTH and index + 1 < len(lines):
+            message += lines[index + 1].strip()
+        error = {"kind": _classify(message), "message": message, "line": None, "context": ""}
+        for follow in lines[index + 1:index + 12]:
+            match = _ERROR_LINE.match(follow)
+            if match:
+                error["line"] = int(match.group(1))
+                error["context"] = match.group(2)
+                break
+            if follow.startswith("! "):
+                break
+        errors.append(error)
+    return errors
+
+
+def _locate(tex_lines, error, offset):
+    """0-based index in tex_lines of the line an error points at, or None."""
+    if error["line"] is None:
+        return None
+    context = error["context"].strip()[-30:]
+    candidates = [error["line"] - 1 + offset, error["line"] - 1]
+    candidates = [index for index in dict.fromkeys(candidates) if 0 <= index < len(tex_lines)]
+    for index in candidates:
+        if context and context in tex_lines[index]:
+            return index
+    return candidates[0] if candidates else None
+
+
+def _escape_outside_math(line, chars):
+    parts = _MATH_SEGMENT.split(line)
+    for i in range(0, len(parts), 2):  # Even parts are outside math
+        for char in chars:
+            escaped = r"\^{}" if char == "^" else "\\" + char
+            parts[i] = re.sub(r"(?<!\\)" + re.escape(char), lambda _: escaped, parts[i])
+    return "".join(parts)
+
+
+def _document_start(tex_lines):
+    return next((i for i, line in enumerate(tex_lines) if r"\begin{document}" in line), 0)
+
+
+def _add_package(tex_lines, package):
+    if any(re.search(r"\\usepackage(\[[^\]]*\])?\{[^}]*\b" + re.escape(package) + r"\b", line) for line in tex_lines):
+        return False
+    # Inserted just before \begin{document}, so the standard preamble (and its precompiled format) stays intact
+    tex_lines.insert(_document_start(tex_lines), rf"\usepackage{{{package}}}")
+    return True
+
+
+def _drop_package(tex_lines, package):
+    pattern = re.compile(r"\\usepackage(\[[^\]]*\])?\{([^}]*)\}")
+    for index, line in enumerate(tex_lines):
+        match = pattern.search(line)
+        if not match:
+            continue
+        names = [name.strip() for name in match.group(2).split(",")]
+        if package not in names:
+            continue
+        names.remove(package)
+        replacement = rf"\usepackage{match.group(1) or ''}{{{', '.join(names)}}}" if names else ""
+        tex_lines[index] = line[:match.start()] + replacement + line[match.end():]
+        return True
+    return False
+
+
+def balance_braces(tex_lines):
+    """Drops unmatched closing braces in the document body and closes any left open before \\end{document}."""
+    depth, changed = 0, False
+    start = _document_start(tex_lines)
+    for index in range(start, len(tex_lines)):
+        line, out, i = tex_lines[index], [], 0
+        while i < len(line):
+            char = line[i]
+            if char == "\\":
+                out.append(line[i:i + 2])
+                i += 2
+                continue
+            if char == "%":
+                out.append(line[i:])
+                break
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                if depth == 0:
+                    changed = True
+                    i += 1
+                    continue
+                depth -= 1
+            out.append(char)
+            i += 1
+        tex_lines[index] = "".join(out)
+    if depth > 0:
+        end = next((i for i in range(len(tex_lines) - 1, -1, -1) if r"\end{document}" in tex_lines[i]), len(tex_lines))
+        tex_lines.insert(end, "}" * depth)
+        changed = True
+    return changed
+
+
+def balance_environments(tex_lines):
+    """Drops unmatched \\end{...}, closes environments left open and makes sure the document is ended."""
+    start = _document_start(tex_lines)
+    body = "\n".join(tex_lines[start:])
+    stack, changed = [], False
+
+    def fix(match):
+        nonlocal changed
+        kind, name = match.groups()
+        if name == "document":
+            return match.group(0)
+        if kind == "begin":
+            stack.append(name)
+            return match.group(0)
+        if stack and stack[-1] == name:
+            stack.pop()
+            return match.group(0)
+        changed = True
+        if name in stack:
+            closing = ""
+            while stack[-1] != name:
+                closing += rf"\end{{{stack.pop()}}}"
+            stack.pop()
+            return closing + match.group(0)
+        return ""
+
+    body = _ENVIRONMENT.sub(fix, body)
+    if r"\end{document}" not in body:
+        body = body.rstrip("\n") + "\n\\end{document}\n"
+        changed = True
+    if stack:
+        closing = "\n".join(rf"\end{{{name}}}" for name in reversed(stack))
+        position = body.rfind(r"\end{document}")
+        body = body[:position] + closing + "\n" + body[position:]
+        changed = True
+    if changed:
+        tex_lines[start:] = body.split("\n")
+    return changed
+
+
+def apply_local_fixes(tex_source: str, errors):
+    """
+    Fixes the errors that have a known mechanical fix. Returns (fixed LaTeX, list of fixes applied);
+    the list is empty if nothing could be changed.
+    """
+    tex_lines = tex_source.split("\n")
+    offset = source_line_offset(tex_source)
+    fixes, packages = [], []
+    # Resolve every line first; packages are added last, as inserting lines shifts the line numbers
+    located = [(error, _locate(tex_lines, error, offset)) for error in errors]
+    for error, index in located:
+        kind = error["kind"]
+        if kind == "missing_package":
+            match = re.search(r"File `([^']+)\.sty' not found", error["message"])
+            if match and _drop_package(tex_lines, match.group(1)):
+                fixes.append(f"dropped package {match.group(1)}")
+        elif kind == "unicode":
+            text = "\n".join(tex_lines)
+            # Only characters with a known LaTeX equivalent are mapped; anything else (Greek, CJK, ...) is
+            # student content and is left for the model fix rather than deleted
+            fixed = "".join(UNICODE_REPLACEMENTS.get(char, char) for char in text)
+            if fixed != text:
+                tex_lines = fixed.split("\n")
+                fixes.append("replaced unsupported Unicode characters")
+        elif kind in ("unescaped_ampersand", "math_outside_math", "unbalanced_braces") and index is not None:
+            chars = {"unescaped_ampersand": "&", "math_outside_math": "_^"}.get(kind, "")
+            line = _escape_outside_math(tex_lines[index], chars) if chars else tex_lines[index]
+            # A bare "%" after a number silently comments out the rest of the line
+            line = re.sub(r"(?<=\d)%", r"\\%", line)
+            if line != tex_lines[index]:
+                tex_lines[index] = line
+                fixes.append(f"escaped special characters on line {index + 1}")
+        elif kind == "undefined_environment":
+            match = re.search(r"Environment (\S+) undefined", error["message"])
+            package = ENVIRONMENT_PACKAGES.get(match.group(1)) if match else None
+            if package:
+                packages.append(package)
+        elif kind == "undefined_command" and index is not None:
+            match = _TRAILING_COMMAND.search(error["context"])
+            command = match.group(1) if match else None
+            if command in COMMAND_PACKAGES:
+                packages.append(COMMAND_PACKAGES[command])
+            elif command:
+                pattern = re.escape(command) + r"(?![A-Za-z])"
+                replacement = COMMAND_REPLACEMENTS.get(command, command[1:])
+                line = re.sub(pattern, lambda _: replacement, tex_lines[index])
+                if line != tex_lines[index]:
+                    tex_lines[index] = line
+                    fixes.append(f"replaced undefined {command} on line {index + 1}")
+
+    for package in dict.fromkeys(packages):
+        if _add_package(tex_lines, package):
+            fixes.append(f"added package {package}")
+
+    kinds = {error["kind"] for error in errors}
+    # Environments first, so braces opened around an environment are closed after it
+    if kinds & {"unbalanced_environment", "missing_end", "unbalanced_braces"} and balance_environments(tex_lines):
+        fixes.append("balanced environments")
+    if kinds & {"unbalanced_braces", "missing_end"} and balance_braces(tex_lines):
+        fixes.append("balanced braces")
+    return "\n".join(tex_lines), fixes
+
+
+def request_llm_fix(tex_source: str, errors):
+    """
+    Asks the model to fix the offending lines. Only the error messages and a few numbered lines around
+    each error are sent. Returns the patched LaTeX, or None if there was nothing to send or no usable reply.
+    """
+    tex_lines = tex_source.split("\n")
+    offset = source_line_offset(tex_source)
+    errors = errors[:REPAIR_MAX_ERRORS]
+    window = set()
+    for error in errors:
+        index = _locate(tex_lines, error, offset)
+        if index is not None:
+            window.update(range(max(0, index - REPAIR_CONTEXT_LINES), min(len(tex_lines), index + REPAIR_CONTEXT_LINES + 1)))
+    if not window:
+        return None
+    window = sorted(window)[:REPAIR_MAX_LINES]
+    numbered = "\n".join(f"{index + 1}: {tex_lines[index]}" for index in window)
+    messages = [
+        {"role": "system", "content": REPAIR_SYSTEM_PROMPT},
+        {"role": "user", "content": "Errors:\n" + "\n".join(error["message"] for error in errors)
+                                    + "\n\nLines:\n" + numbered},
+    ]
+    with stage_slot("llm"):
+        reply = get_llm_client().chat(
+            messages,
+            model=os.getenv("LATEX_REPAIR_MODEL", DEFAULT_REPAIR_MODEL),
+            temperature=0,
+            max_tokens=2000,
+            response_format={"type": "json_object"},
+        )
+    try:
+        changes = json.loads(reply).get("lines", [])
+    except (TypeError, ValueError, AttributeError):
+        print("⚠️ Unusable LaTeX fix from the model")
+        return None
+
+    allowed = set(window)
+    changed = False
+    for change in changes:
+        try:
+            index = int(change["line"]) - 1
+            text = str(change["text"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if index in allowed and tex_lines[index] != text:  # Lines outside what was sent are never touched
+            tex_lines[index] = text
+            changed = True
+    return "\n".join(tex_lines) if changed else None
+
+
+def repair_latex(tex_source: str, log: str, job_name: str, output_dir: str):
+    """
+    Repair loop for a document that failed to compile with `log`: local fixes and a recompile for up to
+    LATEX_REPAIR_ROUNDS rounds, then (if LATEX_REPAIR_LLM is on) one text-only fix request to the model.
+
+    Returns:
+        tuple[str | None, str, str, list[str]]: The compiled PDF path (None if still failing), the last
+        log, the LaTeX last compiled and the fixes applied.
+    """
+    rounds = repair_rounds()
+    if rounds <= 0 or not log or log.startswith(("pdflatex timed out", "pdflatex command not found")):
+        return None, log, tex_source, []
+
+    fixes = []
+    for _ in range(rounds):
+        fixed, applied = apply_local_fixes(tex_source, parse_latex_errors(log))
+        if not applied or fixed == tex_source:
+            break
+        print(f"🔧 LaTeX repair for {job_name}: {', '.join(applied)}")
+        fixes.extend(applied)
+        tex_source = fixed
+        pdf_path, log = compile_latex(tex_source, job_name, output_dir)
+        if pdf_path:
+            return pdf_path, log, tex_source, fixes
+
+    if llm_repair_enabled():
+        try:
+            fixed = request_llm_fix(tex_source, parse_latex_errors(log))
+        except Exception as e:
+            print(f"⚠️ LaTeX fix request failed for {job_name}: {e}")
+            fixed = None
+        if fixed is not None:
+            print(f"🤖 Applying model LaTeX fix for {job_name}")
+            fixes.append("model fix")
+            tex_source = fixed
+            pdf_path, log = compile_latex(tex_source, job_name, output_dir)
+            if pdf_path:
+                return pdf_path, log, tex_source, fixes
+    return None, log, tex_source, fixes
@@ -0,0 +1,265 @@
+#llm_client
+import os
+import random
+import threading
+import time
+
+from utils.metrics import span
+
+# Shared client settings (override with the LLM_* env variables)
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 0  # 0 disables token budgeting
+DEFAULT_TIMEOUT = 180.0  # Seconds per request; vision calls on long scripts are slow
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+# Rough prompt-size estimate used for the token budget before the real usage is known
+IMAGE_TOKEN_ESTIMATE = 1105  # A high-detail page image of up to 2048px
+OUTPUT_TOKEN_ESTIMATE = 2000
+CHARS_PER_TOKEN = 4
+
+
+def retryable_errors():
+    """429s, timeouts, connection errors and 5xx responses. openai is only imported once a client is used."""
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+def _env_number(name, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+    A limit of 0 (or less) disables the bucket.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self._available = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def acquire(self, amount: float = 1):
+        if self.per_minute <= 0:
+            return
+        amount = min(amount, self.capacity)  # A single oversized request still goes through eventually
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available >= amount:
+                    self._available -= amount
+                    return
+                wait = (amount - self._available) * 60.0 / self.per_minute
+            time.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Corrects an earlier acquire once the real cost is known (negative amounts refund)."""
+        if self.per_minute <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._available = min(self.capacity, self._available - amount)
+
+    def wait_time(self, amount: float = 1) -> float:
+        """Seconds until `amount` could be acquired, without acquiring it."""
+        if self.per_minute <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            missing = min(amount, self.capacity) - self._available
+        return max(0.0, missing * 60.0 / self.per_minute)
+
+
+def estimate_tokens(messages, max_tokens=None) -> int:
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens + (max_tokens or OUTPUT_TOKEN_ESTIMATE)
+
+
+def payload_bytes(messages) -> int:
+    """Approximate request size: the text parts plus the (base64) image URLs."""
+    size = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            size += len(content)
+            continue
+        for part in content or []:
+            size += len(part.get("text", "")) + len((part.get("image_url") or {}).get("url", ""))
+    return size
+
+
+def _retry_after(error) -> float:
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LLMClient:
+    """
+    Process-wide chat-completion client shared by every extraction path.
+
+    One pooled HTTP client keeps connections alive between calls; requests are limited by a
+    concurrency semaphore plus request- and token-per-minute buckets, time out after `timeout`
+    seconds, and are retried with jittered exponential backoff on 429s, timeouts, connection
+    errors and 5xx responses.
+
+    `transport` accepts any httpx transport (e.g. httpx.MockTransport) and `base_url` any
+    OpenAI-compatible server, so tests and benchmarks can run against a local fake.
+    """
+
+    def __init__(self, transport=None, base_url=None, api_key=None, max_concurrency=None,
+                 requests_per_minute=None, tokens_per_minute=None, timeout=None, max_retries=None):
+        self.max_concurrency = max_concurrency or _env_number("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+        self.timeout = timeout or _env_number("LLM_TIMEOUT", DEFAULT_TIMEOUT, float)
+        self.max_retries = max_retries if max_retries is not None else _env_number("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        self.request_limiter = RateLimiter(
+            requests_per_minute if requests_per_minute is not None
+            else _env_number("LLM_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)
+        )
+        self.token_limiter = RateLimiter(
+            tokens_per_minute if tokens_per_minute is not None
+            else _env_number("LLM_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)
+        )
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+
+        # Imported here rather than at module load: together they take most of the app's import time
+        import httpx
+        import openai
+
+        self.http_client = httpx.Client(
+            transport=transport,
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+        )
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.openai = openai.OpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY") or "not-set",
+            base_url=self.base_url,
+            http_client=self.http_client,
+            max_retries=0,  # Retries are handled here so they share the rate limiters
+            timeout=self.timeout,
+        )
+
+    def chat(self, messages, model: str, temperature: float = None, max_tokens: int = None, **kwargs) -> str:
+        """Sends one chat-completion request and returns the message content."""
+        estimate = estimate_tokens(messages, max_tokens)
+        request = {"model": model, "messages": messages, **kwargs}
+        if temperature is not None:
+            request["temperature"] = temperature
+        if max_tokens is not None:
+            request["max_tokens"] = max_tokens
+
+        attempt = 0
+        with span("llm_request", model=model, bytes=payload_bytes(messages)) as request_span:
+            while True:
+                self.request_limiter.acquire(1)
+                self.token_limiter.acquire(estimate)
+                try:
+                    with self._semaphore:
+                        response = self.openai.chat.completions.create(**request)
+                except retryable_errors() as e:
+                    attempt += 1
+                    request_span.set(retries=attempt)
+                    if attempt > self.max_retries:
+                        raise
+                    delay = max(_retry_after(e), random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+                    print(f"⚠️ LLM request failed ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+
+                usage = getattr(response, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    self.token_limiter.adjust(usage.total_tokens - estimate)
+                    request_span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                return response.choices[0].message.content
+
+    def close(self):
+        self.http_client.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+_chat_models = {}
+
+
+def get_llm_client() -> LLMClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+
+def set_llm_client(client: LLMClient):
+    """Replaces the shared client, e.g. with one pointed at a fake server."""
+    global _client
+    with _client_lock:
+        _client = client
+        _chat_models.clear()
+
+
+def get_chat_model(model_name="gpt-4o", temperature=0.1):
+    """
+    LangChain chat model whose requests go through the shared LLMClient.chat, so LangChain chains
+    get the same concurrency semaphore, request- and token-per-minute budgets, timeout and
+    retry/backoff policy as the vision extraction path. Instances are cached per model and temperature.
+    """
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, convert_to_openai_messages
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    class SharedClientChatModel(BaseChatModel):
+        model_name: str
+        temperature: float = None
+
+        @property
+        def _llm_type(self) -> str:
+            return "shared-llm-client"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            if stop:
+                kwargs["stop"] = stop
+            # Looked up on every call, so set_llm_client also redirects existing chains
+            content = get_llm_client().chat(convert_to_openai_messages(messages), model=self.model_name,
+                                            temperature=self.temperature, **kwargs)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content or ""))])
+
+    key = (model_name, temperature)
+    with _client_lock:
+        if key not in _chat_models:
+            _chat_models[key] = SharedClientChatModel(model_name=model_name, temperature=temperature)
+        return _chat_models[key]
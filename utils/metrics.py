@@ -0,0 +1,165 @@
+#metrics
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) for stage durations: from fast encodes up to long vision calls
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Span fields that are summed into counters
+COUNTED_FIELDS = ("bytes", "pages", "prompt_tokens", "completion_tokens", "retries")
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+span_logger = logging.getLogger("pipeline.spans")
+if not span_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    span_logger.addHandler(_handler)
+    span_logger.propagate = False
+span_logger.setLevel(logging.INFO if os.getenv("METRICS_LOG", "1") != "0" else logging.WARNING)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._help = {}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, help_text="", **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, help_text="", **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            histogram = self._histograms.setdefault(key, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self) -> str:
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in sorted(self._help.items()):
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{fmt_labels(labels)} {value}")
+                else:
+                    for (metric, labels), histogram in sorted(self._histograms.items()):
+                        if metric != name:
+                            continue
+                        for bound, count in zip(DURATION_BUCKETS, histogram):
+                            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', str(bound))])} {count}")
+                        lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+                        lines.append(f"{name}_sum{fmt_labels(labels)} {histogram[-2]}")
+                        lines.append(f"{name}_count{fmt_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class Span:
+    """Fields recorded for one pipeline stage of one job; safe to update from several threads."""
+
+    def __init__(self, stage, job=None):
+        self.stage = stage
+        self.job = job
+        self.fields = {}
+        self.status = None  # Set to "error" to mark a failure that did not raise
+        self._lock = threading.Lock()
+
+    def set(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def add(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                self.fields[name] = self.fields.get(name, 0) + value
+
+
+@contextmanager
+def job_context(job):
+    """Tags every span recorded inside the block (in this thread/context) with `job`."""
+    token = _current_job.set(job)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def current_job():
+    return _current_job.get()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def record_span(stage, seconds, status="ok", job=None, **fields):
+    """Records a finished stage: duration histogram, per-field counters and one structured log line."""
+    job = job if job is not None else _current_job.get()
+    registry.observe("pipeline_stage_duration_seconds", seconds, "Wall time of each pipeline stage", stage=stage)
+    registry.inc("pipeline_stage_total", 1, "Pipeline stages run, by outcome", stage=stage, status=status)
+    for name in COUNTED_FIELDS:
+        if fields.get(name):
+            registry.inc(f"pipeline_stage_{name}_total", fields[name], f"Sum of span {name} per stage", stage=stage)
+    span_logger.info(json.dumps({
+        "event": "span", "stage": stage, "job": job, "status": status,
+        "seconds": round(seconds, 4), **fields
+    }, default=str))
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Times a pipeline stage. Yields a Span whose fields (bytes, pages, prompt_tokens, ...) can be
+    set inside the block; an exception marks the span as an error and is re-raised.
+    """
+    current = Span(stage, _current_job.get())
+    current.set(**fields)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        _current_span.reset(token)
+        record_span(stage, time.perf_counter() - start, status=current.status or status, job=current.job,
+                    **current.fields)
@@ -1,71 +1,376 @@
 #ocr_openai
 import os
-from dotenv import load_dotenv
-from PIL import Image
-from pdf2image import convert_from_path
+import io
+import hashlib
 import base64
-import openai
+import contextvars
+import time
+from utils.llm_client import get_llm_client
+from concurrent.futures import ThreadPoolExecutor
+from utils.concurrency import stage_slot
+from utils.formatter import parse_flexible_gpt_output, merge_structured_answers
+from utils.question_index import prompt_question_text
 
-def pdf_to_images(pdf_path):
-    images = convert_from_path(pdf_path, dpi=300)
-    image_paths = []
+# PIL, pdf2image and the page filter (numpy) are imported on first use, so importing the pipeline
+# (and the web app) stays cheap; gunicorn.conf.py loads them once before forking workers.
+
+RASTER_DPI = 300
+# Pages decoded per pdftoppm call. Only this many page bitmaps are ever held in memory at once.
+DEFAULT_PAGE_WINDOW = 1
+
+# In-memory page encoding sent to the model (override with the PAGE_* env variables).
+# 300-dpi lossless PNGs are far larger than the model needs; the vision endpoint downsamples
+# anything above ~2048px on the longest side anyway.
+DEFAULT_PAGE_DPI = 200
+DEFAULT_PAGE_FORMAT = "JPEG"
+DEFAULT_PAGE_QUALITY = 85
+DEFAULT_PAGE_MAX_SIDE = 2048
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+EXTRACTION_MODEL = "gpt-4o"
+EXTRACTION_TEMPERATURE = 0.1
+
+# EXTRACTION_MODE: "latex" sends the whole script in one request and gets a full LaTeX document back;
+# "structured" sends the whole script and gets compact JSON answers back, rendered locally by
+# convert_to_latex with the fixed preamble; "windowed" splits the script into overlapping page
+# windows extracted concurrently as structured answers; "auto" picks windowed for scripts longer
+# than one window and structured otherwise.
+DEFAULT_EXTRACTION_MODE = "latex"
+EXTRACTION_MODES = ("latex", "structured", "windowed", "auto")
+DEFAULT_WINDOW_PAGES = 6
+DEFAULT_WINDOW_OVERLAP = 1
+
+
+def iter_pdf_pages(pdf_path, dpi=RASTER_DPI, window=None):
+    """
+    Renders a PDF lazily, yielding (page_number, PIL image) one page at a time.
+
+    Pages are decoded in windows of `window` pages (PAGE_WINDOW env, default 1), so peak memory
+    depends on the window size and not on how many pages the script has. The caller owns each
+    image and should close it once it has been handed on.
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
+    window = window or int(os.getenv("PAGE_WINDOW", DEFAULT_PAGE_WINDOW))
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    for first_page in range(1, page_count + 1, window):
+        last_page = min(first_page + window - 1, page_count)
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+        for offset, img in enumerate(images):
+            yield first_page + offset, img
+        del images
+
+
+def iter_pdf_images(pdf_path, dpi=RASTER_DPI, window=None):
+    """Streams the pages of a PDF to tmp/<base_name>/page_<n>.png, yielding each path as soon as it is written."""
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
     os.makedirs(f"tmp/{base_name}", exist_ok=True)
-    for i, img in enumerate(images):
-        img_path = f"tmp/{base_name}/page_{i + 1}.png"
-        img.save(img_path, "PNG")
-        image_paths.append(img_path)
-    return image_paths
+    for page_number, img in iter_pdf_pages(pdf_path, dpi=dpi, window=window):
+        img_path = f"tmp/{base_name}/page_{page_number}.png"
+        try:
+            img.save(img_path, "PNG")
+        finally:
+            img.close()
+        yield img_path
+
+
+def pdf_to_images(pdf_path):
+    return list(iter_pdf_images(pdf_path))
+
+
+def _env_flag(name):
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def encode_page(img, image_format=None, quality=None, max_side=None, grayscale=None, binarize_threshold=None):
+    """
+    Encodes a rendered page straight from memory into a base64 data URL for the request payload.
+
+    Args:
+        img (PIL.Image.Image): The rendered page.
+        image_format (str): "JPEG", "WEBP" or "PNG" (PAGE_FORMAT env, default JPEG).
+        quality (int): JPEG/WebP quality 1-100 (PAGE_QUALITY env, default 85).
+        max_side (int): Longest side in pixels; larger pages are downscaled (PAGE_MAX_SIDE env, default 2048).
+        grayscale (bool): Drop colour information (PAGE_GRAYSCALE env).
+        binarize_threshold (int): If set (0-255), pixels brighter than this become white and the rest
+                                  black, which suits handwritten scripts (PAGE_BINARIZE_THRESHOLD env).
+
+    Returns:
+        str: "data:<mime>;base64,..." URL.
+    """
+    image_format = (image_format or os.getenv("PAGE_FORMAT", DEFAULT_PAGE_FORMAT)).upper()
+    if image_format not in IMAGE_MIME_TYPES:
+        raise ValueError(f"Unsupported page image format: {image_format}")
+    quality = quality or int(os.getenv("PAGE_QUALITY", DEFAULT_PAGE_QUALITY))
+    max_side = max_side or int(os.getenv("PAGE_MAX_SIDE", DEFAULT_PAGE_MAX_SIDE))
+    if grayscale is None:
+        grayscale = _env_flag("PAGE_GRAYSCALE")
+    if binarize_threshold is None and os.getenv("PAGE_BINARIZE_THRESHOLD"):
+        binarize_threshold = int(os.getenv("PAGE_BINARIZE_THRESHOLD"))
+
+    if max(img.size) > max_side:
+        from PIL import Image
+
+        img = img.copy()
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if binarize_threshold is not None:
+        img = img.convert("L").point(lambda p: 255 if p > binarize_threshold else 0)
+    elif grayscale:
+        img = img.convert("L")
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        img.save(buffer, "PNG", optimize=True)
+    else:
+        img.save(buffer, image_format, quality=quality)
+    return f"data:{IMAGE_MIME_TYPES[image_format]};base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+
+def iter_encoded_pages(pdf_path, dpi=None, window=None, stats=None, page_filter=None, **encode_options):
+    """
+    Renders and encodes a PDF one page at a time without touching the disk,
+    yielding a data URL per page (see encode_page for the encoding options).
+
+    Pages go through the local page filter first (see utils.page_filter; `page_filter` overrides
+    page_filter_params()): blank and near-duplicate pages are dropped and the rest are deskewed
+    and cropped to the written area. If every page is dropped, the first one is sent anyway.
+    If a `stats` dict is given, encode_seconds, encoded_bytes, pages_dropped, dropped_bytes
+    and the filter counters are accumulated in it; "dropped_pages" lists (page_number, reason)
+    of every page not sent.
+    """
+    from utils.page_filter import iter_filtered_pages, page_filter_params
+
+    dpi = dpi or int(os.getenv("PAGE_DPI", DEFAULT_PAGE_DPI))
+    stats = stats if stats is not None else {}
+    pages = iter_filtered_pages(iter_pdf_pages(pdf_path, dpi=dpi, window=window),
+                                page_filter if page_filter is not None else page_filter_params(), stats)
+    kept = 0
+    fallback = None
+    for page_number, img, reason in pages:
+        try:
+            start = time.perf_counter()
+            page = encode_page(img, **encode_options)
+            stats["encode_seconds"] = stats.get("encode_seconds", 0.0) + time.perf_counter() - start
+        finally:
+            img.close()
+        if reason:
+            # Dropped pages are still encoded (cheaply: they are mostly white) to report the bytes saved
+            stats["pages_dropped"] = stats.get("pages_dropped", 0) + 1
+            stats["dropped_bytes"] = stats.get("dropped_bytes", 0) + len(page)
+            if fallback is None:
+                fallback = (page_number, page)
+            continue
+        kept += 1
+        stats["encoded_bytes"] = stats.get("encoded_bytes", 0) + len(page)
+        yield page
+
+    if not kept and fallback:
+        page_number, page = fallback
+        stats["pages_dropped"] -= 1
+        stats["dropped_bytes"] -= len(page)
+        stats["encoded_bytes"] = stats.get("encoded_bytes", 0) + len(page)
+        stats["dropped_pages"] = [dropped for dropped in stats.get("dropped_pages", []) if dropped[0] != page_number]
+        yield page
+
+
+def page_encoding_params(dpi=None, **encode_options):
+    """The effective rendering/encoding settings, used to key cached pages."""
+    from utils.page_filter import page_filter_params
+
+    binarize_threshold = encode_options.get("binarize_threshold")
+    if binarize_threshold is None and os.getenv("PAGE_BINARIZE_THRESHOLD"):
+        binarize_threshold = int(os.getenv("PAGE_BINARIZE_THRESHOLD"))
+    grayscale = encode_options.get("grayscale")
+    return {
+        "dpi": dpi or int(os.getenv("PAGE_DPI", DEFAULT_PAGE_DPI)),
+        "format": (encode_options.get("image_format") or os.getenv("PAGE_FORMAT", DEFAULT_PAGE_FORMAT)).upper(),
+        "quality": encode_options.get("quality") or int(os.getenv("PAGE_QUALITY", DEFAULT_PAGE_QUALITY)),
+        "max_side": encode_options.get("max_side") or int(os.getenv("PAGE_MAX_SIDE", DEFAULT_PAGE_MAX_SIDE)),
+        "grayscale": _env_flag("PAGE_GRAYSCALE") if grayscale is None else grayscale,
+        "binarize_threshold": binarize_threshold,
+        "filter": page_filter_params(),
+    }
+
 
 def encode_image_base64(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode("utf-8")
 
-def gpt4o_extract_answer_latex(image_paths, question_text):
+
+def _page_image_url(page):
+    # Pages are either data URLs from iter_encoded_pages or paths to PNGs written by pdf_to_images
+    if page.startswith("data:"):
+        return page
+    return f"data:image/png;base64,{encode_image_base64(page)}"
+
+
+def build_extraction_prompt(question_text):
+    return (
+        "You are a helpful assistant. A professor uploaded a question paper and a student's answer sheet.\n"
+        "Match each student's answer with the correct question number from the question paper.\n"
+        "The student may have written answers in a different order.\n"
+        "Write everything exactly as written in the answer sheet.\n"
+        "Do NOT correct math steps or reasoning. Preserve diagrams with descriptions if present.\n"
+        "Generate a full LaTeX document (start with \\documentclass and end with \\end{document}).\n"
+        # MODIFIED LINE BELOW: Be more explicit about essential packages
+        "Include standard packages like amsmath, amssymb, graphicx, and geometry.\n"
+        f"\nQUESTION PAPER:\n{prompt_question_text(question_text)}\n"
+        "ANSWER SHEET IMAGES:"
+    )
+
+
+def build_structured_prompt(question_text, first_page=1, last_page=None, page_count=None, context_pages=0):
+    page_note = ""
+    if last_page is not None and page_count is not None and (first_page > 1 or last_page < page_count):
+        page_note = (
+            f"These images are pages {first_page}-{last_page} of a {page_count}-page answer sheet. "
+            "An answer may start before or continue after these pages: transcribe only what is on these pages "
+            "and label it with the question it belongs to.\n"
+        )
+    if context_pages:
+        # Overlapping pages were transcribed by the previous window; here they only show which answer continues
+        last_context = first_page + context_pages - 1
+        pages_label = f"page {first_page}" if context_pages == 1 else f"pages {first_page}-{last_context}"
+        page_note += (
+            f"The first {context_pages} image(s) ({pages_label}) are context only and were transcribed already: "
+            "do NOT transcribe anything written on them. Use them only to tell which question the text on "
+            "the following pages continues.\n"
+        )
+    return (
+        "You are a helpful assistant. A professor uploaded a question paper and a student's answer sheet.\n"
+        "Match each student's answer with the correct question number from the question paper.\n"
+        "The student may have written answers in a different order.\n"
+        "Write everything exactly as written in the answer sheet.\n"
+        "Do NOT correct math steps or reasoning. Preserve diagrams with descriptions if present.\n"
+        + page_note +
+        "Return ONLY a JSON object {\"answers\": [...]} with one item per answered question, in one of these forms:\n"
+        '{"question_number": "1", "answer": "..."}\n'
+        '{"question_number": "2", "subparts": {"a": {"answer": "..."}, "b": {"answer": "..."}}}\n'
+        "Answers are plain text; do not add LaTeX markup, a preamble or explanations.\n"
+        f"\nQUESTION PAPER:\n{prompt_question_text(question_text)}\n"
+        "ANSWER SHEET IMAGES:"
+    )
+
+
+def extraction_mode():
+    mode = os.getenv("EXTRACTION_MODE", DEFAULT_EXTRACTION_MODE).strip().lower()
+    return mode if mode in EXTRACTION_MODES else DEFAULT_EXTRACTION_MODE
+
+
+def window_params(window_pages=None, overlap=None):
+    window_pages = window_pages or int(os.getenv("WINDOW_PAGES", DEFAULT_WINDOW_PAGES))
+    overlap = overlap if overlap is not None else int(os.getenv("WINDOW_OVERLAP", DEFAULT_WINDOW_OVERLAP))
+    return max(1, window_pages), max(0, min(overlap, window_pages - 1))
+
+
+def extraction_params(question_text, mode=None):
+    """Model, temperature and prompt fingerprint of an extraction call, used to key cached LLM output."""
+    mode = mode or extraction_mode()
+    prompt = build_extraction_prompt(question_text) if mode == "latex" else build_structured_prompt(question_text)
+    params = {
+        "model": EXTRACTION_MODEL,
+        "temperature": EXTRACTION_TEMPERATURE,
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+    }
+    if mode != "latex":
+        params["mode"] = mode
+        params["window_pages"], params["window_overlap"] = window_params()
+        params["overlap"] = "context"  # Overlapping pages are context only (not transcribed twice)
+    return params
+
+
+def _chat_with_pages(prompt, pages, **request_options):
     messages = [
         {
             "role": "user",
             "content": [
                 {
                     "type": "text",
-                    "text": (
-                        "You are a helpful assistant. A professor uploaded a question paper and a student's answer sheet.\n"
-                        "Match each student's answer with the correct question number from the question paper.\n"
-                        "The student may have written answers in a different order.\n"
-                        "Write everything exactly as written in the answer sheet.\n"
-                        "Do NOT correct math steps or reasoning. Preserve diagrams with descriptions if present.\n"
-                        "Generate a full LaTeX document (start with \\documentclass and end with \\end{document}).\n"
-                        # MODIFIED LINE BELOW: Be more explicit about essential packages
-                        "Include standard packages like amsmath, amssymb, graphicx, and geometry.\n"
-                        f"\nQUESTION PAPER:\n{question_text}\n"
-                        "ANSWER SHEET IMAGES:"
-                    )
+                    "text": prompt
                 }
             ]
         }
     ]
 
-    for path in image_paths:
-        img_b64 = encode_image_base64(path)
+    for page in pages:
         messages[0]["content"].append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/png;base64,{img_b64}"
+                "url": _page_image_url(page)
             }
         })
 
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.1
+    return get_llm_client().chat(
+        messages,
+        model=EXTRACTION_MODEL,
+        temperature=EXTRACTION_TEMPERATURE,
+        **request_options
     )
 
-    return response.choices[0].message.content
+
+def gpt4o_extract_answer_latex(image_paths, question_text):
+    return _chat_with_pages(build_extraction_prompt(question_text), image_paths)
+
+
+def gpt4o_extract_answers_json(pages, question_text, first_page=1, page_count=None, context_pages=0):
+    """
+    Extracts structured answers (question_number/subparts items, see utils/formatter.py) from pages.
+    The first `context_pages` pages are shown for context but not transcribed.
+    """
+    page_count = page_count or len(pages)
+    prompt = build_structured_prompt(question_text, first_page, first_page + len(pages) - 1, page_count,
+                                     context_pages=context_pages)
+    # JSON mode guarantees a parseable object, so no tokens are spent on LaTeX or a failed re-run
+    return parse_flexible_gpt_output(_chat_with_pages(prompt, pages, response_format={"type": "json_object"}))
+
+
+def page_windows(page_count, window_pages, overlap):
+    """(start, end) index pairs of overlapping page windows covering page_count pages."""
+    if page_count <= window_pages:
+        return [(0, page_count)]
+    step = window_pages - overlap
+    windows = []
+    for start in range(0, page_count, step):
+        end = min(start + window_pages, page_count)
+        windows.append((start, end))
+        if end == page_count:
+            break
+    return windows
+
+
+def extract_answers_windowed(pages, question_text, window_pages=None, overlap=None):
+    """
+    Extracts a long script as overlapping page windows sent concurrently (each window takes
+    an "llm" stage slot), then merges the answers by question number. Latency is bounded by the
+    slowest window instead of growing with the page count. The pages a window shares with the
+    previous one are context only (not transcribed again), so an answer on them appears once.
+    """
+    window_pages, overlap = window_params(window_pages, overlap)
+    windows = page_windows(len(pages), window_pages, overlap)
+
+    def _extract_window(window):
+        start, end = window
+        with stage_slot("llm"):
+            return gpt4o_extract_answers_json(pages[start:end], question_text, first_page=start + 1,
+                                              page_count=len(pages), context_pages=overlap if start else 0)
+
+    if len(windows) == 1:
+        return merge_structured_answers([_extract_window(windows[0])])
+
+    with ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix="window") as executor:
+        # Copy the caller's context so request spans stay tagged with this script's job
+        futures = [executor.submit(contextvars.copy_context().run, _extract_window, window) for window in windows]
+        answer_lists = [future.result() for future in futures]
+    return merge_structured_answers(answer_lists)
 
 # Example usage: (This part remains as is, for local testing)
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
     load_dotenv()
-    openai.api_key = os.getenv("OPENAI_API_KEY")
 
     if not os.path.exists("uploads/question_data/question_paper.txt"):
         print("Please create 'uploads/question_data/question_paper.txt' for example usage.")
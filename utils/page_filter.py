@@ -0,0 +1,221 @@
+#page_filter
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+# Local, CPU-only clean-up of rendered pages before they are encoded for the model
+# (override with the PAGE_* env variables; PAGE_FILTER=0 sends every page untouched).
+# All measurements run on a downscaled greyscale copy, so the cost barely depends on the DPI.
+ANALYSIS_MAX_SIDE = 800
+DEFAULT_INK_THRESHOLD = 160  # Grey level below which a pixel counts as ink
+DEFAULT_BLANK_INK_RATIO = 0.002  # Pages with more ink than this fraction of their area are never blank
+# A page under that ratio is only blank if it has no mark of at least this many connected ink pixels
+# (of the analysis image): scanner specks are a pixel or two, a handwritten "42" is hundreds
+DEFAULT_BLANK_MIN_MARK = 12
+# A page is only a duplicate of the page kept just before it if it is near-identical: at most this
+# many differing hash bits (of HASH_SIZE**2) ...
+DEFAULT_DUPLICATE_DISTANCE = 4
+# ... and at most this many cells of a DUPLICATE_GRID x DUPLICATE_GRID grid over the written area
+# with ink on one page but not the other. Templated answer books print the same layout on every
+# page, so the hash alone cannot tell two different short answers apart; the ink difference can.
+DEFAULT_DUPLICATE_INK_CELLS = 4
+DUPLICATE_GRID = 128
+DEFAULT_CROP_MARGIN = 0.02  # Margin kept around the written area, as a fraction of the page size
+DEFAULT_MAX_SKEW = 5.0  # Degrees searched either way when deskewing; 0 disables deskewing
+SKEW_STEP = 0.5
+SKEW_MIN_GAIN = 1.05  # A rotation must sharpen the line profile by 5% over the unrotated page
+BORDER_FRACTION = 0.03  # Scanner edges, shadows and punch holes are not counted as ink
+HASH_SIZE = 16
+
+
+def _env_enabled(name, default=True):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def page_filter_params():
+    """The effective filter settings; part of the cache key of encoded pages."""
+    return {
+        "enabled": _env_enabled("PAGE_FILTER"),
+        "ink_threshold": int(os.getenv("PAGE_INK_THRESHOLD", DEFAULT_INK_THRESHOLD)),
+        "blank_ink_ratio": float(os.getenv("PAGE_BLANK_INK_RATIO", DEFAULT_BLANK_INK_RATIO)),
+        "blank_min_mark": int(os.getenv("PAGE_BLANK_MIN_MARK", DEFAULT_BLANK_MIN_MARK)),
+        "duplicate_distance": int(os.getenv("PAGE_DUPLICATE_DISTANCE", DEFAULT_DUPLICATE_DISTANCE)),
+        "duplicate_ink_cells": int(os.getenv("PAGE_DUPLICATE_INK_CELLS", DEFAULT_DUPLICATE_INK_CELLS)),
+        "crop_margin": float(os.getenv("PAGE_CROP_MARGIN", DEFAULT_CROP_MARGIN)),
+        "max_skew": float(os.getenv("PAGE_MAX_SKEW", DEFAULT_MAX_SKEW)),
+    }
+
+
+def _analysis_image(img):
+    gray = img.convert("L")
+    gray.thumbnail((ANALYSIS_MAX_SIDE, ANALYSIS_MAX_SIDE))
+    return gray
+
+
+def ink_mask(gray, threshold=DEFAULT_INK_THRESHOLD):
+    """Boolean array of ink pixels, ignoring a thin border around the page."""
+    mask = np.asarray(gray) < threshold
+    height, width = mask.shape
+    border_y, border_x = int(height * BORDER_FRACTION), int(width * BORDER_FRACTION)
+    mask[:border_y] = False
+    mask[height - border_y:] = False
+    mask[:, :border_x] = False
+    mask[:, width - border_x:] = False
+    return mask
+
+
+def has_mark(mask, min_pixels=DEFAULT_BLANK_MIN_MARK):
+    """True if the mask holds a connected (8-neighbour) group of at least `min_pixels` ink pixels."""
+    ink = set(zip(*np.nonzero(mask)))
+    while ink:
+        stack = [ink.pop()]
+        size = 0
+        while stack:
+            y, x = stack.pop()
+            size += 1
+            if size >= min_pixels:
+                return True
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    neighbour = (y + dy, x + dx)
+                    if neighbour in ink:
+                        ink.remove(neighbour)
+                        stack.append(neighbour)
+    return False
+
+
+def is_blank(mask, params):
+    """
+    Conservative blank test: only a page with very little ink and no real mark anywhere (just
+    scanner specks) is blank. A short answer such as "Q3: 42" has little ink but a clear mark.
+    """
+    if mask.mean() >= params["blank_ink_ratio"]:
+        return False
+    return not has_mark(mask, params["blank_min_mark"])
+
+
+def estimate_skew(mask, max_angle=DEFAULT_MAX_SKEW):
+    """
+    Angle (degrees) that best straightens the lines of writing, found by rotating the ink mask
+    and maximising the sharpness of its row profile. Returns 0.0 when no angle clearly helps.
+    """
+    if max_angle <= 0 or not mask.any():
+        return 0.0
+    mask_img = Image.fromarray(mask.astype(np.uint8) * 255)
+
+    def profile_sharpness(angle):
+        rows = np.asarray(mask_img.rotate(angle, resample=Image.NEAREST)).sum(axis=1, dtype=np.float64)
+        return float(np.square(np.diff(rows)).sum())
+
+    baseline = profile_sharpness(0.0)
+    best_angle, best_score = 0.0, baseline
+    for angle in np.arange(-max_angle, max_angle + SKEW_STEP / 2, SKEW_STEP):
+        if angle == 0:
+            continue
+        score = profile_sharpness(float(angle))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle if best_score > baseline * SKEW_MIN_GAIN else 0.0
+
+
+def crop_box(mask, margin=DEFAULT_CROP_MARGIN):
+    """Bounding box (left, top, right, bottom) of the written area in mask coordinates, or None if empty."""
+    # Rows/columns need at least two ink pixels, so isolated specks of scanner noise do not widen the box
+    rows = np.flatnonzero(np.count_nonzero(mask, axis=1) >= 2)
+    cols = np.flatnonzero(np.count_nonzero(mask, axis=0) >= 2)
+    if not rows.size or not cols.size:
+        return None
+    height, width = mask.shape
+    pad_y, pad_x = int(height * margin), int(width * margin)
+    return (max(0, int(cols[0]) - pad_x), max(0, int(rows[0]) - pad_y),
+            min(width, int(cols[-1]) + 1 + pad_x), min(height, int(rows[-1]) + 1 + pad_y))
+
+
+def difference_hash(gray, size=HASH_SIZE):
+    """Perceptual (difference) hash: one bit per horizontally adjacent pair of cells of a size x size grid."""
+    cells = np.asarray(gray.resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    return (cells[:, 1:] > cells[:, :-1]).ravel()
+
+
+def ink_grid(mask, size=DUPLICATE_GRID):
+    """size x size boolean grid of the cells of `mask` that hold any ink."""
+    cells = Image.fromarray(mask.astype(np.uint8) * 255).resize((size, size), Image.BOX)
+    return np.asarray(cells) > 0
+
+
+def is_duplicate(page, previous, params):
+    """
+    Whether `page` repeats `previous` (both (hash, ink grid) of the written area): the hashes must
+    be near-identical and the ink must differ in no more than a few grid cells.
+    """
+    if previous is None:
+        return False
+    page_hash, page_ink = page
+    previous_hash, previous_ink = previous
+    if np.count_nonzero(page_hash != previous_hash) > params["duplicate_distance"]:
+        return False
+    return np.count_nonzero(page_ink != previous_ink) <= params["duplicate_ink_cells"]
+
+
+def iter_filtered_pages(pages, params=None, stats=None):
+    """
+    Runs the page filter over (page_number, PIL image) pairs.
+
+    Yields (page_number, image, reason) for every page: reason is None for pages to send (deskewed
+    and cropped to the written area) and "blank" or "duplicate" (a near-identical repeat of the
+    page kept just before it, e.g. scanned twice) for pages to drop. Replaced
+    images are closed here; the caller owns (and closes) every image yielded.
+    If a `stats` dict is given, page counts and filter_seconds are accumulated in it, and every
+    dropped page is listed under "dropped_pages" as (page_number, reason).
+    """
+    params = params or page_filter_params()
+    stats = stats if stats is not None else {}
+    previous = None  # (hash, ink grid) of the last page kept
+    for page_number, img in pages:
+        if not params["enabled"]:
+            yield page_number, img, None
+            continue
+
+        start = time.perf_counter()
+        gray = _analysis_image(img)
+        mask = ink_mask(gray, params["ink_threshold"])
+        reason = None
+        if is_blank(mask, params):
+            reason = "blank"
+        else:
+            angle = estimate_skew(mask, params["max_skew"])
+            if angle:
+                rotated = img.rotate(angle, resample=Image.BICUBIC, fillcolor="white")
+                img.close()
+                img = rotated
+                gray = gray.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+                mask = ink_mask(gray, params["ink_threshold"])
+                stats["pages_deskewed"] = stats.get("pages_deskewed", 0) + 1
+
+            box = crop_box(mask, params["crop_margin"]) or (0, 0, gray.width, gray.height)
+            fingerprint = (difference_hash(gray.crop(box)), ink_grid(mask[box[1]:box[3], box[0]:box[2]]))
+            if is_duplicate(fingerprint, previous, params):
+                reason = "duplicate"
+            else:
+                previous = fingerprint
+                scale_x, scale_y = img.width / gray.width, img.height / gray.height
+                full_box = (int(box[0] * scale_x), int(box[1] * scale_y),
+                            min(img.width, int(round(box[2] * scale_x))), min(img.height, int(round(box[3] * scale_y))))
+                stats["pixels_in"] = stats.get("pixels_in", 0) + img.width * img.height
+                if full_box != (0, 0, img.width, img.height):
+                    cropped = img.crop(full_box)
+                    img.close()
+                    img = cropped
+                stats["pixels_out"] = stats.get("pixels_out", 0) + img.width * img.height
+        gray.close()
+
+        if reason:
+            stats[f"pages_{reason}"] = stats.get(f"pages_{reason}", 0) + 1
+            stats.setdefault("dropped_pages", []).append((page_number, reason))
+        stats["filter_seconds"] = stats.get("filter_seconds", 0.0) + time.perf_counter() - start
+        yield page_number, img, reason
@@ -0,0 +1,258 @@
+#question_index
+import os
+import re
+import threading
+
+from utils.cache import get_cache, cache_key
+from utils.checkpoints import text_sha256
+
+# The question paper is parsed once (locally, no model call) into an index of question numbers,
+# subparts and marks, cached by the hash of its text. Extraction prompts send the compact index
+# instead of the whole OCRed paper (QUESTION_INDEX=0 sends the full text), and answer documents
+# are split back into per-question records with the same numbering.
+QUESTION_INDEX_VERSION = 2  # Bump when parsing changes, so cached indexes are rebuilt
+
+# Optional layout commands a heading can be wrapped in: "\item \textbf{Question 1}", "\section*{Q1}", ...
+_HEADING_LEAD = r"^\s*(?:\\item(?:\[[^\]]*\])?\s*)?(?:(?:\\(?:sub)*section\*?|\\textbf|\\underline|\\emph)\s*\{\s*|\\noindent\s*)*"
+_QUESTION_HEADING = re.compile(
+    _HEADING_LEAD + r"(?:question|ques\.?|q)\s*\.?\s*(?:q\.?\s*)?(\d+)\s*(?:\(?([a-h]|[ivx]{1,4})\))?(?![\w])", re.IGNORECASE)
+_NUMBERED_HEADING = re.compile(_HEADING_LEAD + r"(\d+)\s*[.)]\s")
+_SUBPART_HEADING = re.compile(_HEADING_LEAD + r"\(([a-h]|[ivx]{1,4})\)", re.IGNORECASE)
+_ITEM_LABEL = re.compile(r"^\s*\\item\s*\[\s*\(?([a-h]|[ivx]{1,4})[.)]?\s*\]", re.IGNORECASE)  # \item[(a)]
+# Auto-numbered lists: \begin{enumerate}[label=\textbf{Q\arabic*.}] numbers questions, a nested
+# [label=(\alph*)] / [label=(\roman*)] list numbers their subparts
+_LIST_BOUNDARY = re.compile(r"\\(begin|end)\{(enumerate|itemize)\}(?:\[([^\]]*)\])?")
+_QUESTION_LIST_LABEL = re.compile(r"(?:question|ques|q)\W*\\arabic\*", re.IGNORECASE)
+_SUBPART_LIST_LABEL = re.compile(r"\\(alph|roman)\*")
+_LIST_ITEM = re.compile(r"^\s*\\item(?![\[a-zA-Z])\s*")
+# Question numbers mentioned anywhere in a paper ("Question 3", "Q.4"), to check the index covers them
+_QUESTION_MENTION = re.compile(r"(?<![A-Za-z])(?:question|ques\.?|q)\s*\.?\s*(\d+)(?!\d)", re.IGNORECASE)
+_ROMAN_NUMERALS = ("i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x")
+_LIST_EDGES = re.compile(r"^\s*\\(?:begin|end)\{(?:enumerate|itemize)\}(?:\[[^\]]*\])?"
+                         r"|\\(?:begin|end)\{(?:enumerate|itemize)\}(?:\[[^\]]*\])?\s*$")
+_MARKS = re.compile(
+    r"\[\s*(\d+(?:\.\d+)?)\s*(?:marks?|m|pts?|points?)?\s*\]"
+    r"|\(\s*(\d+(?:\.\d+)?)\s*(?:marks?|m|pts?|points?)\s*\)"
+    r"|\b(\d+(?:\.\d+)?)\s*marks?\b", re.IGNORECASE)
+_FORMATTING_COMMANDS = re.compile(r"\\(?:textbf|textit|emph|underline|text|(?:sub)*section\*?)\s*\{([^{}]*)\}")
+_LAYOUT_COMMANDS = re.compile(
+    r"\\(?:begin|end)\{[^}]*\}(?:\[[^\]]*\])?|\\item(?:\[[^\]]*\])?|\\(?:hfill|noindent|newline|medskip|bigskip|smallskip"
+    r"|newpage|centering)\b|\\(?:vspace|hspace)\*?\{[^}]*\}|\\\\")
+
+_indexes = {}  # question text hash -> index, so each process parses a paper at most once
+_indexes_lock = threading.Lock()
+
+
+def question_index_enabled():
+    return os.getenv("QUESTION_INDEX", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def normalize_question_number(value) -> str:
+    """Canonical question number: "Question 3" -> "3", "Q.4(b)" -> "4b", anything else lower-cased."""
+    text = str(value).strip()
+    match = re.match(r"(?i)^(?:question|ques\.?|q)?\s*\.?\s*(\d+)\s*\(?([a-z]{1,4})?\)?\s*$", text)
+    if match:
+        return match.group(1) + (match.group(2) or "").lower()
+    return text.lower()
+
+
+def _document_body(latex: str) -> str:
+    start = latex.find(r"\begin{document}")
+    end = latex.rfind(r"\end{document}")
+    body = latex[start + len(r"\begin{document}"):] if start != -1 else latex
+    if end != -1 and (start == -1 or end > start):
+        body = body[:body.rfind(r"\end{document}")]
+    return re.sub(r"\\(?:maketitle|title\{[^}]*\}|date\{[^}]*\}|author\{[^}]*\})", "", body)
+
+
+def plain_text(latex: str) -> str:
+    """Question text without layout markup; maths and everything the student must see is kept."""
+    text = _LAYOUT_COMMANDS.sub(" ", latex)
+    for _ in range(3):  # Nested \textbf{\emph{...}}
+        text = _FORMATTING_COMMANDS.sub(r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _marks(text):
+    match = _MARKS.search(text)
+    if not match:
+        return None
+    value = float(next(group for group in match.groups() if group))
+    return int(value) if value.is_integer() else value
+
+
+def _heading(line, numbered):
+    match = _QUESTION_HEADING.match(line)
+    if match:
+        return "question", match.group(1), (match.group(2) or "").lower(), match.end()
+    if numbered:
+        match = _NUMBERED_HEADING.match(line)
+        if match:
+            return "question", match.group(1), "", match.end()
+    match = _SUBPART_HEADING.match(line) or _ITEM_LABEL.match(line)
+    if match:
+        return "subpart", None, match.group(1).lower(), match.end()
+    return None
+
+
+def _list_label(kind, style, count):
+    if kind == "question":
+        return str(count)
+    if style == "roman":
+        return _ROMAN_NUMERALS[count - 1] if count <= len(_ROMAN_NUMERALS) else str(count)
+    return chr(ord("a") + count - 1) if count <= 26 else str(count)
+
+
+def _list_heading(line, lists, in_question):
+    """
+    Heading of an \item in an auto-numbered question or subpart list, or None. `lists` is the stack
+    of open lists ([kind, style, items so far]) and is updated for the list boundaries on the line.
+    """
+    heading = None
+    item = _LIST_ITEM.match(line)
+    if item and lists and lists[-1][0]:
+        lists[-1][2] += 1
+        kind, style, count = lists[-1]
+        label = _list_label(kind, style, count)
+        heading = ("question", label, "", item.end()) if kind == "question" else ("subpart", None, label, item.end())
+    for boundary in _LIST_BOUNDARY.finditer(line):
+        action, environment, options = boundary.groups()
+        if action == "end":
+            if lists:
+                lists.pop()
+            continue
+        kind = style = None
+        subpart_label = _SUBPART_LIST_LABEL.search(options or "")
+        if environment == "enumerate" and _QUESTION_LIST_LABEL.search(options or ""):
+            kind = "question"
+        elif environment == "enumerate" and subpart_label and (in_question or any(l[0] == "question" for l in lists)):
+            kind, style = "subpart", subpart_label.group(1)
+        lists.append([kind, style, 0])
+    return heading
+
+
+def segment_document(latex: str, numbered=False):
+    """
+    Splits a LaTeX document (a question paper or an answer sheet) at its question and subpart
+    headings. Returns [(question_number, subpart, latex_fragment)] in document order; subpart
+    is "" for text that belongs to the question as a whole. Text before the first heading
+    (instructions, a preamble) is dropped. With numbered=True, "1." / "1)" lines also start
+    questions (safe on question papers, too loose for answers that contain numbered lists).
+    Items of an enumerate labelled "Q\arabic*" are questions, and items of an (\alph*) or
+    (\roman*) enumerate inside a question are its subparts; explicit headings take precedence.
+    """
+    segments = []
+    question, subpart, lines = None, "", []
+    lists = []
+
+    def flush():
+        fragment = "\n".join(lines).strip()
+        previous = None
+        while fragment != previous:  # The list a heading opens or closes is not part of the answer
+            previous, fragment = fragment, _LIST_EDGES.sub("", fragment).strip()
+        if question is not None and (subpart or plain_text(fragment)):
+            segments.append((question, subpart, fragment))
+
+    for line in _document_body(latex).splitlines():
+        list_heading = _list_heading(line, lists, question is not None)
+        heading = _heading(line, numbered) or list_heading
+        if heading and (heading[0] == "question" or question is not None):
+            flush()
+            kind, number, label, end = heading
+            if kind == "question":
+                question = normalize_question_number(number)
+            subpart = label
+            rest = re.sub(r"^[}\s]*(?:\\\\)?", "", line[end:]).strip()  # Closing brace and line break of the heading
+            lines = [rest] if rest else []
+        elif question is not None:
+            lines.append(line)
+    flush()
+    return segments
+
+
+def parse_question_index(question_text: str):
+    """
+    Parses OCRed question paper text (LaTeX or plain) into
+    {"questions": [{"number", "text", "marks", "subparts": [{"label", "text", "marks"}]}], "total_marks"}.
+    """
+    questions = {}
+    for number, label, fragment in segment_document(question_text or "", numbered=True):
+        question = questions.setdefault(number, {"number": number, "text": "", "marks": None, "subparts": []})
+        text = plain_text(fragment)
+        if label:
+            question["subparts"].append({"label": label, "text": text, "marks": _marks(text)})
+        else:
+            question["text"] = (question["text"] + " " + text).strip()
+            question["marks"] = question["marks"] if question["marks"] is not None else _marks(text)
+
+    index = list(questions.values())
+    for question in index:
+        if question["marks"] is None and question["subparts"] and all(s["marks"] is not None for s in question["subparts"]):
+            question["marks"] = sum(s["marks"] for s in question["subparts"])
+    marks = [question["marks"] for question in index]
+    total = sum(marks) if marks and all(m is not None for m in marks) else None
+    return {"questions": index, "total_marks": total}
+
+
+def get_question_index(question_text: str):
+    """The parsed index of a question paper, cached in memory and in the artifact cache ("questions")."""
+    key = cache_key(text_sha256(question_text or ""), QUESTION_INDEX_VERSION)
+    with _indexes_lock:
+        if key in _indexes:
+            return _indexes[key]
+    cache = get_cache()
+    index = cache.get_json("questions", key)
+    if index is None:
+        index = parse_question_index(question_text)
+        cache.put_json("questions", key, index)
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+def _marks_note(marks):
+    return f" [{marks} marks]" if marks is not None else ""
+
+
+def format_question_index(index) -> str:
+    """Compact text of the indexed questions for an extraction prompt."""
+    lines = []
+    for question in index["questions"]:
+        lines.append(f"Q{question['number']}{_marks_note(question['marks'])}: {question['text']}".rstrip(": "))
+        for subpart in question["subparts"]:
+            lines.append(f"  ({subpart['label']}){_marks_note(subpart['marks'])}: {subpart['text']}".rstrip(": "))
+    return "\n".join(lines)
+
+
+def index_covers(index, question_text: str) -> bool:
+    """
+    Whether the index has every question the paper mentions ("Question 3", "Q.4", ...). A heading
+    style the parser does not know would otherwise drop that question from the prompt silently.
+    """
+    indexed = {question["number"] for question in index["questions"]}
+    mentioned = {normalize_question_number(number) for number in _QUESTION_MENTION.findall(plain_text(question_text))}
+    return bool(indexed) and mentioned <= indexed
+
+
+def prompt_question_text(question_text: str) -> str:
+    """
+    What a prompt sends for the question paper: the compact index, or the full text if the index
+    misses any question the paper mentions (or none could be parsed).
+    """
+    if not question_text or not question_index_enabled():
+        return question_text
+    index = get_question_index(question_text)
+    return format_question_index(index) if index_covers(index, question_text) else question_text
+
+
+def segment_answers(latex: str):
+    """
+    Per-question answer records of a student's LaTeX answer sheet:
+    [{"question_number", "subpart", "latex"}], one per (question, subpart), in document order.
+    """
+    records = {}
+    for number, label, fragment in segment_document(latex):
+        fragment = re.sub(r"^\\textbf\{Answer:\}\s*(?:\\\\)?\s*", "", fragment)
+        record = records.setdefault((number, label), {"question_number": number, "subpart": label, "latex": ""})
+        record["latex"] = (record["latex"] + "\n" + fragment).strip()
+    return list(records.values())
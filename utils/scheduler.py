@@ -0,0 +1,232 @@
+#scheduler
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.metrics import registry
+
+# Lanes, served in this order: "interactive" (single-script previews) always goes ahead of "bulk"
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+DEFAULT_FLOW = "default"
+# Per-flow weights as "name=weight,..." (SCHEDULER_WEIGHTS env), matched against a session's name or ID;
+# a flow with weight 2 gets twice the share of a busy stage as a flow with weight 1
+DEFAULT_SCHEDULER_WEIGHTS = ""
+# Bulk work is refused (429) when the LLM backlog would keep it waiting longer than this (ADMISSION_MAX_WAIT env,
+# seconds, 0 disables admission control)
+DEFAULT_ADMISSION_MAX_WAIT = 1800
+# LLM requests expected per queued script, for the backlog estimate
+REQUESTS_PER_SCRIPT = 1
+
+_current_flow = contextvars.ContextVar("current_flow", default=(DEFAULT_FLOW, 1.0, BULK))
+
+
+class AdmissionError(Exception):
+    """Raised when new bulk work is refused; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message, retry_after=60):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def scheduling_context(flow: str, weight: float = 1.0, lane: str = BULK):
+    """
+    Schedules every stage slot taken inside the block (in this thread/context) as part of `flow`
+    with `weight`, in `lane`. Threads started with contextvars.copy_context() inherit it.
+    """
+    token = _current_flow.set((flow or DEFAULT_FLOW, max(weight, 0.01), lane if lane in LANES else BULK))
+    try:
+        yield
+    finally:
+        _current_flow.reset(token)
+
+
+def current_flow():
+    """(flow, weight, lane) of the current context."""
+    return _current_flow.get()
+
+
+def flow_weight(*names) -> float:
+    """Weight configured in SCHEDULER_WEIGHTS for the first of `names` (session name, ID, ...) listed there."""
+    weights = {}
+    for pair in os.getenv("SCHEDULER_WEIGHTS", DEFAULT_SCHEDULER_WEIGHTS).split(","):
+        name, _, value = pair.partition("=")
+        try:
+            weights[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return next((weights[name] for name in names if name in weights), 1.0)
+
+
+class FairQueue:
+    """
+    Weighted fair queue over flows (start-time fair queuing) with strict-priority lanes.
+
+    Each item gets a virtual start tag: the later of the queue's virtual time and the finish tag
+    of the previous item of its flow. Items are served lowest tag first within a lane, so every
+    backlogged flow gets a share proportional to its weight however many items it queued, and
+    a flow that was idle starts at the current virtual time instead of being owed a burst.
+    Not thread-safe on its own; callers hold their own lock.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags = {}  # flow -> finish tag of its last queued item
+        self._depths = {}  # (lane, flow) -> queued items
+
+    def push(self, item, flow: str = DEFAULT_FLOW, weight: float = 1.0, lane: str = BULK, cost: float = 1.0):
+        start = max(self._virtual_time, self._finish_tags.get(flow, 0.0))
+        self._finish_tags[flow] = start + cost / weight
+        heapq.heappush(self._heap, (LANES.index(lane), start, next(self._sequence), item, flow, lane, time.monotonic()))
+        self._depths[(lane, flow)] = self._depths.get((lane, flow), 0) + 1
+
+    def pop(self, lanes=LANES):
+        """(item, flow, lane, seconds queued) of the next item in one of `lanes`, or None."""
+        skipped, entry = [], None
+        while self._heap:
+            candidate = heapq.heappop(self._heap)
+            if candidate[5] in lanes:
+                entry = candidate
+                break
+            skipped.append(candidate)
+        for candidate in skipped:
+            heapq.heappush(self._heap, candidate)
+        if entry is None:
+            return None
+        _, start, _, item, flow, lane, queued_at = entry
+        self._virtual_time = max(self._virtual_time, start)
+        self._depths[(lane, flow)] -= 1
+        if not self._depths[(lane, flow)]:
+            del self._depths[(lane, flow)]
+        if not any(f == flow for _, f in self._depths):
+            self._finish_tags.pop(flow, None)  # An idle flow keeps no credit or debt
+        return item, flow, lane, time.monotonic() - queued_at
+
+    def __len__(self):
+        return len(self._heap)
+
+    def has(self, lanes=LANES) -> bool:
+        return any(lane in lanes for lane, _ in self._depths)
+
+    def depths(self):
+        """{"lanes": {lane: items}, "flows": {flow: items}} of what is waiting."""
+        lanes, flows = {lane: 0 for lane in LANES}, {}
+        for (lane, flow), depth in self._depths.items():
+            lanes[lane] += depth
+            flows[flow] = flows.get(flow, 0) + depth
+        return {"lanes": lanes, "flows": flows}
+
+
+class QueueStats:
+    """Served counts and wait times of one queue, per lane; waits also go to the /metrics histogram."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._lanes = {lane: {"served": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0} for lane in LANES}
+
+    def record(self, lane: str, waited: float):
+        registry.observe("scheduler_wait_seconds", waited, "Time spent queued before being served",
+                         queue=self.name, lane=lane)
+        with self._lock:
+            lane_stats = self._lanes[lane]
+            lane_stats["served"] += 1
+            lane_stats["wait_seconds_total"] += waited
+            lane_stats["wait_seconds_max"] = max(lane_stats["wait_seconds_max"], waited)
+
+    def snapshot(self):
+        with self._lock:
+            return {lane: dict(values, wait_seconds_avg=values["wait_seconds_total"] / values["served"]
+                               if values["served"] else 0.0)
+                    for lane, values in self._lanes.items()}
+
+
+class FairSlots:
+    """
+    At most `limit` holders at a time (like a semaphore), handed out to waiters in weighted fair
+    order of their flows, interactive lane first. A released slot goes straight to the next waiter.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_use = 0
+        self.stats = QueueStats(name)
+        self._queue = FairQueue()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        flow, weight, lane = current_flow()
+        with self._lock:
+            if self.in_use < self.limit and not len(self._queue):
+                self.in_use += 1
+                waiter = None
+            else:
+                waiter = threading.Event()
+                self._queue.push(waiter, flow, weight, lane)
+        if waiter is None:
+            self.stats.record(lane, 0.0)
+            return
+        waiter.wait()
+
+    def release(self):
+        with self._lock:
+            entry = self._queue.pop()
+            if entry is None:
+                self.in_use -= 1
+                return
+        waiter, _, lane, waited = entry
+        self.stats.record(lane, waited)
+        waiter.set()  # The slot passes to the waiter without being freed in between
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self):
+        with self._lock:
+            depths = self._queue.depths()
+            in_use = self.in_use
+        return {"limit": self.limit, "in_use": in_use, "queued": depths["lanes"], "queued_by_flow": depths["flows"],
+                "served": self.stats.snapshot()}
+
+
+def llm_backlog_seconds(pending_scripts: int) -> float:
+    """
+    Seconds the LLM request-rate limit needs to get through `pending_scripts` queued scripts,
+    plus the current wait for the next request. 0 when no rate limit is configured.
+    """
+    from utils.llm_client import get_llm_client
+
+    limiter = get_llm_client().request_limiter
+    if limiter.per_minute <= 0:
+        return 0.0
+    return limiter.wait_time(1) + pending_scripts * REQUESTS_PER_SCRIPT * 60.0 / limiter.per_minute
+
+
+def admit(pending_scripts: int, new_scripts: int, lane: str = BULK):
+    """
+    Admission control for new work. Interactive work is always admitted; bulk work is refused with
+    an AdmissionError once the scripts already queued would keep it waiting past ADMISSION_MAX_WAIT.
+    """
+    max_wait = float(os.getenv("ADMISSION_MAX_WAIT", DEFAULT_ADMISSION_MAX_WAIT))
+    if lane == INTERACTIVE or max_wait <= 0 or pending_scripts <= 0:
+        return
+    backlog = llm_backlog_seconds(pending_scripts)
+    if backlog > max_wait:
+        retry_after = int(backlog - max_wait) + 1
+        raise AdmissionError(f"The grading queue is full ({pending_scripts} scripts queued, about {backlog / 60:.0f} min "
+                             f"at the current model rate limit); {new_scripts} more cannot start within "
+                             f"{max_wait / 60:.0f} min. Try again later.", retry_after=retry_after)
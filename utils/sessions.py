@@ -0,0 +1,146 @@
+#sessions
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Everything a session owns lives under <STORAGE_ROOT>/sessions/<session_id>/. Point STORAGE_ROOT at
+# a volume shared by every host (NFS, EFS, ...) to serve sessions from several machines.
+DEFAULT_STORAGE_ROOT = "storage"
+DEFAULT_SESSION_TTL = 30 * 24 * 3600  # Sessions untouched for this long are removed (SESSION_TTL env, seconds)
+# Access refreshes a session's last-activity time at most this often, to spare writes to shared storage
+TOUCH_INTERVAL = 300
+SESSION_FILE = "session.json"
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SessionError(Exception):
+    """Raised for unknown or malformed session IDs; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=404):
+        super().__init__(message)
+        self.status = status
+
+
+class SessionStore:
+    """
+    Exam sessions kept as plain directories on (possibly shared) storage:
+
+        <root>/sessions/<session_id>/session.json   question text and metadata
+                                    /question/       question paper uploads
+                                    /students/       upload batches (see utils.uploads)
+                                    /outputs/        generated .tex and .pdf files
+
+    session.json is replaced atomically, so any worker process or host that mounts the same
+    root sees a consistent view without an in-process global.
+
+    A session expires SESSION_TTL seconds after its last activity (see last_active). `busy_sessions`,
+    if given, returns the IDs of sessions that own queued or running jobs; those never expire.
+    """
+
+    def __init__(self, root: str = None, ttl: int = None, busy_sessions=None):
+        self.root = os.path.abspath(os.path.join(root or os.getenv("STORAGE_ROOT", DEFAULT_STORAGE_ROOT), "sessions"))
+        self.ttl = ttl or int(os.getenv("SESSION_TTL", DEFAULT_SESSION_TTL))
+        self.busy_sessions = busy_sessions
+        os.makedirs(self.root, exist_ok=True)
+
+    def session_dir(self, session_id: str) -> str:
+        if not session_id or not SESSION_ID_PATTERN.match(session_id):
+            raise SessionError("Invalid session ID.", status=400)
+        return os.path.join(self.root, session_id)
+
+    def question_dir(self, session_id: str) -> str:
+        return os.path.join(self.session_dir(session_id), "question")
+
+    def students_dir(self, session_id: str) -> str:
+        return os.path.join(self.session_dir(session_id), "students")
+
+    def outputs_dir(self, session_id: str) -> str:
+        return os.path.join(self.session_dir(session_id), "outputs")
+
+    def session_ids(self):
+        """IDs of every session currently on disk."""
+        return [entry.name for entry in os.scandir(self.root)
+                if entry.is_dir() and SESSION_ID_PATTERN.match(entry.name)]
+
+    def _session_file(self, session_id):
+        return os.path.join(self.session_dir(session_id), SESSION_FILE)
+
+    def exists(self, session_id: str) -> bool:
+        return os.path.isfile(self._session_file(session_id))
+
+    def touch(self, session_id: str):
+        """Records activity on a session (bumps session.json's mtime, at most every TOUCH_INTERVAL seconds)."""
+        path = self._session_file(session_id)
+        try:
+            if os.stat(path).st_mtime < time.time() - TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def last_active(self, session_id: str) -> float:
+        """
+        Time of the latest activity on a session: the newest mtime of session.json (touched on access),
+        the session folder and its question/students/outputs folders (changed by uploads and outputs).
+        """
+        session_dir = self.session_dir(session_id)
+        paths = [session_dir, self._session_file(session_id), self.question_dir(session_id),
+                 self.students_dir(session_id), self.outputs_dir(session_id)]
+        latest = 0.0
+        for path in paths:
+            try:
+                latest = max(latest, os.stat(path).st_mtime)
+            except OSError:
+                continue
+        return latest
+
+    def expire(self, now: float = None):
+        """Removes sessions inactive for longer than the TTL, except those with queued or running jobs."""
+        cutoff = (now or time.time()) - self.ttl
+        busy = set(self.busy_sessions()) if self.busy_sessions else set()
+        removed = []
+        for session_id in self.session_ids():
+            if session_id in busy or self.last_active(session_id) >= cutoff:
+                continue
+            shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+            removed.append(session_id)
+        if removed:
+            print(f"🧹 Expired {len(removed)} inactive sessions")
+        return removed
+
+    def create(self, name: str = None, session_id: str = None) -> dict:
+        try:
+            self.expire()
+        except Exception as e:  # Housekeeping must never stop a new session
+            print(f"Warning: session expiry failed: {e}")
+        session_id = session_id or uuid.uuid4().hex
+        for path in (self.question_dir(session_id), self.students_dir(session_id), self.outputs_dir(session_id)):
+            os.makedirs(path, exist_ok=True)
+        now = time.time()
+        session = {"session_id": session_id, "name": name, "question_pdf": None, "question_sha256": None,
+                   "question_text": None, "created_at": now, "updated_at": now}
+        self._write(session_id, session)
+        return session
+
+    def get(self, session_id: str) -> dict:
+        if not self.exists(session_id):
+            raise SessionError("Unknown session.")
+        with open(self._session_file(session_id), "r", encoding="utf-8") as f:
+            session = json.load(f)
+        self.touch(session_id)
+        return session
+
+    def update(self, session_id: str, **fields) -> dict:
+        # Last writer wins; the fields are only ever replaced wholesale, never merged
+        session = self.get(session_id)
+        session.update(fields, updated_at=time.time())
+        self._write(session_id, session)
+        return session
+
+    def _write(self, session_id, session):
+        tmp_path = f"{self._session_file(session_id)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(session, f, indent=2)
+        os.replace(tmp_path, self._session_file(session_id))
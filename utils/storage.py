@@ -0,0 +1,183 @@
+#storage
+import os
+import shutil
+import threading
+import time
+
+from utils.checkpoints import CHECKPOINT_DIR, ScriptCheckpoint
+
+# Retention of scratch files under tmp/ (rendered page PNGs, ...): entries untouched for TMP_TTL
+# seconds are removed, and the oldest go first once tmp/ grows past TMP_MAX_BYTES.
+DEFAULT_TMP_DIR = "tmp"
+DEFAULT_TMP_TTL = 24 * 3600
+DEFAULT_TMP_MAX_BYTES = 1024 ** 3  # 1 GB
+# Kept by the tmp/ sweep: precompiled LaTeX formats are small and slow to rebuild
+TMP_KEEP = ("latex_formats",)
+# Disk a session may use (uploads and outputs) before further uploads are refused (SESSION_MAX_BYTES env, 0 = no limit)
+DEFAULT_SESSION_MAX_BYTES = 5 * 1024 ** 3  # 5 GB
+# Seconds between background sweeps (STORAGE_SWEEP_INTERVAL env, 0 disables the sweeper)
+DEFAULT_STORAGE_SWEEP_INTERVAL = 3600
+# pdflatex byproducts left in output folders by runs that compiled in place
+LATEX_BYPRODUCTS = (".aux", ".log", ".out", ".toc", ".fls", ".fdb_latexmk", ".synctex.gz")
+
+
+def directory_size(path: str) -> int:
+    """Bytes used by the files under `path` (hard-linked files are counted once)."""
+    total, seen = 0, set()
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+            total += st.st_size
+    return total
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+
+
+def sweep_tmp(root: str = None, ttl: float = None, max_bytes: int = None, keep=TMP_KEEP, now: float = None):
+    """
+    Applies the tmp/ retention policy: removes entries directly under `root` not modified for `ttl`
+    seconds, then the least recently modified ones until the rest fits in `max_bytes`.
+    Returns {"removed": [names], "freed_bytes", "size_bytes"}.
+    """
+    root = root or DEFAULT_TMP_DIR
+    ttl = ttl if ttl is not None else float(os.getenv("TMP_TTL", DEFAULT_TMP_TTL))
+    max_bytes = max_bytes if max_bytes is not None else int(os.getenv("TMP_MAX_BYTES", DEFAULT_TMP_MAX_BYTES))
+    cutoff = (now or time.time()) - ttl
+    if not os.path.isdir(root):
+        return {"removed": [], "freed_bytes": 0, "size_bytes": 0}
+
+    entries = []
+    for entry in os.scandir(root):
+        if entry.name in keep:
+            continue
+        try:
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+        except FileNotFoundError:
+            continue
+        size = directory_size(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat().st_size
+        entries.append((mtime, entry.name, entry.path, size))
+    entries.sort()  # Oldest first
+    total = sum(size for _, _, _, size in entries)
+
+    removed, freed = [], 0
+    for mtime, name, path, size in entries:
+        if mtime >= cutoff and total <= max_bytes:
+            break  # Everything left is recent enough and fits in the quota
+        try:
+            _remove(path)
+        except OSError as e:
+            print(f"Error removing {path}: {e}")
+            continue
+        removed.append(name)
+        freed += size
+        total -= size
+    return {"removed": removed, "freed_bytes": freed, "size_bytes": total}
+
+
+def remove_latex_byproducts(output_dir: str) -> int:
+    """Deletes stray .aux/.log/... files from an output folder; only the .tex and .pdf are served. Returns bytes freed."""
+    freed = 0
+    if not os.path.isdir(output_dir):
+        return 0
+    for entry in os.scandir(output_dir):
+        if entry.is_file() and entry.name.endswith(LATEX_BYPRODUCTS):
+            try:
+                freed += entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                pass
+    return freed
+
+
+def compact_outputs(output_dir: str, mode: str = None) -> int:
+    """
+    Compacts the checkpoint intermediates of every script in `output_dir` whose PDF is done
+    (see ScriptCheckpoint.compact). Scripts still running or that failed to compile are left alone.
+    Returns bytes freed.
+    """
+    checkpoints_root = os.path.join(output_dir, CHECKPOINT_DIR)
+    if not os.path.isdir(checkpoints_root):
+        return 0
+    freed = 0
+    for entry in os.scandir(checkpoints_root):
+        if not entry.is_dir():
+            continue
+        checkpoint = ScriptCheckpoint(output_dir, entry.name)
+        if checkpoint.info("pdf") is not None:
+            freed += checkpoint.compact(mode)
+    return freed
+
+
+def session_quota_bytes() -> int:
+    return int(os.getenv("SESSION_MAX_BYTES", DEFAULT_SESSION_MAX_BYTES))
+
+
+def over_quota(path: str, max_bytes: int = None):
+    """(size in bytes, limit) of `path` if it uses more than its quota (SESSION_MAX_BYTES), else None."""
+    max_bytes = max_bytes if max_bytes is not None else session_quota_bytes()
+    if max_bytes <= 0:
+        return None
+    size = directory_size(path)
+    return (size, max_bytes) if size > max_bytes else None
+
+
+def sweep_storage(output_dirs=(), tmp_root: str = None):
+    """One retention pass: tmp/ policy, then byproduct removal and compaction of every output folder."""
+    tmp = sweep_tmp(tmp_root)
+    freed = tmp["freed_bytes"]
+    for output_dir in output_dirs:
+        try:
+            freed += remove_latex_byproducts(output_dir) + compact_outputs(output_dir)
+        except OSError as e:
+            print(f"Error sweeping {output_dir}: {e}")
+    if freed:
+        print(f"🧹 Storage sweep freed {freed / 1024 ** 2:.1f} MB ({len(tmp['removed'])} tmp entries removed)")
+    return {"freed_bytes": freed, "tmp_removed": tmp["removed"], "tmp_size_bytes": tmp["size_bytes"]}
+
+
+class StorageSweeper:
+    """
+    Background thread running sweep_storage every `interval` seconds over the output folders
+    returned by `output_dirs()` (called on each pass, so new sessions are included).
+    """
+
+    def __init__(self, output_dirs, interval: float = None, tmp_root: str = None):
+        self.output_dirs = output_dirs
+        self.interval = interval if interval is not None else \
+            float(os.getenv("STORAGE_SWEEP_INTERVAL", DEFAULT_STORAGE_SWEEP_INTERVAL))
+        self.tmp_root = tmp_root
+        self.last_sweep = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sweep(self):
+        self.last_sweep = sweep_storage(self.output_dirs(), self.tmp_root)
+        return self.last_sweep
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:  # A failed pass must never stop later ones
+                print(f"Warning: storage sweep failed: {e}")
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-sweeper", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,218 @@
+#uploads
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process locks apply
+    fcntl = None
+
+# Upload batches older than this are removed (UPLOAD_BATCH_TTL env, seconds)
+DEFAULT_BATCH_TTL = 7 * 24 * 3600
+STREAM_CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+PART_SUFFIX = ".part"
+LOCK_DIR = ".locks"  # Per-batch lock files, so writers in other processes or hosts exclude each other
+
+
+class UploadError(Exception):
+    """Raised for invalid upload requests; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, received=None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def _safe_relative_path(relative_path: str) -> str:
+    # Keep webkitdirectory sub-folders but never let a path escape the batch directory
+    parts = [p for p in relative_path.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    if not parts or parts == [MANIFEST_NAME] or parts[0] == LOCK_DIR or parts[-1].endswith(PART_SUFFIX):
+        raise UploadError("Invalid file path.")
+    return os.path.join(*parts)
+
+
+class UploadBatches:
+    """
+    Per-batch upload directories under `root` (<root>/<batch_id>/...), filled by streaming
+    chunked, resumable writes straight to disk.
+
+    Each file is written to "<name>.part" while it arrives and hashed (SHA-256) as it streams;
+    when the last byte lands it is renamed into place and recorded in the batch manifest.
+    Chunks of one file and manifest updates are serialised by a lock file under <batch>/.locks/
+    (plus an in-process lock, as threads of one process do not exclude each other through it).
+    Batches that have not been touched for `ttl` seconds are expired instead of wiping
+    the upload folder on every request.
+    """
+
+    def __init__(self, root: str, ttl: int = None):
+        self.root = root
+        self.ttl = ttl or int(os.getenv("UPLOAD_BATCH_TTL", DEFAULT_BATCH_TTL))
+        self._lock = threading.Lock()
+        self._hashers = {}  # (batch_id, relative_path) -> (bytes hashed, sha256 object)
+        self._thread_locks = {}  # lock file path -> threading.Lock
+        os.makedirs(root, exist_ok=True)
+
+    def batch_dir(self, batch_id: str) -> str:
+        if not batch_id or os.path.basename(batch_id) != batch_id or batch_id.startswith("."):
+            raise UploadError("Invalid batch ID.")
+        return os.path.join(self.root, batch_id)
+
+    @contextmanager
+    def _locked(self, batch_id: str, name: str):
+        """Holds the batch lock `name` (a file or the manifest) against other threads, processes and hosts."""
+        lock_dir = os.path.join(self.batch_dir(batch_id), LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_path = os.path.join(lock_dir, hashlib.sha256(name.encode("utf-8")).hexdigest())
+        with self._lock:
+            thread_lock = self._thread_locks.setdefault(lock_path, threading.Lock())
+        with thread_lock, open(lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+            yield
+
+    def create_batch(self, metadata: dict = None, batch_id: str = None) -> str:
+        self.expire()
+        batch_id = batch_id or uuid.uuid4().hex
+        os.makedirs(self.batch_dir(batch_id), exist_ok=True)
+        self._write_manifest(batch_id, {"created_at": time.time(), "metadata": metadata or {}, "files": {}})
+        return batch_id
+
+    def exists(self, batch_id: str) -> bool:
+        return os.path.isfile(os.path.join(self.batch_dir(batch_id), MANIFEST_NAME))
+
+    def _manifest_path(self, batch_id):
+        return os.path.join(self.batch_dir(batch_id), MANIFEST_NAME)
+
+    def _write_manifest(self, batch_id, manifest):
+        tmp_path = self._manifest_path(batch_id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path(batch_id))
+
+    def manifest(self, batch_id: str) -> dict:
+        if not self.exists(batch_id):
+            raise UploadError("Unknown batch.", status=404)
+        with open(self._manifest_path(batch_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def update_file(self, batch_id: str, relative_path: str, **fields):
+        # Read-modify-write of the manifest, under the batch's manifest lock
+        with self._locked(batch_id, MANIFEST_NAME):
+            manifest = self.manifest(batch_id)
+            manifest["files"].setdefault(relative_path, {}).update(fields)
+            self._write_manifest(batch_id, manifest)
+
+    def file_path(self, batch_id: str, relative_path: str) -> str:
+        return os.path.join(self.batch_dir(batch_id), _safe_relative_path(relative_path))
+
+    def received_bytes(self, batch_id: str, relative_path: str) -> int:
+        """Bytes received so far for a file (its full size once complete), so clients can resume."""
+        path = self.file_path(batch_id, relative_path)
+        for candidate in (path, path + PART_SUFFIX):
+            if os.path.exists(candidate):
+                return os.path.getsize(candidate)
+        return 0
+
+    def write_chunk(self, batch_id: str, relative_path: str, stream, offset: int, total: int):
+        """
+        Streams one chunk from `stream` to disk at `offset`.
+
+        Returns (received_bytes, sha256 or None); the hash is only returned once the file is
+        complete (received_bytes == total), at which point it is renamed into place.
+        """
+        if not self.exists(batch_id):
+            raise UploadError("Unknown batch.", status=404)
+        relative_path = _safe_relative_path(relative_path)
+        with self._locked(batch_id, relative_path):
+            return self._write_chunk(batch_id, relative_path, stream, offset, total)
+
+    def _write_chunk(self, batch_id, relative_path, stream, offset, total):
+        final_path = self.file_path(batch_id, relative_path)
+        part_path = final_path + PART_SUFFIX
+        received = self.received_bytes(batch_id, relative_path)
+        if os.path.exists(final_path):
+            raise UploadError("File already uploaded.", status=409, received=received)
+        if offset != received:
+            raise UploadError(f"Expected offset {received}.", status=409, received=received)
+
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        key = (batch_id, relative_path)
+        with self._lock:
+            hashed, hasher = self._hashers.pop(key, (0, None))
+        if hasher is None or hashed != offset:
+            # Resumed on another worker or after a restart: re-hash what is already on disk
+            hasher = hashlib.sha256()
+            if offset:
+                with open(part_path, "rb") as f:
+                    for block in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                        hasher.update(block)
+
+        start = offset
+        with open(part_path, "r+b" if offset else "wb") as f:
+            f.seek(start)
+            while True:
+                block = stream.read(STREAM_CHUNK_SIZE)
+                if not block:
+                    break
+                if offset + len(block) > total:
+                    # Rejected chunks leave nothing behind, so the client can resend from `start`
+                    f.truncate(start)
+                    raise UploadError("Chunk runs past the declared file size.", received=start)
+                f.write(block)
+                hasher.update(block)
+                offset += len(block)
+
+        if offset < total:
+            with self._lock:
+                self._hashers[key] = (offset, hasher)
+            return offset, None
+
+        os.replace(part_path, final_path)
+        sha256 = hasher.hexdigest()
+        self.update_file(batch_id, relative_path, size=total, sha256=sha256, completed_at=time.time())
+        return offset, sha256
+
+    def save_file(self, batch_id: str, relative_path: str, file_storage):
+        """Saves a whole multipart upload into the batch, hashing it on the way. Returns (path, sha256)."""
+        path = self.file_path(batch_id, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, "wb") as f:
+            for block in iter(lambda: file_storage.stream.read(STREAM_CHUNK_SIZE), b""):
+                f.write(block)
+                hasher.update(block)
+                size += len(block)
+        sha256 = hasher.hexdigest()
+        self.update_file(batch_id, _safe_relative_path(relative_path), size=size, sha256=sha256,
+                         completed_at=time.time())
+        return path, sha256
+
+    def expire(self, now: float = None):
+        """Removes batch directories (and stray files) not modified for longer than the TTL."""
+        return expire_entries(self.root, self.ttl, now)
+
+
+def expire_entries(root: str, ttl: float, now: float = None):
+    """Removes the files and directories directly under `root` not modified in the last `ttl` seconds."""
+    cutoff = (now or time.time()) - ttl
+    removed = []
+    for entry in os.scandir(root):
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+            removed.append(entry.name)
+        except OSError as e:
+            print(f"Error expiring upload {entry.path}: {e}")
+    return removed